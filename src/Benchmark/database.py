@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for reading from, and writing to the database. They need a (local) PostgreSQL database with the regions of
+interest in it, as given in Database.database_definition.bind.
+Run as 'python -m Benchmark.database' from the source folder.
+"""
+from __future__ import print_function, division
+
+__author__ = 'Sindre Nistad'
+
+import numpy as np
+
+from Benchmark.regions_of_interest import _time
+from Database.connector import connect, get_point, query_to_point_list, _get_description, \
+    get_nearest_neighbor_to_points, get_sample, get_spectra, execute_prepared, prepare
+from Database.database_definition import db, ensure_indexes, drop_indexes
+from Database.helpers import select_sql_point, nearest_neighbor_sql
+from Database.session import session, get_counters, reset_counters
+
+
+@session
+def benchmark_spectrum_fetch(number_of_points=50000, repeat=1):
+    """
+        Compares getting the spectrum of each point with its own query (the N + 1 pattern), with getting all the
+        spectra in one go (see Database.connector.get_spectra), and checks that the points are the same.
+    :param number_of_points:    The number of points to get. Default is 50 000.
+    :param repeat:              The number of times each variant is run. The best time is reported.
+    :type number_of_points:     int
+    :type repeat:               int
+    :return:                    The time of the queries per point, and of the bulk query, in seconds.
+    :rtype:                     float, float
+    """
+    connect()
+    sql = "SELECT id, long_lat FROM point ORDER BY id LIMIT " + str(number_of_points) + ";"
+
+    def per_point():
+        query = db.execute(sql)
+        description = _get_description(query.description)
+        return [get_point(point_tuple, description) for point_tuple in query.fetchall()]
+
+    per_point_time, per_point_result = _time(per_point, repeat)
+    bulk_time, bulk_result = _time(lambda: query_to_point_list(db.execute(sql)), repeat)
+
+    assert len(per_point_result) == len(bulk_result)
+    for per_point_point, bulk_point in zip(per_point_result, bulk_result):
+        assert per_point_point.identity == bulk_point.identity
+        assert np.allclose(per_point_point.bands, bulk_point.bands)
+
+    print("Fetched the spectra of " + str(len(bulk_result)) + " points")
+    print("One query per point: " + str(per_point_time) + " s")
+    print("Bulk:                " + str(bulk_time) + " s")
+    print("Speedup:             " + str(per_point_time / bulk_time))
+    return per_point_time, bulk_time
+
+
+@session
+def benchmark_nearest_neighbors(number_of_points=1000, k=8, repeat=1):
+    """
+        Compares getting the k nearest neighbors of each point with its own query (and the spectra of the neighbors
+        with one query each), with getting the neighbors, and their spectra, of all the points in one query (see
+        Database.connector.get_nearest_neighbor_to_points), and checks that the neighborhoods are the same.
+    :param number_of_points:    The number of points whose neighbors we get. Default is 1000.
+    :param k:                   The number of neighbors of each point. Default is 8.
+    :param repeat:              The number of times each variant is run. The best time is reported.
+    :type number_of_points:     int
+    :type k:                    int
+    :type repeat:               int
+    :return:                    The time of the queries per point, and of the batched query, in seconds.
+    :rtype:                     float, float
+    """
+    connect()
+    sql = "SELECT id, long_lat FROM point ORDER BY id LIMIT " + str(number_of_points) + ";"
+    points = query_to_point_list(db.execute(sql))
+
+    def per_point():
+        neighborhoods = []
+        for point in points:
+            order_by_sql, params = nearest_neighbor_sql(point.longitude, point.latitude, k)
+            query = db.execute(select_sql_point(3) + order_by_sql + ";", params)
+            description = _get_description(query.description)
+            neighborhood = [get_point(point_tuple, description) for point_tuple in query.fetchall()]
+            neighborhood.sort()
+            neighborhoods.append(neighborhood)
+        return neighborhoods
+
+    per_point_time, per_point_result = _time(per_point, repeat)
+    batched_time, batched_result = _time(lambda: get_nearest_neighbor_to_points(points, k, "", ignore_dataset=True),
+                                         repeat)
+
+    for per_point_neighborhood, batched_neighborhood in zip(per_point_result, batched_result):
+        assert [point.identity for point in per_point_neighborhood] == \
+               [point.identity for point in batched_neighborhood]
+        for per_point_point, batched_point in zip(per_point_neighborhood, batched_neighborhood):
+            assert np.allclose(per_point_point.bands, batched_point.bands)
+
+    print("Found the " + str(k) + " nearest neighbors of " + str(len(points)) + " points")
+    print("One query per point:     " + str(per_point_time) + " s")
+    print("Batched:                 " + str(batched_time) + " s")
+    print("Speedup:                 " + str(per_point_time / batched_time))
+    return per_point_time, batched_time
+
+
+def benchmark_indexes(number_of_samples=10000, number_of_points=1000, k=8, repeat=1):
+    """
+        Compares getting a sample of a region (see Database.connector.get_sample), and the k nearest neighbors of
+        some points, without, and with the secondary indices (see Database.database_definition.ensure_indexes).
+        NB: The indices are dropped, and created again!
+    :param number_of_samples:   The number of points in the sample. Default is 10 000.
+    :param number_of_points:    The number of points whose neighbors we get. Default is 1000.
+    :param k:                   The number of neighbors of each point. Default is 8.
+    :param repeat:              The number of times each variant is run. The best time is reported.
+    :type number_of_samples:    int
+    :type number_of_points:     int
+    :type k:                    int
+    :type repeat:               int
+    :return:                    The time of the sample, and of the neighbors, without, and with the indices, in seconds.
+    :rtype:                     dict of [str, (float, float)]
+    """
+    connect()
+    with session("benchmark_indexes"):
+        region = db.select("SELECT name FROM region LIMIT 1;")[0]
+        points = query_to_point_list(db.execute("SELECT id, long_lat FROM point ORDER BY id LIMIT " +
+                                                str(number_of_points) + ";"))
+
+    def sample():
+        return get_sample(region, "", number_of_samples)
+
+    def neighbors():
+        return get_nearest_neighbor_to_points(points, k, "", ignore_dataset=True)
+
+    drop_indexes()
+    sample_before, _ = _time(sample, repeat)
+    neighbors_before, _ = _time(neighbors, repeat)
+    sizes = ensure_indexes(debug=True)
+    sample_after, _ = _time(sample, repeat)
+    neighbors_after, _ = _time(neighbors, repeat)
+
+    print("Total size of the indices: " + str(sum(sizes.values()) / 1024 ** 2) + " MB")
+    print("Sample of " + str(number_of_samples) + " points from '" + region + "'")
+    print("    Without indices:     " + str(sample_before) + " s")
+    print("    With indices:        " + str(sample_after) + " s")
+    print("The " + str(k) + " nearest neighbors of " + str(len(points)) + " points")
+    print("    Without indices:     " + str(neighbors_before) + " s")
+    print("    With indices:        " + str(neighbors_after) + " s")
+    return {'sample': (sample_before, sample_after), 'neighbors': (neighbors_before, neighbors_after)}
+
+
+def benchmark_sessions(number_of_points=1000, repeat=1):
+    """
+        Compares getting the spectra of points one at the time, where each call opens its own session, with doing the
+        same in a single session that every call reuses (see Database.session), and reports the number of sessions,
+        and transactions of each.
+    :param number_of_points:    The number of points. Default is 1000.
+    :param repeat:              The number of times each variant is run. The best time is reported.
+    :type number_of_points:     int
+    :type repeat:               int
+    :return:                    The time with a session per call, and with a single session, in seconds.
+    :rtype:                     float, float
+    """
+    connect()
+    with session("benchmark_sessions"):
+        point_ids = db.select("SELECT id FROM point ORDER BY id LIMIT " + str(number_of_points) + ";")
+
+    def per_call():
+        return [get_spectra([point_id]) for point_id in point_ids]
+
+    def single():
+        with session("single"):
+            return per_call()
+
+    reset_counters()
+    per_call_time, _ = _time(per_call, repeat)
+    per_call_counters = get_counters("get_spectra")
+    single_time, _ = _time(single, repeat)
+    single_counters = get_counters("single")
+
+    print("Got the spectra of " + str(len(point_ids)) + " points, one at the time")
+    print("A session per call:  " + str(per_call_time) + " s, " + str(per_call_counters['sessions']) +
+          " sessions, " + str(per_call_counters['transactions']) + " transactions")
+    print("A single session:    " + str(single_time) + " s, " + str(single_counters['sessions']) +
+          " sessions, " + str(single_counters['transactions']) + " transactions")
+    return per_call_time, single_time
+
+
+def _inline(sql, params):
+    """
+        Puts the (numeric) values of the parameters into the query, as the queries were written before they had
+        parameters.
+    """
+    for name in sorted(params.keys(), key=len, reverse=True):
+        sql = sql.replace("$" + name, repr(params[name]))
+    return sql
+
+
+@session
+def benchmark_prepared_statements(number_of_calls=10000, k=8, explained=100):
+    """
+        Compares finding the k nearest neighbors of a point with a query that has the values written into it (so that
+        it is planned every time), with a parameterized query, and with a prepared statement (see
+        Database.connector.execute_prepared), and compares the time PostgreSQL spends planning, and executing the
+        queries, as reported by EXPLAIN ANALYZE.
+    :param number_of_calls: The number of queries of each variant. Default is 10 000.
+    :param k:               The number of neighbors of each point. Default is 8.
+    :param explained:       The number of queries of each variant that are explained. Default is 100.
+    :type number_of_calls:  int
+    :type k:                int
+    :type explained:        int
+    :return:                The time of the literal, parameterized, and prepared queries, in seconds.
+    :rtype:                 float, float, float
+    """
+    connect()
+    points = query_to_point_list(db.execute("SELECT id, long_lat FROM point ORDER BY id LIMIT " +
+                                            str(number_of_calls) + ";"))
+    queries = []
+    for i in range(number_of_calls):
+        point = points[i % len(points)]
+        order_by_sql, params = nearest_neighbor_sql(point.longitude, point.latitude, k)
+        queries.append((select_sql_point(3) + order_by_sql + ";", params))
+
+    literal_time, _ = _time(lambda: [db.execute(_inline(sql, params)).fetchall() for sql, params in queries], 1)
+    parameterized_time, _ = _time(lambda: [db.execute(sql, params).fetchall() for sql, params in queries], 1)
+    prepared_time, _ = _time(lambda: [execute_prepared(sql, params).fetchall() for sql, params in queries], 1)
+
+    cursor = db.get_connection().cursor()
+    literal_plans = []
+    prepared_plans = []
+    for sql, params in queries[:explained]:
+        cursor.execute("EXPLAIN (ANALYZE, FORMAT JSON) " + _inline(sql, params).rstrip(';'))
+        literal_plans.append(cursor.fetchone()[0][0])
+        name, names = prepare(sql)
+        cursor.execute("EXPLAIN (ANALYZE, FORMAT JSON) EXECUTE " + name + " (" + ", ".join(["%s"] * len(names)) + ")",
+                       [params[param] for param in names])
+        prepared_plans.append(cursor.fetchone()[0][0])
+
+    print(str(number_of_calls) + " queries of the " + str(k) + " nearest neighbors of a point")
+    print("Literal values:      " + str(literal_time) + " s")
+    print("Parameterized:       " + str(parameterized_time) + " s")
+    print("Prepared:            " + str(prepared_time) + " s")
+    for name, plans in (("Literal values", literal_plans), ("Prepared", prepared_plans)):
+        planning = sum([plan['Planning Time'] for plan in plans]) / len(plans)
+        execution = sum([plan['Execution Time'] for plan in plans]) / len(plans)
+        print(name + ":" + " " * (20 - len(name)) + "planning " + str(planning) + " ms, execution " +
+              str(execution) + " ms per query")
+    return literal_time, parameterized_time, prepared_time
+
+
+if __name__ == '__main__':
+    benchmark_spectrum_fetch()
+    benchmark_nearest_neighbors()
+    benchmark_indexes()
+    benchmark_sessions()
+    benchmark_prepared_statements()
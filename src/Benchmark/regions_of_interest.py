@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for reading, and handling the regions of interest from the ASCII ROI files.
+Run as 'python -m Benchmark.regions_of_interest path/to/roi_file.txt' from the source folder to benchmark the parser, and
+the neighborhood extraction, or without a path to benchmark loading all the files in
+RegionOfInterest.export.get_file_list in parallel, and the memory of the points.
+"""
+from __future__ import print_function, division
+
+__author__ = 'Sindre Nistad'
+
+import sys
+from timeit import default_timer
+
+import numpy as np
+
+from Common.common import get_neighborhoods
+from Common.data_management import read_data_from_file, convert_to_single_dict
+from Common.spatial import morton_order, hilbert_order
+from RegionOfInterest.region import Point
+
+
+def _time(function, repeat=3):
+    """
+        Runs the given function 'repeat' times, and returns the best time, and the result of the last run.
+    :param function:    The function to be timed. Takes no arguments.
+    :param repeat:      The number of times the function is to be run.
+    :type function:     function
+    :type repeat:       int
+    :return:            The best time (in seconds), and the result of the function.
+    :rtype:             float, object
+    """
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = default_timer()
+        result = function()
+        best = min(best, default_timer() - start)
+    return best, result
+
+
+def benchmark_parser(path, repeat=3):
+    """
+        Compares the line-by-line parser with the bulk (NumPy) parser of the ROI files, and checks that the results
+        are the same.
+    :param path:    The path to the ASCII ROI file.
+    :param repeat:  The number of times each parser is run. The best time is reported.
+    :type path:     str
+    :type repeat:   int
+    :return:        The time of the line-by-line parser, and the time of the bulk parser, in seconds.
+    :rtype:         float, float
+    """
+    line_time, line_result = _time(lambda: read_data_from_file(path), repeat)
+    bulk_time, bulk_result = _time(lambda: read_data_from_file(path, bulk=True), repeat)
+
+    assert line_result['num_bands'] == bulk_result['num_bands']
+    line_rois = convert_to_single_dict(line_result['rois'])
+    bulk_rois = convert_to_single_dict(bulk_result['rois'])
+    assert sorted(line_rois.keys()) == sorted(bulk_rois.keys())
+    num_points = 0
+    for key in line_rois.keys():
+        for line_point, bulk_point in zip(line_rois[key].points, bulk_rois[key].points):
+            assert list(line_point.bands) == list(bulk_point.bands)
+            assert (line_point.X, line_point.Y, line_point.latitude, line_point.longitude) == \
+                   (bulk_point.X, bulk_point.Y, bulk_point.latitude, bulk_point.longitude)
+            num_points += 1
+
+    print("Parsed " + str(num_points) + " points with " + str(bulk_result['num_bands']) + " bands")
+    print("Line by line:    " + str(line_time) + " s")
+    print("Bulk (NumPy):    " + str(bulk_time) + " s")
+    print("Speedup:         " + str(line_time / bulk_time))
+    return line_time, bulk_time
+
+
+def benchmark_parallel_loading(workers=None, repeat=1):
+    """
+        Compares reading, and normalizing all the files given by RegionOfInterest.export.get_file_list one after
+        another, and in a pool of processes.
+    :param workers: The number of processes to use. Default is one per file, or the number of CPUs if that is smaller.
+    :param repeat:  The number of times each variant is run. The best time is reported.
+    :type workers:  int
+    :type repeat:   int
+    :return:        The time of the sequential, and of the parallel loading, in seconds.
+    :rtype:         float, float
+    """
+    from multiprocessing import cpu_count
+    from RegionOfInterest.export import get_all_rois, get_file_list
+
+    if workers is None:
+        workers = min(len(get_file_list()), cpu_count())
+    sequential_time, sequential = _time(lambda: get_all_rois(read_data=True), repeat)
+    parallel_time, parallel = _time(lambda: get_all_rois(read_data=True, workers=workers), repeat)
+    for sequential_roi, parallel_roi in zip(sequential, parallel):
+        assert sequential_roi.bands.shape == parallel_roi.bands.shape
+
+    print("Loaded " + str(sum([roi.bands.shape[0] for roi in parallel])) + " points from " +
+          str(len(parallel)) + " files")
+    print("Sequential:              " + str(sequential_time) + " s")
+    print("Parallel (" + str(workers) + " workers):   " + str(parallel_time) + " s")
+    print("Speedup:                 " + str(sequential_time / parallel_time))
+    return sequential_time, parallel_time
+
+
+def benchmark_neighborhoods(path, num_neighbors=5, repeat=3, seed=0):
+    """
+        Compares extracting the neighborhoods of every point of the largest region in the file when the points are in a
+        random order, and when they are sorted lexicographically, along a Z-order curve, and along a Hilbert curve, and
+        compares the first sort of a region with switching back to a sort mode that has already been computed.
+    :param path:            The path to the ASCII ROI file.
+    :param num_neighbors:   The diameter of the neighborhoods. Default is 5.
+    :param repeat:          The number of times each variant is run. The best time is reported.
+    :param seed:            The seed of the random order.
+    :type path:             str
+    :type num_neighbors:    int
+    :type repeat:           int
+    :type seed:             int
+    :return:                The time of each order, in seconds.
+    :rtype:                 dict of [str, float]
+    """
+    from RegionOfInterest.regions_of_interest import RegionsOfInterest
+
+    roi = max(RegionsOfInterest(path).get_all(), key=len)
+    # Random order, as the points would be after e.g. merging, or sampling
+    shuffle = np.random.RandomState(seed).permutation(len(roi))
+    x = roi.get_location('X')[shuffle]
+    y = roi.get_location('Y')[shuffle]
+    bands = np.ascontiguousarray(roi.get_band_matrix()[shuffle])
+    orders = [('random', np.arange(len(x))),
+              ('x-y', np.lexsort((y, x))),
+              ('morton', morton_order(x, y)),
+              ('hilbert', hilbert_order(x, y))]
+    times = {}
+    print("Neighborhoods of " + str(len(x)) + " points with " + str(bands.shape[1]) + " bands, size " +
+          str(num_neighbors) + " x " + str(num_neighbors))
+    for name, order in orders:
+        sorted_x, sorted_y, sorted_bands = x[order], y[order], np.ascontiguousarray(bands[order])
+        times[name], _ = _time(lambda: get_neighborhoods(sorted_x, sorted_y, sorted_bands, num_neighbors), repeat)
+        print(name + ":" + " " * (16 - len(name)) + str(times[name]) + " s")
+
+    first_time, _ = _time(lambda: roi.sort('hilbert'), 1)
+    roi.sort('x-y')
+    cached_time, _ = _time(lambda: roi.sort('hilbert'), 1)
+    print("First Hilbert sort:     " + str(first_time) + " s")
+    print("Cached Hilbert sort:    " + str(cached_time) + " s")
+    return times
+
+
+class _DictPoint(object):
+    """
+    A point as it was before Point had slots; the attributes are in a __dict__, and the bands are a list.
+    """
+
+    def __init__(self, identity, x, y, map_x, map_y, latitude, longitude, bands, name="", sub_name="",
+                 region_id=-1, dataset_id=-1):
+        self.identity = int(identity)
+        self.latitude = latitude
+        self.longitude = longitude
+        self.bands = bands
+        self.region_id = region_id
+        self.dataset_id = dataset_id
+        self.X = int(x)
+        self.Y = int(y)
+        self.map_X = map_x
+        self.map_Y = map_y
+        self.name = name
+        self.sub_name = sub_name
+
+
+def _measure(function):
+    """
+        Measures the memory that is allocated (and still in use) by the given function, with tracemalloc, which is
+        not available on Python 2, in which case the memory is not measured.
+    :param function:    The function to be measured. Takes no arguments.
+    :type function:     function
+    :return:            The number of bytes (None if it could not be measured), and the result of the function.
+    :rtype:             int | None, object
+    """
+    try:
+        import tracemalloc
+    except ImportError:
+        return None, function()
+    tracemalloc.start()
+    try:
+        result = function()
+        size = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return size, result
+
+
+def benchmark_point_memory(num_points=100000, num_bands=178, seed=0):
+    """
+        Compares the memory of the points when they have a __dict__, and a list of bands, with the memory of the
+        (slotted) Point objects with bands that are views into a single band matrix.
+    :param num_points:  The number of points. Default is 100 000.
+    :param num_bands:   The number of bands of each point. Default is 178 (AVIRIS).
+    :param seed:        The seed of the random bands.
+    :type num_points:   int
+    :type num_bands:    int
+    :type seed:         int
+    :return:            The number of bytes per point before, and after, or None if they could not be measured.
+    :rtype:             float | None, float | None
+    """
+    values = np.random.RandomState(seed).random_sample((num_points, num_bands))
+    raw_size = values.itemsize * num_bands
+
+    def dict_points():
+        # Each point has its own list of (boxed) floats, as when the points were parsed, or fetched from the database
+        return [_DictPoint(i, i % 512, i // 512, 0.5 * i, 0.5 * i, 34.0, -119.0, values[i].tolist())
+                for i in range(num_points)]
+
+    def slotted_points():
+        bands = values.copy()
+        return [Point(i, i % 512, i // 512, 0.5 * i, 0.5 * i, 34.0, -119.0, bands[i]) for i in range(num_points)]
+
+    before, _ = _measure(dict_points)
+    after, _ = _measure(slotted_points)
+    if before is None or after is None:
+        print("The memory of the points can not be measured without tracemalloc (Python 3.4, or newer)")
+        return None, None
+    before /= num_points
+    after /= num_points
+    print(str(num_points) + " points with " + str(num_bands) + " bands (" + str(raw_size) + " bytes of bands each)")
+    print("__dict__, and list:      " + str(before) + " bytes per point, " + str(before - raw_size) + " overhead")
+    print("Slots, and matrix view:  " + str(after) + " bytes per point, " + str(after - raw_size) + " overhead")
+    return before, after
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        benchmark_parser(sys.argv[1])
+        benchmark_neighborhoods(sys.argv[1])
+    else:
+        benchmark_parallel_loading()
+        benchmark_point_memory()
@@ -4,9 +4,12 @@
 """
 __author__ = 'Sindre Nistad'
 
+from gzip import open as gzip_open
+from sys import version_info
 from re import split as regex_split
 from ast import literal_eval
 
+import numpy as np
 import matplotlib.pylab as plt
 from matplotlib import figure
 
@@ -144,6 +147,7 @@ def get_neighbors(point, point_list, num_neighbors, use_list=False):
     :rtype:                 list[list[Point]] or list[Point]
     :return:                Matrix of Points corresponding to the neighborhood. Some of the points ma
     """
+    # NB: This goes through every point in the region. Use get_neighborhoods for the neighborhoods of many points.
     if not use_list:
         points = [[None for _ in range(num_neighbors)] for _ in range(num_neighbors)]
     else:
@@ -165,6 +169,57 @@ def get_neighbors(point, point_list, num_neighbors, use_list=False):
     return points
 
 
+def get_neighborhoods(x, y, bands, num_neighbors, indices=None):
+    """
+        Gets the bands of the num_neighbors * num_neighbors neighborhood (in the image) of each of the given points, all
+        at once. The points are indexed by a sorted key of their image coordinates, so that the neighbors are found by
+        binary search, instead of going through every point for every neighborhood.
+        The neighbors are in the same order as in get_neighbors (with use_list=True), i.e. row by row in Y.
+    :param x:               The X (image) coordinate of each point.
+    :param y:               The Y (image) coordinate of each point.
+    :param bands:           The (number of points, number of bands) matrix of the bands of the points.
+    :param num_neighbors:   The diameter of the neighborhood.
+    :param indices:         The indices of the points to get the neighborhoods of. Default is None; every point.
+    :type x:                np.ndarray
+    :type y:                np.ndarray
+    :type bands:            np.ndarray
+    :type num_neighbors:    int
+    :type indices:          np.ndarray
+    :return:                The (number of points, num_neighbors ** 2, number of bands) array of the bands of the
+                            neighbors, which are 0 where there is no point in the region, and a
+                            (number of points, num_neighbors ** 2) mask that is True where there is.
+    :rtype:                 (np.ndarray, np.ndarray)
+    """
+    x = np.asarray(x).astype(np.int64)
+    y = np.asarray(y).astype(np.int64)
+    bands = np.asarray(bands)
+    if indices is None:
+        indices = np.arange(len(x))
+    keys = _grid_keys(x, y)
+    order = np.argsort(keys, kind='mergesort')
+    sorted_keys = keys[order]
+
+    offsets = np.arange(num_neighbors) - int(num_neighbors / 2)
+    offsets_y, offsets_x = np.meshgrid(offsets, offsets, indexing='ij')
+    neighbor_keys = _grid_keys(x[indices][:, np.newaxis] + offsets_x.ravel(),
+                               y[indices][:, np.newaxis] + offsets_y.ravel())
+    positions = np.minimum(np.searchsorted(sorted_keys, neighbor_keys), max(len(sorted_keys) - 1, 0))
+    if len(sorted_keys) > 0:
+        mask = sorted_keys[positions] == neighbor_keys
+    else:
+        mask = np.zeros(neighbor_keys.shape, dtype=bool)
+    neighborhoods = np.zeros((len(indices), num_neighbors ** 2, bands.shape[1]), dtype=bands.dtype)
+    neighborhoods[mask] = bands[order[positions[mask]]]
+    return neighborhoods, mask
+
+
+def _grid_keys(x, y):
+    """
+        Combines the (integer) image coordinates into a single sortable key.
+    """
+    return (x << 32) + (y + 2 ** 31)
+
+
 def get_AVIRIS_wavelengths(unit='micrometer'):
     """
         Returns a list of all the wavelengths of AVIRIS in the specified unit. The default is micrometers.
@@ -222,6 +277,25 @@ def strip_and_add_space(string):
     return string
 
 
+def open_text_file(path, compress=False):
+    """
+        Opens a text file for writing, which is gzip-compressed if 'compress' is True. The file takes (native) strings
+        on both Python 2, and 3.
+    :param path:        The path to the file.
+    :param compress:    Toggles whether or not the file is gzip-compressed. Default is False.
+    :type path:         str
+    :type compress:     bool
+    :return:            The open file.
+    :rtype:             file
+    """
+    if compress:
+        # The gzip module of Python 2 has no text mode, but its strings are bytes
+        if version_info[0] < 3:
+            return gzip_open(path, 'wb')
+        return gzip_open(path, 'wt')
+    return open(path, 'w')
+
+
 def list_to_string(l, delimiter=','):
     """
         Converts a list of objects to a single string, where the objects are separated by 'delimiter'.
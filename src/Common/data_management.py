@@ -7,70 +7,94 @@ from __future__ import division
 
 __author__ = 'Sindre Nistad'
 
-from random import random
+from itertools import islice
+from json import dump as json_dump, load as json_load
+from os import stat
 
 from warnings import warn
 
-from Common.common import get_neighbors
-from Common.common import get_histogram, extract_name, split_numbers
-from RegionOfInterest.region import Point, ROI
+import numpy as np
+
+from Common.common import get_neighborhoods
+from Common.common import get_histogram, extract_name, split_numbers, strip_and_add_space
+from Common.spatial import GridIndex
+from Common.statistics import BandStatistics
+from RegionOfInterest.region import Point, ROI, LOCATION_FIELDS, CSV_FORMAT
+
+"""
+The extension of the index of the regions in a ROI file (see build_region_index)
+"""
+REGION_INDEX_EXTENSION = '.idx'
+
+"""
+The default largest distance (in degrees) between points in different files that are considered to be the same
+(see merge_roi_files). About 10 meters.
+"""
+MERGE_TOLERANCE = 1e-4
 
 """
 Pre-process data
 """
 
 
-def merge_roi_files(paths):
-    """
-        Method for merging different files together, assuming they are over the same area.
-        :param paths:   A list of paths to files
-        :type paths:    list of [str]
-        :return:        Does not return anything, bu saves the merged data into a new file, called
-                        merged_[file1]_[file2]_..._[filen].txt where [filei] is the name of the i-th file.
-    """
-    # Get the data from the files
-    data = []
-    for path in paths:
-        # Read the regions of interest information from its file
-        roi_data = read_data_from_file(path)
-        # The dict of dict of region polygons with points
-        rois = roi_data['rois']
-        rois = convert_to_single_dict(rois)
-        # Update the region of interest polygons
-        roi_data['rois'] = rois
-        data.append(roi_data)
-    point_set = {}
-    for roi_data in data:
-        meta = roi_data['meta']
-        """ :type : str """
-        number_of_rois = roi_data['number_of_rois']
-        """ :type : int """
-        img_dim = roi_data['img_dim']
-        """ :type : list[int] """
-        band_info = roi_data['band_info']
-        """ :type : list[str] """
-        rois = roi_data['rois']
-        """ :type : dict[str, ROI] """
-        num_bands = roi_data['num_bands']
-        """ :type : int """
-        for key in rois.keys():
-            roi = rois[key]
-            for point in roi.points:
-                # TODO: Have a boundary for what is considered close enough
-                coord = "LA" + str(point.latitude) + "LO" + str(point.longitude)
-                extended_point = {'meta': meta,
-                                  'number_of_rois': number_of_rois,
-                                  'img_dim': img_dim,
-                                  'band_info': band_info,
-                                  'num_bands': num_bands,
-                                  'point': point
-                                  }
-                if coord in point_set:
-                    point_set[coord].append(extended_point)
-                else:
-                    point_set[coord] = [extended_point]
-    # TODO
-    pass
+def merge_roi_files(paths, tolerance=MERGE_TOLERANCE, path=None, delimiter=","):
+    """
+        Method for merging different files together, assuming they are over the same area. A point of the first file
+        is merged with the nearest point (by latitude, and longitude) of each of the other files, if it is within the
+        tolerance. Points that do not have a match in every file are left out.
+        The first file is read one region at the time, and the merged points are written as they are found, so only
+        the other files are kept in memory (as arrays, indexed by a GridIndex).
+        Each line of the merged file is of the form
+        "NAME, SUB_NAME, R, G, B, ID, X, Y, MAP_X, MAP_Y, LATITUDE, LONGITUDE, BANDS OF FILE 1, ..., BANDS OF FILE n",
+        where the region, and the location is that of the first file.
+        :param paths:       A list of paths to files
+        :param tolerance:   The largest distance (in degrees) between points that are considered to be the same.
+                            Default is MERGE_TOLERANCE.
+        :param path:        The path of the merged file. Default is merged_[file1]_[file2]_..._[filen].txt where
+                            [filei] is the name of the i-th file.
+        :param delimiter:   The character the values are separated by. Default is ','
+        :type paths:        list of [str]
+        :type tolerance:    float
+        :type path:         str
+        :type delimiter:    str
+        :return:            The path of the merged file.
+        :rtype:             str
+    """
+    if path is None:
+        path = "merged_" + "_".join([file_path.split("/")[-1].split(".")[0] for file_path in paths]) + ".txt"
+    delimiter = strip_and_add_space(delimiter)
+    latitude = LOCATION_FIELDS.index('latitude')
+    longitude = LOCATION_FIELDS.index('longitude')
+
+    # Index the points of the other files
+    indices = []
+    bands = []
+    labels = read_meta_data_from_file(paths[0])['band_info']
+    for file_path in paths[1:]:
+        roi_data = read_data_from_file(file_path, bulk=True)
+        indices.append(GridIndex(roi_data['locations'][latitude], roi_data['locations'][longitude], tolerance))
+        bands.append(roi_data['bands'])
+        name = file_path.split("/")[-1].split(".")[0]
+        labels.extend([name + " " + label for label in roi_data['band_info'][len(LOCATION_FIELDS):]])
+
+    with open(path, 'w') as merged_file:
+        merged_file.write("Name" + delimiter + "sub_name" + delimiter + "Red" + delimiter + "Green" + delimiter +
+                          "Blue" + delimiter + delimiter.join(labels) + '\n')
+        for name, sub_name, rgb, points in iterate_data_from_file(paths[0]):
+            columns = [points]
+            is_matched = np.ones(len(points), dtype=bool)
+            for index, other_bands in zip(indices, bands):
+                nearest, distances = index.query(points[:, latitude], points[:, longitude], tolerance)
+                is_matched &= nearest >= 0
+                columns.append(other_bands[nearest])
+            if not is_matched.any():
+                continue
+            # The prefix is written as is, rather than as part of the format, as the names may contain '%'
+            prefix = delimiter.join([name, sub_name] + [str(color) for color in rgb]) + delimiter
+            row_format = delimiter.join([CSV_FORMAT] * sum([c.shape[1] for c in columns])) + '\n'
+            for row in np.hstack(columns)[is_matched]:
+                merged_file.write(prefix + row_format % tuple(row))
+    return path
 
 """
 Read data from files
@@ -146,10 +170,7 @@ def _read_meta_data(datafile):
 
             # Read the RGB value of the region (in the form "{r, g, b}")
             roi_rgb_string = _read(datafile, '')  # Results in ['{r,', 'g,', 'b}']
-            red = roi_rgb_string[-3][1]
-            green = roi_rgb_string[-2][0]
-            blue = roi_rgb_string[-1][0]
-            colors = [red, green, blue]
+            colors = [color.strip('{},') for color in roi_rgb_string[-3:]]
             roi_rgb = split_numbers(colors)
 
             # Reads the number of points there are in that region
@@ -216,7 +237,90 @@ def _read_spectral_data(datafile, results):
         return results
 
 
-def read_data_from_file(path, send_residuals=False):
+def _read_spectral_data_bulk(datafile, results):
+        """
+            Does the same as _read_spectral_data, but reads all the points of a region as a single NumPy block, instead
+            of parsing the file one line at the time.
+            The points of all the regions are stored in one contiguous (7, number of points) array of locations, and
+            one (number of points, number of bands) array of bands. These are added to the results as 'locations',
+            and 'bands', along with 'offsets', where the points of region i (in the order of the file) are in
+            offsets[i]:offsets[i + 1]. Each region of interest is backed by views into these arrays.
+            The minimum, maximum, mean, and standard deviation of each band are computed while the regions are read,
+            and added as 'statistics' (see BandStatistics).
+        :param datafile:    The file from which we read the (spectral) data.
+        :param results:     The results containing the meta data, and the dictionary to which we add the spectral data.
+        :type datafile:     file
+        :type results:      dict of [str, object]
+        :return:            The results dictionary with the added spectral data.
+        :rtype:             dict of [str, object]
+        """
+        rois = results['rois']
+        res_rois = {}
+        offsets = np.zeros(len(rois) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([roi.num_points for roi in rois])
+        num_columns = len(LOCATION_FIELDS)
+        locations = np.empty((num_columns, offsets[-1]), dtype=np.float64)
+        bands = None
+        statistics = BandStatistics()
+        for i in range(len(rois)):
+            roi = rois[i]
+            block = _read_region_block(datafile, roi.num_points)
+            if bands is None and block.size > 0:
+                # The first region with points tells us how many bands there are.
+                num_columns = block.shape[1]
+                bands = np.empty((offsets[-1], num_columns - len(LOCATION_FIELDS)), dtype=np.float64)
+            start, end = offsets[i], offsets[i + 1]
+            if block.size > 0:
+                locations[:, start:end] = block[:, :len(LOCATION_FIELDS)].T
+                bands[start:end] = block[:, len(LOCATION_FIELDS):]
+                statistics.update(bands[start:end])
+
+            if roi.name in res_rois:
+                res_rois[roi.name][roi.sub_name] = roi
+            else:
+                res_rois[roi.name] = {}
+                res_rois[roi.name][roi.sub_name] = roi
+        if bands is None:
+            bands = np.empty((offsets[-1], 0), dtype=np.float64)
+        for i in range(len(rois)):
+            rois[i].set_arrays(locations[:, offsets[i]:offsets[i + 1]], bands[offsets[i]:offsets[i + 1]])
+        results['num_bands'] = bands.shape[1]
+        results['locations'] = locations
+        results['bands'] = bands
+        results['offsets'] = offsets
+        results['region_keys'] = [(roi.name, roi.sub_name) for roi in rois]
+        results['statistics'] = statistics
+        results['rois'] = res_rois
+        return results
+
+
+def _read_region_block(datafile, num_points):
+    """
+        Reads the next 'num_points' rows (ignoring empty lines) of the file, and parses them as a single
+        (num_points, 7 + number of bands) NumPy array; ID, X, Y, Map X, Map Y, latitude, longitude, and the bands.
+    :param datafile:    The file from which we read the (spectral) data. Must be positioned at the rows of a region.
+    :param num_points:  The number of points (rows) in the region.
+    :type datafile:     file
+    :type num_points:   int
+    :return:            The rows of the region.
+    :rtype:             np.ndarray
+    """
+    lines = []
+    reader = iter(datafile.readline, '')
+    while len(lines) < num_points:
+        chunk = list(islice(reader, num_points - len(lines)))
+        if not chunk:
+            raise ValueError("The file ended before all the " + str(num_points) + " points of the region were read.")
+        lines.extend([line for line in chunk if line.strip()])
+    block = np.fromstring("".join(lines), dtype=np.float64, sep=' ')
+    if num_points == 0:
+        return block.reshape(0, 7)
+    if block.size % num_points != 0:
+        raise ValueError("The rows of the region does not have the same number of columns.")
+    return block.reshape(num_points, -1)
+
+
+def read_data_from_file(path, send_residuals=False, bulk=False):
     """
         An aggregate method for reading the data from a file, and returning a dictionary of the information:
         'meta',
@@ -228,8 +332,13 @@ def read_data_from_file(path, send_residuals=False):
         are the keys.
     :param path:            The path to the file we want to read from
     :param send_residuals:  Toggles whether or not the rest of the file will be sent back. For debugging.
+    :param bulk:            Toggles whether or not each region is parsed as a single NumPy block, instead of line by
+                            line. This is a lot faster for large files. The regions of interest are then backed by
+                            arrays, which are added as 'locations', 'bands', 'offsets', and 'region_keys'
+                            (see _read_spectral_data_bulk). Default is False.
     :type path:             str
     :type send_residuals:   bool
+    :type bulk:             bool
     :return:                A dictionary with all the information from the regions of interest.
     :rtype:                 dict of [str, str |
                             list of [float] |
@@ -239,13 +348,158 @@ def read_data_from_file(path, send_residuals=False):
     """
     data_file = open(path, 'r')
     results = _read_meta_data(data_file)
-    results = _read_spectral_data(data_file, results)
+    if bulk:
+        results = _read_spectral_data_bulk(data_file, results)
+    else:
+        results = _read_spectral_data(data_file, results)
     if send_residuals:
         results['residuals'] = data_file.readlines()
     data_file.close()
     return results
 
 
+def read_meta_data_from_file(path):
+    """
+        Reads only the header of the given ROI file; the meta data, the image dimensions, the band information, and
+        the (empty) regions of interest, in the order they appear in the file.
+    :param path:    The path to the file we want to read from
+    :type path:     str
+    :return:        A dictionary with the keys 'meta', 'number_of_rois', 'img_dim', 'band_info', and 'rois'.
+    :rtype:         dict of [str, str | int | list of [int] | list of [str] | list of [ROI]]
+    """
+    with open(path, 'r') as data_file:
+        return _read_meta_data(data_file)
+
+
+def iterate_data_from_file(path):
+    """
+        A generator that reads the regions of interest in the given file one at the time, so that only a single region
+        is kept in memory. Each region is given as a tuple (name, sub_name, rgb, points), where points is a
+        (number of points, 7 + number of bands) NumPy array with the columns ID, X, Y, Map X, Map Y, latitude,
+        longitude, and then the bands.
+        Use read_meta_data_from_file to get the rest of the information in the header.
+    :param path:    The path to the file we want to read from
+    :type path:     str
+    :return:        A generator of (name, sub_name, rgb, points) for each region in the file.
+    :rtype:         generator of [(str, str, list of [float], np.ndarray)]
+    """
+    with open(path, 'r') as data_file:
+        meta_data = _read_meta_data(data_file)
+        for roi in meta_data['rois']:
+            points = _read_region_block(data_file, roi.num_points)
+            yield roi.name, roi.sub_name, roi.rgb, points
+
+
+def compute_statistics(path):
+    """
+        Computes the minimum, maximum, mean, and standard deviation of each band of the points in the given file, in a
+        single pass, keeping only one region in memory at the time. The statistics of several files can be merged
+        (see BandStatistics.merge), e.g. when they are computed in different processes.
+    :param path:    The path to the ROI file.
+    :type path:     str
+    :return:        The statistics of the bands in the file.
+    :rtype:         BandStatistics
+    """
+    statistics = BandStatistics()
+    for name, sub_name, rgb, points in iterate_data_from_file(path):
+        statistics.update(points[:, len(LOCATION_FIELDS):])
+    return statistics
+
+
+def build_region_index(path, save=True):
+    """
+        Builds an index of where the rows of each region start, and end in the given ROI file (as byte offsets), so that
+        a single region can be read without reading the rest of the file (see read_region_from_file). The index also
+        holds the rest of the header of the file. It is saved next to the file as 'path' + REGION_INDEX_EXTENSION.
+    :param path:    The path to the ROI file.
+    :param save:    Toggles whether or not the index is saved next to the file. Default is True.
+    :type path:     str
+    :type save:     bool
+    :return:        The index; the keys 'meta', 'number_of_rois', 'img_dim', 'band_info', 'size', 'mtime', and 'regions',
+                    which is a list of dictionaries with the keys 'name', 'sub_name', 'rgb', 'num_points', 'start', and
+                    'end', in the order of the file.
+    :rtype:         dict of [str, object]
+    """
+    meta_data = read_meta_data_from_file(path)
+    regions = []
+    with open(path, 'rb') as data_file:
+        position = 0
+        lines = iter(data_file)
+        for roi in meta_data['rois']:
+            start = end = None
+            num_rows = 0
+            while num_rows < roi.num_points:
+                line = next(lines)
+                # The header lines start with ';', and the regions are separated by empty lines
+                if line.strip() and not line.startswith(b';'):
+                    if start is None:
+                        start = position
+                    num_rows += 1
+                    end = position + len(line)
+                position += len(line)
+            if start is None:
+                start = end = position
+            regions.append({'name': roi.name,
+                            'sub_name': roi.sub_name,
+                            'rgb': roi.rgb,
+                            'num_points': roi.num_points,
+                            'start': start,
+                            'end': end})
+    file_stats = stat(path)
+    index = {'meta': meta_data['meta'],
+             'number_of_rois': meta_data['number_of_rois'],
+             'img_dim': meta_data['img_dim'],
+             'band_info': meta_data['band_info'],
+             'size': file_stats.st_size,
+             'mtime': file_stats.st_mtime,
+             'regions': regions}
+    if save:
+        with open(path + REGION_INDEX_EXTENSION, 'w') as index_file:
+            json_dump(index, index_file)
+    return index
+
+
+def get_region_index(path):
+    """
+        Gets the index of the regions in the given ROI file. The index that is saved next to the file is used if it
+        is up to date with the file, otherwise, a new index is built, and saved (see build_region_index).
+    :param path:    The path to the ROI file.
+    :type path:     str
+    :return:        The index of the regions in the file.
+    :rtype:         dict of [str, object]
+    """
+    file_stats = stat(path)
+    try:
+        with open(path + REGION_INDEX_EXTENSION, 'r') as index_file:
+            index = json_load(index_file)
+        if index['size'] == file_stats.st_size and index['mtime'] == file_stats.st_mtime:
+            return index
+    except (IOError, OSError, ValueError, KeyError):
+        pass
+    return build_region_index(path)
+
+
+def read_region_from_file(path, region):
+    """
+        Reads the rows of a single region, using the byte offsets in an entry of the region index.
+    :param path:    The path to the ROI file.
+    :param region:  The entry of the region in the index of the file (see get_region_index).
+    :type path:     str
+    :type region:   dict of [str, object]
+    :return:        The region of interest, backed by arrays.
+    :rtype:         ROI
+    """
+    with open(path, 'rb') as data_file:
+        data_file.seek(region['start'])
+        data = data_file.read(region['end'] - region['start'])
+    num_points = region['num_points']
+    block = np.fromstring(data.decode('ascii'), dtype=np.float64, sep=' ')
+    block = block.reshape(num_points, -1) if num_points > 0 else block.reshape(0, len(LOCATION_FIELDS))
+    return ROI(region['name'], region['sub_name'], region['rgb'], num_points,
+               locations=np.ascontiguousarray(block[:, :len(LOCATION_FIELDS)].T),
+               bands=np.ascontiguousarray(block[:, len(LOCATION_FIELDS):]))
+
+
 def _read(data_file, delimiter=None):
     """
         Helper method for reading data from file, and cleaning it up.
@@ -362,38 +616,80 @@ def _add_samples_to_data_set(roi_list, targets, data_set, neighborhood_size, pro
     :type probabilities:        list[float] | dict of [str, float]
     :rtype:                     ClassificationDataSet
     """
-    target_dict = {}  # This because ClassificationDataSet require the number of a target, as opposed to the name.
-    probability_dict = {}  # For convenience.
+    samples, numbers = _build_training_set(roi_list, targets, neighborhood_size, probabilities)
+    for i in range(len(numbers)):
+        data_set.addSample(samples[i], numbers[i])
+    return data_set
 
+
+def build_training_set(roi_obj, targets, neighborhood_size, probabilities=None, seed=None, dtype=np.float32):
+    """
+        Builds the training matrices of all the points of the regions of interest, accounting for neighborhood, in one
+        allocation. The regions that are not among the targets are 'background'. Each point is selected according to
+        the probability of its target, using a seeded random generator.
+    :param roi_obj:             The regions of interest.
+    :param targets:             A list of targets, including the 'background' target.
+    :param neighborhood_size:   The 'diameter' of the neigborhood.
+    :param probabilities:       A list (or dictionary) of probabilities specifying the probabilities of target
+                                number i is added to the data set. The default is None, specifying that all
+                                targets will be added.
+    :param seed:                The seed of the random generator. Default is None; a different selection each time.
+    :param dtype:               The type of the samples. Default is float32.
+    :type roi_obj:              RegionsOfInterest
+    :type targets:              list[str]
+    :type neighborhood_size:    int
+    :type probabilities:        list[float] | dict of [str, float]
+    :type seed:                 int
+    :type dtype:                type
+    :return:                    The (number of samples, neighborhood_size ** 2 * number of bands) matrix X of samples,
+                                where the missing neighbors are 0, and the array y of the index (in targets) of the
+                                target of each sample.
+    :rtype:                     (np.ndarray, np.ndarray)
+    """
+    return _build_training_set(roi_obj.get_all(), targets, neighborhood_size, probabilities, seed, dtype)
+
+
+def _build_training_set(roi_list, targets, neighborhood_size, probabilities=None, seed=None, dtype=np.float32):
+    """
+        Does the same as build_training_set, but for a list of regions of interest.
+    :type roi_list:             list[ROI]
+    :rtype:                     (np.ndarray, np.ndarray)
+    """
     # If we are to use probabilities, they must be the same size as the targets.
     if probabilities is not None:
         assert len(probabilities) == len(targets)
-    for i in range(len(targets)):
-        target = targets[i]
-        target_dict[target] = i
-        if probabilities is None:
-            probability_dict[target] = 1
-        elif isinstance(probabilities, dict):
-            probability_dict = probabilities
-        else:
-            prob = probabilities[i]
-            probability_dict[target] = prob
+    if probabilities is None:
+        probability_dict = _convert_to_dict(targets, [1] * len(targets))
+    elif isinstance(probabilities, dict):
+        probability_dict = probabilities
+    else:
+        probability_dict = _convert_to_dict(targets, probabilities)
 
+    # Selects the points of every region first, so that the matrices can be allocated once.
+    generator = np.random.RandomState(seed)
+    selections = []
     for roi in roi_list:
-        if roi.name is 'background' or roi.name not in targets:
-            number = target_dict['background']
-            prob = probability_dict['background']
-            add_points_to_sample(roi, data_set, number, neighborhood_size, prob)
-        else:  # The ROI is a target
-            number = target_dict[roi.name]
-            prob = probability_dict[roi.name]
-            add_points_to_sample(roi, data_set, number, neighborhood_size, prob)
-    return data_set
-
-
-"""
-Auxiliary
-"""
+        target = roi.name if roi.name in targets else 'background'
+        if target not in targets:
+            raise ValueError("The region '" + roi.name + "' is not a target, and 'background' is not among the targets")
+        probability = min(max(probability_dict[target], 0), 1)
+        selected = np.nonzero(generator.random_sample(len(roi)) < probability)[0]
+        if len(selected) > 0:
+            selections.append((roi, targets.index(target), selected))
+
+    num_bands = selections[0][0].get_band_matrix().shape[1] if selections else 0
+    num_samples = sum([len(selected) for _, _, selected in selections])
+    samples = np.empty((num_samples, neighborhood_size ** 2 * num_bands), dtype=dtype)
+    numbers = np.empty(num_samples, dtype=np.int64)
+    start = 0
+    for roi, number, selected in selections:
+        end = start + len(selected)
+        neighborhoods, mask = get_neighborhoods(roi.get_location('X'), roi.get_location('Y'), roi.get_band_matrix(),
+                                                neighborhood_size, selected)
+        samples[start:end] = neighborhoods.reshape(len(selected), -1)
+        numbers[start:end] = number
+        start = end
+    return samples, numbers
 
 
 def add_points_to_sample(roi, data_set, target, neighborhood_size, probability=1):
@@ -420,16 +716,14 @@ def add_points_to_sample(roi, data_set, target, neighborhood_size, probability=1
     elif probability < 0:
         probability = 0
 
-    for point in roi.points:
-        if probability <= random():
-            continue
-        else:
-            neighborhood_list = get_neighbors(point, roi.points, neighborhood_size, True)
-            bands = [p.bands if p is not None else [0 for _ in range(len(point.bands))] for p in neighborhood_list]
-            collected_bands = []
-            for band in bands:
-                collected_bands += band
-            data_set.addSample(collected_bands, target)
+    # Every point is selected with the given probability
+    selected = np.nonzero(np.random.random(len(roi)) < probability)[0]
+    if len(selected) == 0:
+        return
+    neighborhoods, mask = get_neighborhoods(roi.get_location('X'), roi.get_location('Y'), roi.get_band_matrix(),
+                                            neighborhood_size, selected)
+    for sample in neighborhoods.reshape(len(selected), -1):
+        data_set.addSample(sample, target)
 
 
 def _convert_to_dict(strings, objects):
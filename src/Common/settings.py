@@ -7,18 +7,22 @@ __author__ = 'Sindre Nistad'
 
 # norm_points_table = False
 # extended_point_table = False
+# point_spectrum_table = False
 
-def init(norm_points=False, extended_point=False):
+def init(norm_points=False, extended_point=False, point_spectrum=False):
     """
-    Initializes the global variables norm_points_table, and extended_point_table, which indicated if the respective
-    tables are defined.
+    Initializes the global variables norm_points_table, extended_point_table, and point_spectrum_table, which indicated
+    if the respective tables are defined.
     :param extended_point:
     :param norm_points:
+    :param point_spectrum:
     """
     global norm_points_table
     global extended_point_table
+    global point_spectrum_table
     norm_points_table = norm_points
     extended_point_table = extended_point
+    point_spectrum_table = point_spectrum
 
 
 def set_norm_points_table(val):
@@ -45,6 +49,18 @@ def set_extended_point_table(val):
     extended_point_table = val
 
 
+def set_point_spectrum_table(val):
+    """
+    Sets the value of point_spectrum_table to True, or False
+    :param val: The value that we want to set to the global variable point_spectrum_table
+    :type val:  bool
+    :return:    None
+    """
+    assert isinstance(val, bool)
+    global point_spectrum_table
+    point_spectrum_table = val
+
+
 def get_norm_points():
     """
     Getter for norm_points_table
@@ -63,3 +79,13 @@ def get_extended_point():
     """
     global extended_point_table
     return extended_point_table
+
+
+def get_point_spectrum():
+    """
+    Getter for point_spectrum_table
+    :return:    The current value of point_spectrum_table
+    :rtype:     bool
+    """
+    global point_spectrum_table
+    return point_spectrum_table
@@ -0,0 +1,312 @@
+# -*- coding: utf-8 -*-
+"""
+    Spatial indices for finding points that are (nearly) at the same location, e.g. in different images of the same area,
+    and space-filling curves for ordering points so that points near each other in the plane are near each other in
+    memory.
+"""
+from __future__ import division
+
+__author__ = 'Sindre Nistad'
+
+import numpy as np
+
+
+class GridIndex(object):
+    """
+    A grid hash of points in the plane (e.g. latitude, and longitude). The points are put into square cells of size
+    'cell_size', and sorted by their cell, so that the points near a location are found by a binary search for the
+    cell of the location, and its 8 neighboring cells. Building the index is O(n log n), and so is querying n points,
+    as long as there are few points in each cell. The k nearest points, and the points within a radius, are found by
+    searching the cells in a growing square around each location.
+    """
+
+    def __init__(self, x, y, cell_size):
+        """
+            Creates an index of the given points.
+        :param x:           The first coordinate of the points, e.g. the latitude.
+        :param y:           The second coordinate of the points, e.g. the longitude.
+        :param cell_size:   The size of the cells of the grid, in the same unit as the coordinates. This is also the
+                            largest distance that can be queried.
+        :type x:            np.ndarray | list of [float]
+        :type y:            np.ndarray | list of [float]
+        :type cell_size:    float
+        """
+        if cell_size <= 0:
+            raise ValueError("The size of the cells must be positive", cell_size)
+        self.cell_size = float(cell_size)
+        """ :type : float """
+        self.x = np.asarray(x, dtype=np.float64)
+        """ :type : np.ndarray """
+        self.y = np.asarray(y, dtype=np.float64)
+        """ :type : np.ndarray """
+        cells_x, cells_y = self._cells(self.x, self.y)
+        keys = self._keys(cells_x, cells_y)
+        self.order = np.argsort(keys, kind='mergesort')
+        """ :type : np.ndarray """
+        self.keys = keys[self.order]
+        """ :type : np.ndarray """
+        if len(keys) > 0:
+            self.bounds = (cells_x.min(), cells_x.max(), cells_y.min(), cells_y.max())
+        else:
+            self.bounds = (0, 0, 0, 0)
+        """ :type : (int, int, int, int) """
+
+    def _cells(self, x, y):
+        """
+            The (integer) cells of the given coordinates.
+        """
+        return np.floor(x / self.cell_size).astype(np.int64), np.floor(y / self.cell_size).astype(np.int64)
+
+    @staticmethod
+    def _keys(cells_x, cells_y):
+        """
+            Combines the two cell coordinates into a single sortable key.
+        """
+        return (cells_x << 32) + (cells_y + 2 ** 31)
+
+    def query(self, x, y, tolerance=None):
+        """
+            Finds the nearest indexed point to each of the given locations, if there is one within the tolerance.
+        :param x:           The first coordinate of the locations.
+        :param y:           The second coordinate of the locations.
+        :param tolerance:   The largest distance between a location, and its nearest point. Can not be larger than
+                            the size of the cells. Default is the size of the cells.
+        :type x:            np.ndarray | list of [float]
+        :type y:            np.ndarray | list of [float]
+        :type tolerance:    float
+        :return:            The index (in the order the points were given) of the nearest point to each location, or
+                            -1 if there is no point within the tolerance, and the distance to that point.
+        :rtype:             (np.ndarray, np.ndarray)
+        """
+        if tolerance is None:
+            tolerance = self.cell_size
+        elif tolerance > self.cell_size:
+            raise ValueError("The tolerance can not be larger than the size of the cells", (tolerance, self.cell_size))
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        nearest = np.full(len(x), -1, dtype=np.int64)
+        distances = np.full(len(x), np.inf)
+        cells_x, cells_y = self._cells(x, y)
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                keys = self._keys(cells_x + dx, cells_y + dy)
+                start = np.searchsorted(self.keys, keys, side='left')
+                counts = np.searchsorted(self.keys, keys, side='right') - start
+                # Goes through the k-th point of each cell, for all the locations at the time
+                for k in range(counts.max() if len(counts) > 0 else 0):
+                    queries = np.nonzero(counts > k)[0]
+                    candidates = self.order[start[queries] + k]
+                    candidate_distances = np.hypot(self.x[candidates] - x[queries], self.y[candidates] - y[queries])
+                    closer = candidate_distances < distances[queries]
+                    nearest[queries[closer]] = candidates[closer]
+                    distances[queries[closer]] = candidate_distances[closer]
+        too_far = distances > tolerance
+        nearest[too_far] = -1
+        distances[too_far] = np.inf
+        return nearest, distances
+
+    def k_nearest(self, x, y, k):
+        """
+            Finds the k nearest indexed points to each of the given locations.
+        :param x:   The first coordinate of the locations.
+        :param y:   The second coordinate of the locations.
+        :param k:   The number of points to find for each location.
+        :type x:    np.ndarray | list of [float]
+        :type y:    np.ndarray | list of [float]
+        :type k:    int
+        :return:    A (number of locations, k) matrix of the indices (in the order the points were given) of the points,
+                    sorted by their distance to the location, and a matrix of the distances. If there are fewer than k
+                    points, the rest of the indices are -1, and the distances are inf.
+        :rtype:     (np.ndarray, np.ndarray)
+        """
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        nearest = np.full((len(x), k), -1, dtype=np.int64)
+        distances = np.full((len(x), k), np.inf)
+        if k <= 0 or len(self) == 0:
+            return nearest, distances
+        cells_x, cells_y = self._cells(x, y)
+        remaining = np.arange(len(x))
+        rings = 1
+        while len(remaining) > 0:
+            queries, candidates, candidate_distances = self._search(x[remaining], y[remaining],
+                                                                    cells_x[remaining], cells_y[remaining], rings)
+            ranks = np.arange(len(queries)) - np.searchsorted(queries, queries, side='left')
+            keep = ranks < k
+            nearest[remaining[queries[keep]], ranks[keep]] = candidates[keep]
+            distances[remaining[queries[keep]], ranks[keep]] = candidate_distances[keep]
+            # Any point outside the searched cells is further away than rings * cell_size
+            done = distances[remaining, k - 1] <= rings * self.cell_size
+            done |= self._covers_all(cells_x[remaining], cells_y[remaining], rings)
+            remaining = remaining[~done]
+            rings *= 2
+        return nearest, distances
+
+    def within(self, x, y, radius):
+        """
+            Finds the indexed points within the given radius of each of the given locations.
+        :param x:       The first coordinate of the locations.
+        :param y:       The second coordinate of the locations.
+        :param radius:  The largest distance between a location, and a point.
+        :type x:        np.ndarray | list of [float]
+        :type y:        np.ndarray | list of [float]
+        :type radius:   float
+        :return:        The indices (in the order the points were given) of the points of each location, sorted by
+                        their distance to the location, and the distances.
+        :rtype:         (list of [np.ndarray], list of [np.ndarray])
+        """
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        if len(x) == 0:
+            return [], []
+        cells_x, cells_y = self._cells(x, y)
+        rings = max(int(np.ceil(radius / self.cell_size)), 1)
+        queries, candidates, candidate_distances = self._search(x, y, cells_x, cells_y, rings)
+        close = candidate_distances <= radius
+        queries, candidates, candidate_distances = queries[close], candidates[close], candidate_distances[close]
+        splits = np.searchsorted(queries, np.arange(1, len(x)))
+        return np.split(candidates, splits), np.split(candidate_distances, splits)
+
+    def _search(self, x, y, cells_x, cells_y, rings):
+        """
+            Finds the indexed points in the cells within 'rings' cells of the cell of each of the given locations.
+        :return:    The index of the location, the index of the point, and the distance between them, of each point
+                    that was found, sorted by the location, and then by the distance.
+        """
+        queries = []
+        candidates = []
+        for dx in range(-rings, rings + 1):
+            for dy in range(-rings, rings + 1):
+                keys = self._keys(cells_x + dx, cells_y + dy)
+                start = np.searchsorted(self.keys, keys, side='left')
+                counts = np.searchsorted(self.keys, keys, side='right') - start
+                # The position of each point in its cell
+                positions = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+                queries.append(np.repeat(np.arange(len(keys)), counts))
+                candidates.append(self.order[np.repeat(start, counts) + positions])
+        queries = np.concatenate(queries)
+        candidates = np.concatenate(candidates)
+        candidate_distances = np.hypot(self.x[candidates] - x[queries], self.y[candidates] - y[queries])
+        order = np.lexsort((candidate_distances, queries))
+        return queries[order], candidates[order], candidate_distances[order]
+
+    def _covers_all(self, cells_x, cells_y, rings):
+        """
+            Whether or not the cells within 'rings' cells of each of the given cells include every indexed point.
+        """
+        min_x, max_x, min_y, max_y = self.bounds
+        return (cells_x - rings <= min_x) & (cells_x + rings >= max_x) & \
+               (cells_y - rings <= min_y) & (cells_y + rings >= max_y)
+
+    def __len__(self):
+        return len(self.keys)
+
+
+def morton_order(x, y, bits=16):
+    """
+        Gives the order of the points along a Z-order (Morton) curve, i.e. sorted by the interleaved bits of their
+        (quantized) coordinates, so that points that are near each other in the plane tend to be near each other in
+        the order.
+    :param x:       The first coordinate of the points, e.g. X, or the latitude.
+    :param y:       The second coordinate of the points, e.g. Y, or the longitude.
+    :param bits:    The number of bits each coordinate is quantized to (at most 31). Default is 16.
+    :type x:        np.ndarray
+    :type y:        np.ndarray
+    :type bits:     int
+    :return:        The indices of the points in the order of the curve.
+    :rtype:         np.ndarray
+    """
+    return np.argsort(morton_keys(quantize(x, bits), quantize(y, bits)), kind='mergesort')
+
+
+def hilbert_order(x, y, bits=16):
+    """
+        Gives the order of the points along a Hilbert curve. Unlike the Z-order curve, consecutive points on the curve
+        are always adjacent cells, so the locality is better, but the keys are more expensive to compute.
+    :param x:       The first coordinate of the points, e.g. X, or the latitude.
+    :param y:       The second coordinate of the points, e.g. Y, or the longitude.
+    :param bits:    The number of bits each coordinate is quantized to (at most 31). Default is 16.
+    :type x:        np.ndarray
+    :type y:        np.ndarray
+    :type bits:     int
+    :return:        The indices of the points in the order of the curve.
+    :rtype:         np.ndarray
+    """
+    return np.argsort(hilbert_keys(quantize(x, bits), quantize(y, bits), bits), kind='mergesort')
+
+
+def quantize(values, bits=16):
+    """
+        Maps the values linearly onto the integers 0 to 2 ** bits - 1. Integer values (e.g. image coordinates) that
+        already fit are only shifted, so that no two distinct coordinates end up in the same cell.
+    :param values:  The values to be quantized.
+    :param bits:    The number of bits of the result. Default is 16.
+    :type values:   np.ndarray
+    :type bits:     int
+    :return:        The quantized values.
+    :rtype:         np.ndarray
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if len(values) == 0:
+        return np.zeros(0, dtype=np.int64)
+    shifted = values - values.min()
+    largest = shifted.max()
+    if largest < 2 ** bits and np.array_equal(shifted, np.floor(shifted)):
+        return shifted.astype(np.int64)
+    return np.floor(shifted / largest * (2 ** bits - 1)).astype(np.int64)
+
+
+def morton_keys(x, y):
+    """
+        Interleaves the bits of the two (non-negative, 32 bit) integer coordinates, with x in the odd bits.
+    :param x:   The first (integer) coordinate.
+    :param y:   The second (integer) coordinate.
+    :type x:    np.ndarray
+    :type y:    np.ndarray
+    :return:    The Morton codes of the coordinates.
+    :rtype:     np.ndarray
+    """
+    return (_spread_bits(x) << np.uint64(1)) | _spread_bits(y)
+
+
+def _spread_bits(values):
+    """
+        Moves bit i of the (32 bit) values to bit 2i.
+    """
+    values = np.asarray(values).astype(np.uint64) & np.uint64(0xFFFFFFFF)
+    for shift, mask in ((16, 0x0000FFFF0000FFFF), (8, 0x00FF00FF00FF00FF), (4, 0x0F0F0F0F0F0F0F0F),
+                        (2, 0x3333333333333333), (1, 0x5555555555555555)):
+        values = (values | (values << np.uint64(shift))) & np.uint64(mask)
+    return values
+
+
+def hilbert_keys(x, y, bits=16):
+    """
+        Gives the distance along the Hilbert curve of the 2 ** bits by 2 ** bits grid to each of the (integer)
+        coordinates.
+    :param x:       The first (integer) coordinate, from 0 to 2 ** bits - 1.
+    :param y:       The second (integer) coordinate, from 0 to 2 ** bits - 1.
+    :param bits:    The number of bits of each coordinate (at most 31). Default is 16.
+    :type x:        np.ndarray
+    :type y:        np.ndarray
+    :type bits:     int
+    :return:        The Hilbert indices of the coordinates.
+    :rtype:         np.ndarray
+    """
+    x = np.array(x, dtype=np.int64)
+    y = np.array(y, dtype=np.int64)
+    side = 2 ** bits
+    keys = np.zeros(len(x), dtype=np.int64)
+    s = side // 2
+    while s > 0:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        keys += s * s * ((3 * rx) ^ ry)
+        # Rotates the quadrant, so that the curve is continuous
+        flip = ~ry & rx
+        x[flip] = side - 1 - x[flip]
+        y[flip] = side - 1 - y[flip]
+        swap = ~ry
+        x[swap], y[swap] = y[swap], x[swap].copy()
+        s //= 2
+    return keys
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+    Statistics of the spectral bands that are computed in a single pass over the data, and that can be merged.
+"""
+from __future__ import division
+
+__author__ = 'Sindre Nistad'
+
+import numpy as np
+
+
+class BandStatistics(object):
+    """
+    The number of points, and the minimum, maximum, mean, and standard deviation of each band. The statistics are
+    updated one block of points at the time, and statistics of different blocks, files, or processes can be merged,
+    using the pairwise algorithm of Chan et al. for the mean and variance.
+    """
+
+    def __init__(self, num_bands=0):
+        """
+            Creates empty statistics.
+        :param num_bands:   The number of bands. If it is 0, it is set by the first block of points.
+        :type num_bands:    int
+        :return:
+        """
+        self.count = 0
+        """ :type : int """
+        self.mean = np.zeros(num_bands)
+        """ :type : np.ndarray """
+        self.sum_of_squares = np.zeros(num_bands)
+        """ :type : np.ndarray """
+        self.minimum = np.full(num_bands, np.inf)
+        """ :type : np.ndarray """
+        self.maximum = np.full(num_bands, -np.inf)
+        """ :type : np.ndarray """
+
+    def update(self, bands):
+        """
+            Adds a block of points to the statistics.
+        :param bands:   A (number of points, number of bands) matrix.
+        :type bands:    np.ndarray
+        :return:        The updated statistics (self).
+        :rtype:         BandStatistics
+        """
+        bands = np.asarray(bands, dtype=np.float64)
+        if bands.shape[0] == 0:
+            return self
+        block = BandStatistics()
+        block.count = bands.shape[0]
+        block.mean = bands.mean(axis=0)
+        block.sum_of_squares = ((bands - block.mean) ** 2).sum(axis=0)
+        block.minimum = bands.min(axis=0)
+        block.maximum = bands.max(axis=0)
+        return self.merge(block)
+
+    def merge(self, other):
+        """
+            Merges the statistics of some other points into these.
+        :param other:   The statistics to be merged into these.
+        :type other:    BandStatistics
+        :return:        The updated statistics (self).
+        :rtype:         BandStatistics
+        """
+        if other.count == 0:
+            return self
+        if self.count == 0:
+            self.count = other.count
+            self.mean = other.mean.copy()
+            self.sum_of_squares = other.sum_of_squares.copy()
+            self.minimum = other.minimum.copy()
+            self.maximum = other.maximum.copy()
+            return self
+        if len(self.mean) != len(other.mean):
+            raise ValueError("The statistics does not have the same number of bands", (len(self.mean), len(other.mean)))
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * (other.count / count)
+        self.sum_of_squares = self.sum_of_squares + other.sum_of_squares + \
+            delta ** 2 * (self.count * other.count / count)
+        self.minimum = np.minimum(self.minimum, other.minimum)
+        self.maximum = np.maximum(self.maximum, other.maximum)
+        self.count = count
+        return self
+
+    def get_standard_deviation(self):
+        """
+            The (sample) standard deviation of each band, as computed by stddev in PostgreSQL.
+        :return:    The standard deviation of each band.
+        :rtype:     np.ndarray
+        """
+        if self.count < 2:
+            return np.zeros(len(self.mean))
+        return np.sqrt(self.sum_of_squares / (self.count - 1))
+
+    def to_dict(self):
+        """
+            Converts the statistics to a dictionary of lists, e.g. to be stored as JSON.
+        :return:    The statistics with the keys 'count', 'mean', 'sum_of_squares', 'minimum', and 'maximum'.
+        :rtype:     dict of [str, int | list of [float]]
+        """
+        return {'count': self.count,
+                'mean': self.mean.tolist(),
+                'sum_of_squares': self.sum_of_squares.tolist(),
+                'minimum': self.minimum.tolist(),
+                'maximum': self.maximum.tolist()}
+
+    @staticmethod
+    def from_dict(data):
+        """
+            Creates statistics from a dictionary made by to_dict.
+        :param data:    The statistics as a dictionary.
+        :type data:     dict of [str, int | list of [float]]
+        :return:        The statistics.
+        :rtype:         BandStatistics
+        """
+        statistics = BandStatistics()
+        statistics.count = data['count']
+        statistics.mean = np.array(data['mean'], dtype=np.float64)
+        statistics.sum_of_squares = np.array(data['sum_of_squares'], dtype=np.float64)
+        statistics.minimum = np.array(data['minimum'], dtype=np.float64)
+        statistics.maximum = np.array(data['maximum'], dtype=np.float64)
+        return statistics
+
+    def __len__(self):
+        return len(self.mean)
+
+
+def merge_statistics(statistics):
+    """
+        Merges a list of statistics, e.g. of different files, into one.
+    :param statistics:  The statistics to be merged.
+    :type statistics:   list of [BandStatistics]
+    :return:            The combined statistics.
+    :rtype:             BandStatistics
+    """
+    result = BandStatistics()
+    for itm in statistics:
+        result.merge(itm)
+    return result
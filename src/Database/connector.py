@@ -5,27 +5,72 @@ In this file, all the communication between the main program, and the database i
 
 from __future__ import division
 
+from hashlib import md5
+from io import BytesIO
+from itertools import count
 from warnings import warn
 
 import pony.orm as pny
-from pony.orm import db_session
 import numpy as np
 
 from Database.helpers import select_sql_point, nearest_neighbor_sql, bands_to_string, get_normalizing_sql, \
-    dataset_to_string
-from Database.database_definition import db, Color, Dataset, Norm, Point, Region, Spectrum, Wavelengths, bind
+    dataset_to_sql, spectrum_sql, nearest_neighbors_sql, to_positional, to_pyformat
+from Database.session import session, commit
+from Database.database_definition import db, Color, Dataset, Norm, Point, Region, Spectrum, Wavelengths, bind, \
+    ensure_indexes
 from Common.parameters import WAVELENGTHS, NUMBER_OF_USED_BANDS, USE_NAIVE_SAMPLING, UNIQUE_CLASSES, POINT_FIELDS
 from Common.common import get_one_indexed, is_in_name, string_to_array, is_gaussian, is_min_max
-from Common.settings import get_extended_point, get_norm_points, set_extended_point_table, set_norm_points_table
-from RegionOfInterest.region import BasePoint
+from Common.settings import get_extended_point, get_norm_points, set_extended_point_table, set_norm_points_table, \
+    get_point_spectrum, set_point_spectrum_table
+from RegionOfInterest.region import BasePoint, LOCATION_FIELDS
 from RegionOfInterest.region import Point as ROIPoint
 
 # TODO: Use IOPro if available
 
 __author__ = 'Sindre Nistad'
 
+"""
+The number of points whose spectra are fetched in a single query (see get_spectra)
+"""
+SPECTRA_BATCH_SIZE = 10000
+
+"""
+The number of points that are copied to the database, and committed at the time, when the regions of interest are
+added in bulk (see roi_to_database)
+"""
+BULK_BATCH_SIZE = 10000
 
-@db_session
+"""
+The range of point ids whose spectra are linked to their wavelengths in a single statement (see
+add_wavelength_to_points)
+"""
+WAVELENGTH_BATCH_SIZE = 10000
+
+"""
+The number of points whose nearest neighbors (and their spectra) are fetched in a single query (see
+get_nearest_neighbor_to_points)
+"""
+NEIGHBOR_BATCH_SIZE = 1000
+
+"""
+The number of rows that are fetched from a server-side cursor at the time, when the points are streamed (see
+stream_query)
+"""
+STREAM_BATCH_SIZE = 10000
+
+"""
+Numbers for the names of the server-side cursors
+"""
+_stream_ids = count()
+
+"""
+The names of the statements that have been prepared (see execute_prepared) on each connection, by the id, and the
+(server) process id of the connection
+"""
+_prepared_statements = {}
+
+
+@session
 def _set_table_values():
     try:
         db.execute("SELECT * FROM extended_point LIMIT 1;")
@@ -39,9 +84,15 @@ def _set_table_values():
     except pny.ProgrammingError:
         set_norm_points_table(False)
 
+    try:
+        db.execute("SELECT * FROM point_spectrum LIMIT 1;")
+        set_point_spectrum_table(True)
+    except pny.ProgrammingError:
+        set_point_spectrum_table(False)
+
 
-@db_session
-def connect(combine_point_and_dataset=False, norm_points=False):
+@session
+def connect(combine_point_and_dataset=False, norm_points=False, point_spectrum=False, indexes=False):
     """
         Performs Database connection using Database settings from settings.py.
     :param combine_point_and_dataset:   Toggles whether or not a temporary table is to be created that stores the union
@@ -51,8 +102,16 @@ def connect(combine_point_and_dataset=False, norm_points=False):
                                         will hold the normalizing data for all the spectra in the database, and will
                                         speed up the normalization when we do not want to use the 'given' normalization
                                         data.
+    :param point_spectrum:              Toggles whether or not the spectra are to be migrated to the table
+                                        point_spectrum, which stores the spectrum of each point as a single array (see
+                                        create_point_spectrum), if it has not been done already. Default is False.
+    :param indexes:                     Toggles whether or not the secondary indices (of extended_point as well) are
+                                        created, and validated (see Database.database_definition.ensure_indexes).
+                                        Default is False.
     :type combine_point_and_dataset:    bool
     :type norm_points:                  bool
+    :type point_spectrum:               bool
+    :type indexes:                      bool
     :return:    None
     :rtype:     None
     """
@@ -61,14 +120,20 @@ def connect(combine_point_and_dataset=False, norm_points=False):
     except TypeError:
         warn("The database has already been bound.")
     _set_table_values()
+    if point_spectrum and not get_point_spectrum():
+        create_point_spectrum()
+
     if combine_point_and_dataset and not get_extended_point():
         _create_extended_point()
 
+    if indexes:
+        ensure_indexes()
+
     if norm_points and not get_norm_points():
         _create_norm_points(combine_point_and_dataset)
 
 
-@db_session
+@session
 def _create_norm_points(combine_point_and_dataset):
     if combine_point_and_dataset:
         sql = """
@@ -80,7 +145,7 @@ def _create_norm_points(combine_point_and_dataset):
                 max(value),
                 avg(value),
                 stddev(value)
-              FROM spectrum, extended_point
+              FROM """ + spectrum_sql() + """, extended_point
               WHERE spectrum.point = extended_point.id
               GROUP BY band_nr, extended_point.dataset;
               """
@@ -88,14 +153,13 @@ def _create_norm_points(combine_point_and_dataset):
         sql = """
             CREATE TABLE norm_points AS
               SELECT
-                spectrum.id,
                 band_nr,
                 dataset,
                 min(value),
                 max(value),
                 avg(value),
                 stddev(value)
-              FROM spectrum, point, region, dataset
+              FROM """ + spectrum_sql() + """, point, region, dataset
               WHERE spectrum.point = point.id AND point.region = region.id AND region.dataset = dataset.id
               GROUP BY band_nr, dataset.id;
               """
@@ -109,7 +173,38 @@ def _create_norm_points(combine_point_and_dataset):
     set_norm_points_table(True)
 
 
-@db_session
+@session
+def create_point_spectrum(clear_spectrum=False):
+    """
+        Migrates the spectra from the table spectrum (one row per band of each point) to the table point_spectrum, where
+        the spectrum of each point is a single array (real[]), in one statement. When the table exists, the spectra are
+        read from (and added to) it instead of spectrum.
+    :param clear_spectrum:  Toggles whether or not the rows of spectrum are deleted (truncated) after the migration, to
+                            free the space. The table itself is kept, as it is part of the mapping of the database.
+                            Default is False.
+    :type clear_spectrum:   bool
+    :return:                None
+    :rtype:                 None
+    """
+    sql = """
+        CREATE TABLE point_spectrum AS
+          SELECT
+            point,
+            array_agg(value::real ORDER BY band_nr) AS bands
+          FROM spectrum
+          GROUP BY point;
+        ALTER TABLE point_spectrum ADD PRIMARY KEY (point);
+        ALTER TABLE point_spectrum ADD FOREIGN KEY (point) REFERENCES point (id) ON DELETE CASCADE;
+        """
+    # A failed CREATE would abort the transaction, so the table is only created when it is missing
+    if not db.select("SELECT to_regclass('point_spectrum') IS NOT NULL")[0]:
+        db.execute(sql)
+    if clear_spectrum:
+        db.execute("TRUNCATE spectrum;")
+    set_point_spectrum_table(True)
+
+
+@session
 def _create_extended_point():
     sql = """
         CREATE TABLE extended_point AS
@@ -145,7 +240,7 @@ def disconnect(cleanup=False, hard_clean=False):
     db.disconnect()
 
 
-@db_session
+@session
 def _cleanup(hard_clean=False):
     sql = "DROP TABLE IF EXISTS extended_point;"
     db.execute(sql)
@@ -177,41 +272,40 @@ def create_tables(overwrite=False, debug=False):
     db.create_database(overwrite=overwrite, debug=debug)
 
 
-@db_session
-def roi_to_database(roi, add_wavelengths=False, debug=False, force_load=False, commit_at_end=True):
+@session
+def roi_to_database(roi, add_wavelengths=False, debug=False, force_load=False, commit_at_end=True, bulk=False,
+                    batch_size=BULK_BATCH_SIZE):
     """
         Writes the content of a region of interest to the database
     :param roi:             The region of interest to be written to the database
     :param add_wavelengths: Toggle whether or not information about wavelengths is to be added. Default is False,
-                            as it takes quite a while, and is not strictly necessary.
+                            as it is not strictly necessary.
     :param debug:           Toggle whether or not debug information is to be written to the console. Default is False
     :param force_load:      Toggle whether or not the actual data in the regions of interest is to be read. Default is
                             False
     :param commit_at_end:   Toggles whether or not all the changes are to be committed at the end. Default is False.
+    :param bulk:            Toggles whether or not the points, and spectra are streamed to the database with COPY, in
+                            batches of 'batch_size' points that are committed one at the time, instead of creating one
+                            object per point, and band. Default is False.
+    :param batch_size:      The number of points in each batch, when adding in bulk. Default is BULK_BATCH_SIZE.
     :type roi:              RegionOfInterest.regions_of_interest.RegionsOfInterest
     :type add_wavelengths:  bool
     :type debug:            bool
     :type force_load:       bool
     :type commit_at_end:    bool
+    :type bulk:             bool
+    :type batch_size:       int
     :return:                None
     :rtype:                 None
     """
-    # Splits the path by '/', and then '.', and then extracts the name
-    dataset_name = roi.path.split('/')[-1].split('.')[0]
-    # :type : str
-    spectral_type = ""
-    if add_wavelengths:
-        if is_in_name('AVIRIS', roi.path):
-            spectral_type = 'AVIRIS'
-        elif is_in_name('MASTER', roi.path):
-            spectral_type = 'MASTER'
+    dataset_name, spectral_type = _get_dataset_name_and_type(roi.path, add_wavelengths)
     if dataset_name not in pny.select(d.name for d in Dataset):
         dataset = add_dataset(dataset_name, spectral_type)
         if not roi.is_loaded:
             print("Now loading the dataset located at " + roi.path)
             roi.load_data()
-            rois = roi.get_all()
             print("Loading complete. Now exporting to database.")
+        rois = roi.get_all()
     else:
         dataset = pny.get(d for d in Dataset if d.name == dataset_name)
         if force_load:
@@ -228,6 +322,13 @@ def roi_to_database(roi, add_wavelengths=False, debug=False, force_load=False, c
     if debug:
         i = 0
         n = len(rois)
+    if bulk:
+        new_rois = [itm for itm in rois if not pny.exists(r for r in Region if r.dataset == dataset and
+                                                          r.name == itm.name and r.sub_name == itm.sub_name)]
+        if debug:
+            print("Adding " + str(len(new_rois)) + " of " + str(n) + " regions in bulk.")
+        add_regions_in_bulk(new_rois, dataset, batch_size, debug)
+        rois = []
     for roi in rois:
         if pny.exists(r for r in Region if r.dataset == dataset and r.name == roi.name and r.sub_name == roi.sub_name):
             if debug:
@@ -245,7 +346,7 @@ def roi_to_database(roi, add_wavelengths=False, debug=False, force_load=False, c
         if not commit_at_end:
             if debug:
                 print("Committing point to the database.")
-            db.commit()
+            commit()
             if debug:
                 print("Commit completed.")
     if not pny.exists(wvl for wvl in Wavelengths if dataset in wvl.datasets):
@@ -259,14 +360,14 @@ def roi_to_database(roi, add_wavelengths=False, debug=False, force_load=False, c
         if debug:
             print("Committing changes to the database.")
     if commit_at_end:
-        db.commit()
+        commit()
         if debug:
             print("Commit complete.")
     if debug:
         print("DONE!")
 
 
-@db_session
+@session
 def add_region(roi, dataset):
     """
         Adds the given region to the given data set
@@ -284,7 +385,159 @@ def add_region(roi, dataset):
     return region
 
 
-@db_session
+def _get_dataset_name_and_type(path, add_wavelengths=False):
+    """
+        Gives the name of the dataset of the given ROI file, and its spectral type.
+    :param path:            The path to the ROI file.
+    :param add_wavelengths: Toggle whether or not information about wavelengths is to be added. If not, the spectral
+                            type is "".
+    :type path:             str
+    :type add_wavelengths:  bool
+    :return:                The name of the dataset, and the spectral type ('AVIRIS', 'MASTER', or "").
+    :rtype:                 (str, str)
+    """
+    # Splits the path by '/', and then '.', and then extracts the name
+    dataset_name = path.split('/')[-1].split('.')[0]
+    spectral_type = ""
+    if add_wavelengths:
+        if is_in_name('AVIRIS', path):
+            spectral_type = 'AVIRIS'
+        elif is_in_name('MASTER', path):
+            spectral_type = 'MASTER'
+    return dataset_name, spectral_type
+
+
+@session
+def prepare_dataset(path, add_wavelengths=False):
+    """
+        Adds the dataset of the given ROI file (with its wavelengths), if it is not already in the database, and
+        commits it, e.g. before the regions of several files are added by different processes, so that they do not
+        try to create the same dataset, or wavelengths.
+    :param path:            The path to the ROI file.
+    :param add_wavelengths: Toggle whether or not information about wavelengths is to be added. Default is False.
+    :type path:             str
+    :type add_wavelengths:  bool
+    :return:                The name of the dataset.
+    :rtype:                 str
+    """
+    dataset_name, spectral_type = _get_dataset_name_and_type(path, add_wavelengths)
+    if dataset_name not in pny.select(d.name for d in Dataset):
+        add_dataset(dataset_name, spectral_type)
+        commit()
+    return dataset_name
+
+
+@session
+def add_regions_in_bulk(rois, dataset, batch_size=BULK_BATCH_SIZE, debug=False):
+    """
+        Adds the regions of interest, with their points, and spectra to the given data set, streaming the points, and
+        spectra with COPY FROM STDIN, 'batch_size' points at the time. The ids of the points are reserved from their
+        sequence for each batch, and the wavelengths of the bands are looked up once. Each batch is committed.
+    :param rois:        The regions of interest to be added.
+    :param dataset:     The data set the regions are added to.
+    :param batch_size:  The number of points that are copied, and committed at the time. Default is BULK_BATCH_SIZE.
+    :param debug:       Toggle whether or not debug information is to be written to the console. Default is False
+    :type rois:         list of [RegionOfInterest.region.ROI]
+    :type dataset:      Dataset
+    :type batch_size:   int
+    :type debug:        bool
+    :return:            The number of points that were added.
+    :rtype:             int
+    """
+    regions = [add_region(roi, dataset) for roi in rois]
+    pny.flush()  # So that the regions have their ids
+    sql = "SELECT id FROM wavelengths WHERE name = $spectral_type ORDER BY band_nr;"
+    wavelengths = [row[0] for row in db.execute(sql, {'spectral_type': dataset.type})]
+    commit()
+
+    # The locations, bands, and region id of the points that are waiting to be copied
+    batch = []
+    batch_points = 0
+    total = 0
+    for roi, region in zip(rois, regions):
+        locations = np.array([roi.get_location(field) for field in LOCATION_FIELDS]).reshape(len(LOCATION_FIELDS), -1)
+        bands = roi.get_band_matrix()
+        start = 0
+        while start < len(roi):
+            # The batches may span several regions
+            end = min(start + batch_size - batch_points, len(roi))
+            batch.append((locations[:, start:end], bands[start:end], region.id))
+            batch_points += end - start
+            start = end
+            if batch_points >= batch_size:
+                total += _copy_points(batch, wavelengths)
+                batch, batch_points = [], 0
+                if debug:
+                    print(str(total) + " points committed.")
+    if batch:
+        total += _copy_points(batch, wavelengths)
+        if debug:
+            print(str(total) + " points committed.")
+    return total
+
+
+def _copy_points(batch, wavelengths):
+    """
+        Copies a batch of points, and their spectra to the database, and commits them.
+    :param batch:       The locations (see LOCATION_FIELDS), bands, and region id of each part of the batch.
+    :param wavelengths: The ids of the wavelengths of the bands (in order), or an empty list if they are not known.
+    :type batch:        list of [(np.ndarray, np.ndarray, int)]
+    :type wavelengths:  list of [int]
+    :return:            The number of points that were copied.
+    :rtype:             int
+    """
+    locations = np.hstack([part[0] for part in batch])
+    bands = np.vstack([part[1] for part in batch])
+    regions = np.concatenate([np.full(part[1].shape[0], part[2]) for part in batch])
+    num_points, num_bands = bands.shape
+    sql = "SELECT nextval(pg_get_serial_sequence('point', 'id')) FROM generate_series(1, $num_points);"
+    ids = np.array([row[0] for row in db.execute(sql, {'num_points': num_points})], dtype=np.int64)
+
+    cursor = db.get_connection().cursor()
+    fields = [locations[LOCATION_FIELDS.index(field)] for field in
+              ['X', 'Y', 'map_X', 'map_Y', 'latitude', 'longitude']]
+    # long_lat is stored as (latitude, longitude), as in add_point
+    _copy(cursor, "point (id, local_location, relative_location, long_lat, region)",
+          np.column_stack([ids] + fields + [regions]),
+          "%d\t(%.17g,%.17g)\t(%.17g,%.17g)\t(%.17g,%.17g)\t%d")
+    if get_point_spectrum():
+        _copy(cursor, "point_spectrum (point, bands)", np.column_stack((ids, bands)),
+              "%d\t{" + ",".join(["%.9g"] * num_bands) + "}")
+    else:
+        columns = [bands.ravel(), np.repeat(ids, num_bands), np.tile(np.arange(1, num_bands + 1), num_points)]
+        row_format = "%.17g\t%d\t%d\t"
+        if len(wavelengths) >= num_bands:
+            columns.append(np.tile(wavelengths[:num_bands], num_points))
+            row_format += "%d"
+        else:
+            row_format += "\\N"
+        _copy(cursor, "spectrum (value, point, band_nr, wavelength)", np.column_stack(columns), row_format)
+    commit()
+    return num_points
+
+
+def _copy(cursor, table, rows, row_format):
+    """
+        Copies the rows to the given table with COPY FROM STDIN (in the text format).
+    :param cursor:      A (psycopg2) cursor of the connection of the database.
+    :param table:       The table, and the columns, e.g. 'point (id, region)'.
+    :param rows:        The values of the rows.
+    :param row_format:  The format of a row (tab separated), as in numpy.savetxt.
+    :type cursor:       psycopg2.extensions.cursor
+    :type table:        str
+    :type rows:         np.ndarray
+    :type row_format:   str
+    :return:            None
+    :rtype:             None
+    """
+    # numpy.savetxt writes bytes on Python 2, and encodes its text on Python 3
+    data = BytesIO()
+    np.savetxt(data, rows, fmt=row_format)
+    data.seek(0)
+    cursor.copy_expert("COPY " + table + " FROM STDIN", data)
+
+
+@session
 def add_point(region, point):
     """
        Adds the specified point to a region (of interest)
@@ -303,10 +556,11 @@ def add_point(region, point):
     return p
 
 
-@db_session
+@session
 def add_spectrum(point, bands):
     """
-        Adds the given spectrum (the list of bands) to the given point
+        Adds the given spectrum (the list of bands) to the given point; as a single array in point_spectrum if that
+        table exists, or as one row per band in spectrum.
     :param point:           A point in a region, to which we wish to add a spectral bands
     :param bands:           The spectrum, as discrete bands
     :type point:            Point
@@ -314,6 +568,12 @@ def add_spectrum(point, bands):
     :return:                None
     :rtype:                 None
     """
+    if get_point_spectrum():
+        # The point must be written, so that it has an id
+        pny.flush()
+        db.execute("INSERT INTO point_spectrum (point, bands) VALUES ($point_id, $bands);",
+                   {'point_id': point.id, 'bands': [float(band) for band in bands]})
+        return
     wavelengths = pny.select(wvl for wvl in Wavelengths if point.region.dataset.type == wvl.name)[:]
     for i in range(len(bands)):
         band = bands[i]
@@ -323,7 +583,7 @@ def add_spectrum(point, bands):
                  wavelength=wavelengths[i])
 
 
-@db_session
+@session
 def add_wavelength_to_dataset(dataset, spectral_type, debug=False, commit_at_end=False):
     """
         Adds information about the spectral bands for the given dataset
@@ -358,43 +618,55 @@ def add_wavelength_to_dataset(dataset, spectral_type, debug=False, commit_at_end
                         datasets=dataset,
                         band_nr=get_one_indexed(i))
     if not commit_at_end:
-        db.commit()
+        commit()
 
 
-@db_session
-def add_wavelength_to_points(spectral_type, dataset, commit_at_end=False):
+@session
+def add_wavelength_to_points(spectral_type, dataset, commit_at_end=False, batch_size=WAVELENGTH_BATCH_SIZE):
     """
-        Adds the wavelength
+        Links each band of the spectra in the given dataset to its wavelength, with one UPDATE per batch of points.
     :param spectral_type:   The type of spectral data (MASTER/AVIRIS)
     :param dataset:         The dataset to which the wavelength information is to be added
-    :param commit_at_end:   Toggles whether or not all the changes are to be committed at the end. Default is False.
+    :param commit_at_end:   Toggles whether or not all the changes are to be committed at the end. Default is False,
+                            in which case each batch is committed.
+    :param batch_size:      The (largest) range of point ids that is updated in each statement. Default is
+                            WAVELENGTH_BATCH_SIZE.
     :type spectral_type:    str
     :type dataset:          Dataset
     :type commit_at_end:    bool
-    :return:
+    :type batch_size:       int
+    :return:                The number of spectrum rows that were updated.
+    :rtype:                 int
     """
-    spectralType = spectral_type
-    datasetID = dataset.id
-    stuff = db.execute(
+    sql = """
+        SELECT min(point.id), max(point.id)
+        FROM point, region
+        WHERE point.region = region.id AND region.dataset = $dataset_id;
         """
-        SELECT spectrum.id, spectrum.band_nr, spectrum.value, spectrum.point
-        FROM spectrum, point, region, dataset
+    first, last = db.execute(sql, {'dataset_id': dataset.id}).fetchone()
+    if first is None:
+        return 0
+    sql = """
+        UPDATE spectrum SET wavelength = wavelengths.id
+        FROM wavelengths, point, region
         WHERE spectrum.point = point.id AND
-        point.region = region.id AND
-        region.dataset = """ + str(datasetID) + ";"
-    )
-    for (spectrumID, bandNR, value, point) in stuff:
-        db.execute(
-            """
-            UPDATE spectrum SET wavelength = """ + str(bandNR) + """
-            WHERE id = (SELECT id FROM wavelengths
-                        WHERE name = """ + spectralType + " AND band_nr = " + str(bandNR) + ")"
-        )
-    if not commit_at_end:
-        db.commit()
+              point.region = region.id AND
+              region.dataset = $dataset_id AND
+              wavelengths.name = $spectral_type AND
+              wavelengths.band_nr = spectrum.band_nr AND
+              spectrum.point BETWEEN $start AND $end;
+        """
+    total = 0
+    for start in range(first, last + 1, batch_size):
+        cursor = db.execute(sql, {'dataset_id': dataset.id, 'spectral_type': spectral_type,
+                                  'start': start, 'end': start + batch_size - 1})
+        total += cursor.rowcount
+        if not commit_at_end:
+            commit()
+    return total
 
 
-@db_session
+@session
 def add_normalizing(roi, dataset, debug=False):
     """
         Adds the normalizing data (max, min, mean, std) to the dataset.
@@ -417,10 +689,10 @@ def add_normalizing(roi, dataset, debug=False):
              minimum=roi.minimums[i],
              mean=roi.means[i],
              std_dev=roi.standard_deviations[i])
-    db.commit()
+    commit()
 
 
-@db_session
+@session
 def add_dataset(name, spectral_type=""):
     """
         Adds the given name to the database of main data sets. If a spectral type is given, e.g. MASTER, or AVIRIS, than
@@ -498,8 +770,10 @@ def export_to_csv(region="", dataset="", k=0, proportion=1.0, delimiter=','):
     f = open(file_name, 'w')
     f.write(header)
     for sample_region in areas:
-        points = get_sample(sample_region, dataset, proportion, k=k, select_criteria=8)
-        _write_to_file(points, delimiter, f)
+        with session("export_to_csv"):
+            # The points are written as they arrive, instead of getting all of them first
+            points = get_sample(sample_region, dataset, proportion, k=k, select_criteria=8, stream=True)
+            _write_to_file(points, delimiter, f)
         print(str(i / len(UNIQUE_CLASSES) * 100) + "% complete.")
         i += 1
     f.close()
@@ -722,10 +996,7 @@ def get_points_from_region(region, dataset="", normalizing_mode="", k=0):
         select_criteria = 3
     points = get_sample(region, dataset, -1, select_criteria=select_criteria)
     if k > 0:
-        neighborhoods = [None] * len(points)
-        for i in range(len(points)):
-            point = points[i]
-            neighborhoods[i] = get_nearest_neighbors_to_point(point, k, dataset)
+        neighborhoods = get_nearest_neighbor_to_points(points, k, dataset)
         if normalizing_mode != "":
             return normalize(neighborhoods, normalizing_mode)
         return neighborhoods
@@ -735,7 +1006,7 @@ def get_points_from_region(region, dataset="", normalizing_mode="", k=0):
         return points
 
 
-@db_session
+@session
 def get_nearest_neighbors_to_point(point, k, dataset, normalize_mode="",
                                    ignore_dataset=False, select_criteria=3):
     """
@@ -782,36 +1053,23 @@ def get_nearest_neighbors_to_point(point, k, dataset, normalize_mode="",
             and (select_criteria == 3 or 6 <= select_criteria <= 8) or normalize_mode == "")
 
     # Getting the longitude, and latitude
-    if isinstance(point, Point):
-        longitude = point.long_lat[0]
-        latitude = point.long_lat[1]
-    elif isinstance(point, BasePoint):
-        longitude = point.longitude
-        latitude = point.latitude
-    else:
-        raise TypeError("The type for point is not supported. The type of point is ", type(point))
+    longitude, latitude = _get_longitude_latitude(point)
 
     # Selecting the appropriate SELECT clause, followed by a ORDERED BY clause
     select_from_sql = select_sql_point(select_criteria)
 
     # Initial ORDER BY clause (what attribute are we compare against?)
-    order_by_sql = nearest_neighbor_sql(longitude, latitude, k)
-
-    # Do we consider the dataset the points belong to?
-    dataset_sql = ""
-    if not ignore_dataset:
-        if 'WHERE' in select_from_sql:
-            dataset_sql = dataset_to_string(dataset)
-        elif dataset != "":
-            dataset_sql = " WHERE " + dataset_to_string(dataset, True)
+    order_by_sql, params = nearest_neighbor_sql(longitude, latitude, k)
 
     # There is no need for enforcing the areas to be of the same type, as it might be important that the neighbor
     # is of a different region
+    dataset_sql, dataset_params = _neighbor_dataset_sql(select_from_sql, dataset, ignore_dataset)
+    params.update(dataset_params)
 
     sql = select_from_sql + dataset_sql + order_by_sql + ";"
 
-    # Execute the generated SQL
-    query = db.execute(sql)
+    # Execute the generated SQL (the same statement for every point)
+    query = execute_prepared(sql, params)
 
     # Converting the query result to normal points.
     points = query_to_point_list(query, normalize_mode)
@@ -819,10 +1077,12 @@ def get_nearest_neighbors_to_point(point, k, dataset, normalize_mode="",
     return points
 
 
+@session
 def get_nearest_neighbor_to_points(points, k, dataset, normalize_mode="",
-                                   ignore_dataset=False, select_criteria=3):
+                                   ignore_dataset=False, select_criteria=3, batch_size=NEIGHBOR_BATCH_SIZE):
     """
-        This method does the same as get_nearest_neighbor_to_point for a list of points.
+        This method does the same as get_nearest_neighbor_to_point for a list of points, but gets the neighbors of
+        batch_size points, and their spectra, in a single query (see Database.helpers.nearest_neighbors_sql).
         Returns the k-nearest neighbors for the given points. (This method will return k + 1 points in a
         list, as the given point will be included, unless include_point is set to False)
         If the ignore_dataset flag is set to True, we will not care about the points belonging to the same dataset.
@@ -852,24 +1112,129 @@ def get_nearest_neighbor_to_points(points, k, dataset, normalize_mode="",
                                 If the mode is different from these, a warning will be issued, and
                                 mode 1 will be selected.
                                 NB: When mode 3, or 6 is NOT selected, the set will not be normalized!
+    :param batch_size:      The number of points whose neighbors are found in each query. Default is
+                            NEIGHBOR_BATCH_SIZE.
     :type points:           list of [RegionOfInterest.region.Point | Point | RegionOfInterest.region.BasePoint]
     :type k:                int
     :type dataset:          list of [str] | str
     :type normalize_mode:   str
     :type ignore_dataset:   bool
     :type select_criteria:  int
+    :type batch_size:       int
     :return:                list of List of points sorted in ascending order by how close they are to the given point.
                             One list for each point in the input list.
     :rtype:                 list of [list of [RegionOfInterest.region.BasePoint | Point]]
     """
-    neighbors = [None] * len(points)
-    for i in range(len(points)):
-        point = points[i]
-        neighbors[i] = get_nearest_neighbors_to_point(point, k, dataset, normalize_mode, ignore_dataset,
-                                                      select_criteria)
+    assert ((is_min_max(normalize_mode) or is_gaussian(normalize_mode))
+            and (select_criteria == 3 or 6 <= select_criteria <= 8) or normalize_mode == "")
+
+    select_from_sql = select_sql_point(select_criteria)
+    dataset_sql, params = _neighbor_dataset_sql(select_from_sql, dataset, ignore_dataset)
+    sql, knn_params = nearest_neighbors_sql(select_from_sql, dataset_sql, k)
+    sql += ";"
+    params.update(knn_params)
+    neighbors = [[] for _ in range(len(points))]
+    all_neighbors = []
+    for start in range(0, len(points), batch_size):
+        locations = [_get_longitude_latitude(point) for point in points[start:start + batch_size]]
+        params['longitudes'] = [float(location[0]) for location in locations]
+        params['latitudes'] = [float(location[1]) for location in locations]
+        query = execute_prepared(sql, params)
+        # The first four columns are the (one-indexed) query point, the spectrum, the distance, and the id
+        description = _get_description(query.description[4:])
+        rows = query.fetchall()
+        spectra = _to_band_matrix([row[1] for row in rows])
+        for i in range(len(rows)):
+            neighbor = get_point(rows[i][4:], description, spectra[i])
+            neighbors[start + rows[i][0] - 1].append(neighbor)
+            all_neighbors.append(neighbor)
+    if normalize_mode != "" and len(all_neighbors) > 0:
+        normalize(all_neighbors, normalize_mode)
+    for neighborhood in neighbors:
+        neighborhood.sort()
     return neighbors
 
 
+def _get_longitude_latitude(point):
+    """
+        Gives the longitude, and latitude of the given point.
+    :param point:   The point.
+    :type point:    RegionOfInterest.region.Point | Point | RegionOfInterest.region.BasePoint
+    :return:        The longitude, and the latitude.
+    :rtype:         (float, float)
+    """
+    if isinstance(point, Point):
+        return point.long_lat[0], point.long_lat[1]
+    elif isinstance(point, BasePoint):
+        return point.longitude, point.latitude
+    else:
+        raise TypeError("The type for point is not supported. The type of point is ", type(point))
+
+
+def _neighbor_dataset_sql(select_from_sql, dataset, ignore_dataset=False):
+    """
+        Gives the restriction on the datasets of the neighbors of a point.
+    :param select_from_sql: The SELECT ... FROM ... [WHERE ...] clause of the neighbors (see select_sql_point).
+    :param dataset:         The dataset(s) we want to get the neighbors from.
+    :param ignore_dataset:  Toggles whether or not the datasets are ignored, in which case there is no restriction.
+    :type select_from_sql:  str
+    :type dataset:          list of [str] | str
+    :type ignore_dataset:   bool
+    :return:                The restriction as a SQL clause, or "", and its parameters.
+    :rtype:                 (str, dict of [str, list of [str]])
+    """
+    # Do we consider the dataset the points belong to?
+    dataset_sql, params = "", {}
+    if not ignore_dataset:
+        if 'WHERE' in select_from_sql:
+            dataset_sql, params = dataset_to_sql(dataset)
+        elif dataset != "":
+            dataset_sql, params = dataset_to_sql(dataset, True)
+            dataset_sql = " WHERE " + dataset_sql
+    return dataset_sql, params
+
+
+def execute_prepared(sql, params=None):
+    """
+        Executes the given (parameterized) query as a prepared statement of the connection of the current session, so
+        that PostgreSQL plans the query once per connection, instead of every time it is executed. The statement is
+        prepared the first time the query is executed on the connection.
+    :param sql:     A query, whose parameters are named $name.
+    :param params:  The values of the parameters. Default is None; no parameters.
+    :type sql:      str
+    :type params:   dict of [str, object]
+    :return:        The cursor of the executed query.
+    :rtype:         psycopg2.extensions.cursor
+    """
+    name, names = prepare(sql)
+    cursor = db.get_connection().cursor()
+    if len(names) > 0:
+        cursor.execute("EXECUTE " + name + " (" + ", ".join(["%s"] * len(names)) + ");",
+                       [params[param] for param in names])
+    else:
+        cursor.execute("EXECUTE " + name + ";")
+    return cursor
+
+
+def prepare(sql):
+    """
+        Prepares the given (parameterized) query on the connection of the current session, unless it has already been
+        prepared on it.
+    :param sql: A query, whose parameters are named $name.
+    :type sql:  str
+    :return:    The name of the prepared statement, and the names of its parameters, in order.
+    :rtype:     (str, list of [str])
+    """
+    connection = db.get_connection()
+    prepared = _prepared_statements.setdefault((id(connection), connection.get_backend_pid()), set())
+    positional_sql, names = to_positional(sql.strip().rstrip(';'))
+    name = "statement_" + md5(positional_sql.encode('utf-8')).hexdigest()[:16]
+    if name not in prepared:
+        connection.cursor().execute("PREPARE " + name + " AS " + positional_sql + ";")
+        prepared.add(name)
+    return name, names
+
+
 def get_min_max(datasets="", be_assertive=False, take_averages=False, use_stored_values=True):
     """
         Gets a dict of list og minimums, and maximums for each datasets. This can be refined to give the minimums, and
@@ -946,7 +1311,7 @@ def _average_over_datasets(data):
     return {'MASTER': result['MASTER'], 'AVIRIS': result['AVIRIS']}
 
 
-@db_session
+@session
 def get_normalizing_data(params, datasets="", be_assertive=False, take_averages=False, use_stored_values=True):
     """
         Gets a dict of list of minimums, maximums, means, and standard deviations for each datasets.
@@ -975,8 +1340,8 @@ def get_normalizing_data(params, datasets="", be_assertive=False, take_averages=
     """
     # Creates the appropriate SQL for getting the minimums and maximums
 
-    sql = get_normalizing_sql(params, datasets, use_stored_values)
-    query = db.execute(sql)
+    sql, sql_params = get_normalizing_sql(params, datasets, use_stored_values)
+    query = db.execute(sql, sql_params)
 
     # Sort, and group the normalizing data
     minimums, maximums, means, standard_deviations = {}, {}, {}, {}
@@ -1082,19 +1447,17 @@ def _get_description(description):
 
 def query_to_point_list(query, normalize_mode="", number_of_elements=-1, user_row_count=False, background=False):
     """
-        Takes a query of points (id, long_lat, region), or everything from point, gets the spectrum for each point,
-        and then creates a list of BasePoints, or Points.
+        Takes a query of points (id, long_lat, region), or everything from point, gets the spectra of all the points
+        in one go (see get_spectra), and then creates a list of BasePoints, or Points, whose bands are rows of a single
+        matrix.
         If you want a point, the query has to have the following
         (id, local_location, relative_location, long_lat, region)
     :param query:               The query, which has selected (id, region, long_lat) for the points.
     :param normalize_mode:      Is  the data to be normalized? Can be blank "" -> No normalization.
                                 'min-max' -> normalizes the data by minimums, and maximums (rescales).
                                 'gaussian' -> (val - mean) / std. Default is no normalization.
-    :param number_of_elements:  To speed things up, you can specify the number number of elements that will be in the
-                                query.
-    :param user_row_count:      Toggles whether or not to use the rowcount filed in the query as a parameter of length.
-                                Default is False.
-                                NOTE: This will overwrite whatever value of number_of_elements was passed.
+    :param number_of_elements:  Not used, as all the rows of the query are fetched at once. Kept for compatibility.
+    :param user_row_count:      Not used, as all the rows of the query are fetched at once. Kept for compatibility.
     :param background:          Is this considered background, or target? Default is False.
                                 Sets the first element to 0 if True, or 1 if False, i.e. 1 if the pointlist is the
                                 target, and 0 if it is background.
@@ -1108,42 +1471,158 @@ def query_to_point_list(query, normalize_mode="", number_of_elements=-1, user_ro
     """
     # TODO: Implement background
     description = _get_description(query.description)
-    if user_row_count:
-        number_of_elements = query.rowcount
-    if number_of_elements > 0:
-        points = [None] * number_of_elements
-        i = 0
-        for point_tuple in query:
-            points[i] = get_point(point_tuple, description)
-            i += 1
-    else:
-        points = []
-        for point_tuple in query:
-            points.append(get_point(point_tuple, description))
-    if normalize_mode != "":
+    return _rows_to_points(query.fetchall(), description, normalize_mode)
+
+
+def _rows_to_points(point_tuples, description, normalize_mode=""):
+    """
+        Creates points of the given rows, getting the spectra of all the points in one go (see get_spectra).
+    :param point_tuples:    The rows of a query of points (see get_point).
+    :param description:     A dictionary of columns names with their associated index in the rows.
+    :param normalize_mode:  Is the data to be normalized? (see query_to_point_list) Default is "".
+    :type point_tuples:     list of [tuple]
+    :type description:      dict of [str, int]
+    :type normalize_mode:   str
+    :return:                List of BasePoints/Points with their spectrum.
+    :rtype:                 list of [RegionOfInterest.region.BasePoint | RegionOfInterest.region.Point]
+    """
+    # The spectra of all the points are fetched at once, instead of one query per point
+    spectra = get_spectra([point_tuple[0] for point_tuple in point_tuples])
+    points = [get_point(point_tuples[i], description, spectra[i]) for i in range(len(point_tuples))]
+    if normalize_mode != "" and len(points) > 0:
         points = normalize(points, normalize_mode)
     return points
 
 
-@db_session
-def get_point(point_tuple, description):
+def stream_query(sql, batch_size=STREAM_BATCH_SIZE, as_arrays=False, normalize_mode="", k=0, dataset="", params=None):
+    """
+        Does the same as query_to_point_list, but runs the query with a named (server-side) cursor, and fetches
+        batch_size rows at the time, so that the points can be used as they arrive, and so that only a single batch is
+        in memory at the time.
+        The generator holds a session (see Database.session) while it is consumed, as the cursor is part of its
+        transaction, so it may be consumed outside of one; the session of the caller is reused, if there is one.
+    :param sql:             A query of points (see query_to_point_list).
+    :param batch_size:      The number of rows that are fetched at the time. Default is STREAM_BATCH_SIZE.
+    :param as_arrays:       Toggles whether each batch is given as (ids, bands), where ids is an array of the ids of
+                            the points, and bands is a (number of points, number of bands) matrix of their spectra, or
+                            a (number of points, k + 1, number of bands) array of the spectra of their neighborhoods
+                            if k > 0, instead of the points one by one. Default is False.
+    :param normalize_mode:  Is the data to be normalized? (see query_to_point_list) Default is "".
+    :param k:               The number of neighbors of each point (see get_nearest_neighbor_to_points), in which case
+                            the neighborhoods are given instead of the points. Default is 0.
+    :param dataset:         The dataset(s) of the neighbors, when k > 0. Default is "".
+    :param params:          The values of the (named) parameters of the query. Default is None; no parameters.
+    :type sql:              str
+    :type batch_size:       int
+    :type as_arrays:        bool
+    :type normalize_mode:   str
+    :type k:                int
+    :type dataset:          str | list of [str]
+    :type params:           dict of [str, object]
+    :return:                The points (or neighborhoods) one by one, or the batches as arrays.
+    :rtype:                 collections.Iterable[RegionOfInterest.region.BasePoint | list | (np.ndarray, np.ndarray)]
+    """
+    # The session is opened by the generator itself, so that it lasts until the last batch has been fetched
+    with session('stream_query'):
+        cursor = db.get_connection().cursor(name="point_stream_" + str(next(_stream_ids)))
+        cursor.itersize = batch_size
+        try:
+            if params:
+                cursor.execute(to_pyformat(sql), params)
+            else:
+                cursor.execute(sql)
+            while True:
+                point_tuples = cursor.fetchmany(batch_size)
+                if len(point_tuples) == 0:
+                    break
+                points = _rows_to_points(point_tuples, _get_description(cursor.description), normalize_mode)
+                ids = np.array([point_tuple[0] for point_tuple in point_tuples], dtype=np.int64)
+                if k > 0:
+                    neighborhoods = get_nearest_neighbor_to_points(points, k, dataset, normalize_mode)
+                    if as_arrays:
+                        yield ids, np.array([_neighbors_to_matrix(neighborhood) for neighborhood in neighborhoods])
+                    else:
+                        for neighborhood in neighborhoods:
+                            yield neighborhood
+                elif as_arrays:
+                    yield ids, np.array([point.bands for point in points])
+                else:
+                    for point in points:
+                        yield point
+        finally:
+            cursor.close()
+
+
+@session
+def get_spectra(point_ids):
+    """
+        Gets the spectra of the given points as a single matrix, fetching the spectra of SPECTRA_BATCH_SIZE points per
+        query.
+    :param point_ids:   The ids of the points.
+    :type point_ids:    list of [int]
+    :return:            The (number of points, number of bands) matrix of the spectra, in the same order as the ids.
+                        Points without a spectrum (or with fewer bands than the others) are filled with NaN.
+    :rtype:             np.ndarray
+    """
+    spectra = {}
+    for start in range(0, len(point_ids), SPECTRA_BATCH_SIZE):
+        ids = [int(point_id) for point_id in point_ids[start:start + SPECTRA_BATCH_SIZE]]
+        if get_point_spectrum():
+            sql = "SELECT point, bands FROM point_spectrum WHERE point = ANY($ids);"
+        else:
+            sql = """
+                SELECT point, array_agg(value ORDER BY band_nr)
+                FROM spectrum
+                WHERE point = ANY($ids)
+                GROUP BY point;"""
+        for point_id, values in db.execute(sql, {'ids': ids}):
+            spectra[point_id] = values
+    return _to_band_matrix([spectra.get(point_id) for point_id in point_ids])
+
+
+def _to_band_matrix(spectra):
+    """
+        Puts the given spectra into a single matrix.
+    :param spectra: The spectrum (list of bands) of each point, or None if the point does not have a spectrum.
+    :type spectra:  list of [list of [float] | None]
+    :return:        The (number of points, number of bands) matrix of the spectra. Missing bands are NaN.
+    :rtype:         np.ndarray
+    """
+    num_bands = max([len(values) for values in spectra if values is not None] or [0])
+    matrix = np.full((len(spectra), num_bands), np.nan)
+    for i in range(len(spectra)):
+        values = spectra[i]
+        if values is not None:
+            matrix[i, :len(values)] = values
+    return matrix
+
+
+def get_point(point_tuple, description, bands=None):
     """
         Takes a tuple, and makes it into a Point, or BasePoint depending on how long the tuple is. This method will also
-        get the spectrum for the given point as well
+        get the spectrum for the given point as well, unless it is given.
     :param point_tuple: Tuple of numbers representing a point. May be the following:
                             * (id, long_lat, [region], [dataset]) or
                             * (id, local_location, relative_location, long_lat, [name], [sub_name], [region], [dataset]),
                         where [] is optional, and might be used in the future.
     :param description: A dictionary of columns names with their associated index in the tuple.
+    :param bands:       The spectrum of the point, e.g. a row of the matrix given by get_spectra. Default is None; the
+                        spectrum is fetched from the database.
     :type point_tuple:  tuple
     :type description:  dict of [str, int]
+    :type bands:        np.ndarray
     :return:            A single point (Point or BasePoint) that is equivalent to the given tuple.
     :rtype:             BasePoint | RegionsOfInterest.region.Point
     """
     point_id = point_tuple[0]
-    sql = "SELECT value FROM spectrum WHERE point = " + str(point_id) + " ORDER BY band_nr;"
-    query = db.execute(sql)
-    bands = [value[0] for value in query]
+    if bands is None and get_point_spectrum():
+        sql = "SELECT bands FROM point_spectrum WHERE point = $point_id;"
+        rows = execute_prepared(sql, {'point_id': point_id}).fetchall()
+        bands = np.array(rows[0][0] if rows else [], dtype=np.float64)
+    elif bands is None:
+        sql = "SELECT value FROM spectrum WHERE point = $point_id ORDER BY band_nr;"
+        query = execute_prepared(sql, {'point_id': point_id})
+        bands = np.array([value[0] for value in query], dtype=np.float64)
     values = {}
     for key in POINT_FIELDS:
         if key in description:
@@ -1170,7 +1649,7 @@ def get_point(point_tuple, description):
         return ROIPoint(point_id, x, y, map_x, map_y, latitude, longitude, bands, name, sub_name, region, dataset)
 
 
-@db_session
+@session
 def get_total_number_of_samples():
     """
     Returns the total number of points in the database
@@ -1183,12 +1662,14 @@ def get_total_number_of_samples():
         return itm[0]
 
 
-@db_session
-def get_sample(area, dataset, number_of_samples, k=0, select_criteria=1, background=False, random_sample=False):
+@session
+def get_sample(area, dataset, number_of_samples, k=0, select_criteria=1, background=False, random_sample=False,
+               stream=False, batch_size=STREAM_BATCH_SIZE, as_arrays=False):
     """
         Returns a random sample of number_of_samples points which lies in the given area (which may be regions, or a
         specific region when given a sub-name; e.g. name_sub-name, or just name for the value of area. If background
         is set to True, the resulting collection will be a random sample of anything but the given area.
+        If stream is set to True, the sample is streamed from a server-side cursor instead (see stream_query).
     :param area:                Name of the region we want the sample to be from (or not from). If the underscore
                                 character is in the name, it will be assumed as a sub-region,
                                 e.i. sub_name will be given.
@@ -1224,6 +1705,11 @@ def get_sample(area, dataset, number_of_samples, k=0, select_criteria=1, backgro
                                 'background' of that region, e.i. anything but that region.
     :param random_sample:       Toggles whether or not the sample is to be randomized or not. Default is not, as it is
                                 expensive (at the moment).
+    :param stream:              Toggles whether or not the sample is streamed (see stream_query). Default is False.
+    :param batch_size:          The number of rows that are fetched at the time, when streaming. Default is
+                                STREAM_BATCH_SIZE.
+    :param as_arrays:           Toggles whether or not the streamed sample is given as batches of arrays (see
+                                stream_query). Default is False.
     :type area:                 str
     :type dataset:              str | list of [str]
     :type number_of_samples:    int | float
@@ -1231,9 +1717,31 @@ def get_sample(area, dataset, number_of_samples, k=0, select_criteria=1, backgro
     :type select_criteria:      int
     :type background:           bool
     :type random_sample:        bool
+    :type stream:               bool
+    :type batch_size:           int
+    :type as_arrays:            bool
     :return:                    A list of points which constitutes a sample from the given region, or a list of points
-                                constitutes a sample from the background of that region.
-    :rtype:                     list of [RegionOfInterest.region.Point]
+                                constitutes a sample from the background of that region, or a generator of the sample,
+                                if it is streamed.
+    :rtype:                     list of [RegionOfInterest.region.Point] | collections.Iterable
+    """
+    sql, params = _get_sample_sql(area, dataset, number_of_samples, select_criteria, background, random_sample)
+    if stream:
+        return stream_query(sql, batch_size, as_arrays, k=k, dataset=dataset, params=params)
+    query = execute_prepared(sql, params)
+    points = query_to_point_list(query, number_of_elements=number_of_samples, user_row_count=True)
+    if k <= 0:
+        return points
+    else:
+        return get_nearest_neighbor_to_points(points, k, dataset)
+        # TODO: Add info about whether or not this is a target.
+
+
+def _get_sample_sql(area, dataset, number_of_samples, select_criteria=1, background=False, random_sample=False):
+    """
+        Gives the query of a sample of points (see get_sample for the parameters).
+    :return:    The SQL query, and its parameters.
+    :rtype:     (str, dict of [str, object])
     """
     # Splitting the area-name into (general) name, and sub name
     if '_' in area:
@@ -1248,9 +1756,10 @@ def get_sample(area, dataset, number_of_samples, k=0, select_criteria=1, backgro
     if dataset != "":
         if not get_extended_point() and 'dataset' not in select_sql:
             select_sql += ", dataset "
-        dataset_sql = dataset_to_string(dataset)
+        dataset_sql, params = dataset_to_sql(dataset)
     else:
-        dataset_sql = ""
+        dataset_sql, params = "", {}
+    params['name'] = name
 
     # Define whether or not we are getting background
     if background:
@@ -1271,12 +1780,13 @@ def get_sample(area, dataset, number_of_samples, k=0, select_criteria=1, backgro
     else:
         table_name = "region."
         # Joins the table 'region', with the table 'point'.
-        where_sql += " point.region = region.id AND region.name" + equal_operator + "'" + name + "'"
+        where_sql += " point.region = region.id AND "
 
     # Specify the name of the region we are interested in.
-    where_sql += table_name + "name " + equal_operator + "'" + name + "'"
+    where_sql += table_name + "name" + equal_operator + "$name"
     if sub_name != "":
-        where_sql += " AND " + table_name + "sub_region " + equal_operator + "'" + sub_name + "'"
+        where_sql += " AND " + table_name + "sub_name" + equal_operator + "$sub_name"
+        params['sub_name'] = sub_name
 
     # Do we select randomly?
     if isinstance(number_of_samples, float) and 0 < number_of_samples <= 1:
@@ -1284,7 +1794,8 @@ def get_sample(area, dataset, number_of_samples, k=0, select_criteria=1, backgro
             sample_sql = " AND"
         else:
             sample_sql = " WHERE"
-        sample_sql += " random() <= " + str(number_of_samples)
+        sample_sql += " random() <= $proportion"
+        params['proportion'] = number_of_samples
     else:
         if random_sample:
             if USE_NAIVE_SAMPLING:
@@ -1295,26 +1806,21 @@ def get_sample(area, dataset, number_of_samples, k=0, select_criteria=1, backgro
                     order_by_sql = " AND"
                 else:
                     order_by_sql = " WHERE"
-                order_by_sql += " random() <= " + str(number_of_samples / total_number_of_samples)
+                order_by_sql += " random() <= $proportion"
+                params['proportion'] = number_of_samples / total_number_of_samples
         else:
             order_by_sql = ""
 
         # Limits the outputs if necessary
         if number_of_samples > 0:
-            limit_sql = " LIMIT " + str(number_of_samples)
+            limit_sql = " LIMIT $limit"
+            params['limit'] = number_of_samples
         else:
             limit_sql = ""
         sample_sql = order_by_sql + limit_sql
 
     # Compile the SQL query
-    sql = select_sql + where_sql + dataset_sql + sample_sql + ";"
-    query = db.execute(sql)
-    points = query_to_point_list(query, number_of_elements=number_of_samples, user_row_count=True)
-    if k <= 0:
-        return points
-    else:
-        return get_nearest_neighbor_to_points(points, k, dataset)
-        # TODO: Add info about whether or not this is a target.
+    return select_sql + where_sql + dataset_sql + sample_sql + ";", params
 
 
 def point_to_postgres_point(*args):
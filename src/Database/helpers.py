@@ -2,11 +2,12 @@
 """
 False collection of helper functions for the connector.
 """
+import re
 from warnings import warn
 
 __author__ = 'Sindre Nistad'
 from Common.parameters import WAVELENGTHS
-from Common.settings import get_extended_point, get_norm_points
+from Common.settings import get_extended_point, get_norm_points, get_point_spectrum
 
 
 def select_sql_point(select_criteria=1):
@@ -91,7 +92,8 @@ def select_sql_point(select_criteria=1):
 
 def nearest_neighbor_sql(longitude, latitude, k):
     """
-    Gives an ORDER BY clause that gets the k nearest points to the given longitude, and latitude.
+    Gives an ORDER BY clause that gets the k nearest points to the given longitude, and latitude, with the values as
+    parameters ($longitude, $latitude, and $limit), so that the clause is the same for every point.
     NOTE:   The resulting query will have k + 1, as the nearest point is the point itself, and the result would be the
             k - 1 nearest neighbors.
     NOTE:   If the extended_point table is defined, it will be used wen convenient.
@@ -101,17 +103,57 @@ def nearest_neighbor_sql(longitude, latitude, k):
     :type longitude:                float
     :type latitude:                 float
     :type k:                        int
-    :return:                        An ORDER BY SQL clause.
-    :rtype:                         str
+    :return:                        An ORDER BY SQL clause, and its parameters.
+    :rtype:                         (str, dict of [str, float | int])
     """
     if get_extended_point():
-        order_by_sql = " ORDER BY long_lat <-> '("
+        order_by_sql = " ORDER BY long_lat <-> "
     else:
-        order_by_sql = " ORDER BY point.long_lat <-> '("
+        order_by_sql = " ORDER BY point.long_lat <-> "
 
     # Adding the actual point
-    order_by_sql += str(longitude) + ", " + str(latitude) + ")'::point LIMIT " + str(k + 1)
-    return order_by_sql
+    order_by_sql += "point($longitude, $latitude) LIMIT $limit"
+    return order_by_sql, {'longitude': float(longitude), 'latitude': float(latitude), 'limit': k + 1}
+
+
+def nearest_neighbors_sql(select_from_sql, dataset_sql, k):
+    """
+    Gives a query that gets the k + 1 nearest points to each of the locations given by the (array) parameters
+    $longitudes, and $latitudes, and the spectra of the points, in a single statement, by joining the locations
+    laterally with a query like the one given by nearest_neighbor_sql.
+    Each row is (query_index, bands, distance, neighbor_id, ...), where ... are the columns of select_from_sql, and
+    query_index is the (one-indexed) location the point is a neighbor of. The rows are ordered by the location, and
+    then by the distance.
+    NOTE:   If the point_spectrum table is defined, the spectra are read from it.
+    :param select_from_sql:         The SELECT ... FROM ... [WHERE ...] clause of the points (see select_sql_point).
+    :param dataset_sql:             The restriction on the datasets of the points (see dataset_to_sql), or "".
+    :param k:                       The number of neighbors we want to find.
+    :type select_from_sql:          str
+    :type dataset_sql:              str
+    :type k:                        int
+    :return:                        A SQL query, and its parameters (except $longitudes, and $latitudes).
+    :rtype:                         (str, dict of [str, int])
+    """
+    if select_from_sql.startswith("SELECT extended_point"):
+        table = "extended_point"
+    else:
+        table = "point"
+    distance_sql = table + ".long_lat <-> point(query_point.longitude, query_point.latitude)"
+    neighbor_sql = select_from_sql.replace("SELECT ", "SELECT " + distance_sql + " AS distance, " +
+                                           table + ".id AS neighbor_id, ", 1)
+    if get_point_spectrum():
+        spectrum_join_sql = " LEFT JOIN point_spectrum AS neighbor_spectrum " \
+                            "ON neighbor_spectrum.point = neighbor.neighbor_id "
+    else:
+        spectrum_join_sql = " LEFT JOIN LATERAL (" \
+                            "SELECT array_agg(value ORDER BY band_nr) AS bands FROM spectrum " \
+                            "WHERE spectrum.point = neighbor.neighbor_id) AS neighbor_spectrum ON TRUE "
+    return "SELECT query_point.query_index, neighbor_spectrum.bands, neighbor.* " \
+           "FROM unnest(CAST($longitudes AS float8[]), CAST($latitudes AS float8[])) " \
+           "WITH ORDINALITY AS query_point (longitude, latitude, query_index) " \
+           "CROSS JOIN LATERAL (" + neighbor_sql + dataset_sql + \
+           " ORDER BY distance LIMIT $limit) AS neighbor" + spectrum_join_sql + \
+           "ORDER BY query_point.query_index, neighbor.distance", {'limit': k + 1}
 
 
 def bands_to_string(dataset, delimiter, wavelength=False):
@@ -141,11 +183,12 @@ def bands_to_string(dataset, delimiter, wavelength=False):
     return string
 
 
-def dataset_to_string(dataset, single=False):
+def dataset_to_sql(dataset, single=False):
     """
         A method that takes a single dataset, or a list of datasets, and converts it into a SQL clause:
-        'AND (dataset[0] OR dataset[1] OR ... OR dataset[n-1])'. The datasets can be the full name of the dataset
-        or it can be the type, e.g. MASTER, or AVIRIS, or a mixture of the two.
+        'AND (dataset.name = ANY($dataset_names) OR dataset.type = ANY($dataset_types))', and its parameters. The
+        datasets can be the full name of the dataset or it can be the type, e.g. MASTER, or AVIRIS, or a mixture of
+        the two.
     NOTE:   If the table 'extended_point' has been defined, it will be used.
     :param dataset: A single dataset, or a list of datasets that we want to include in a query.
     :param single:          Toggles whether or not the sub query is the only part of the WHERE clause, or not.
@@ -153,43 +196,44 @@ def dataset_to_string(dataset, single=False):
                             In other words, if this flag is set, the AND (...) will be dropped.
     :type dataset:          str | list of [str]
     :type single:           bool
-    :return:        A single string of the form AND (dataset.name = dataset[0] OR ... OR dataset.name = dataset[n-1]) if
-                    the given string has only dataset-names in it, or it will return a single string of the form
-                    AND (dataset.type = dataset[0] OR ... OR dataset.type = dataset[n-1]) if the datasets have the word
-                    'MASTER' or 'AVIRIS' in it. If there is a combination of the two, a combination will be returned.
-    :rtype:         str
+    :return:        A single string of the form AND (dataset.name = ANY($dataset_names)) if the given string has only
+                    dataset-names in it, or it will return a single string of the form
+                    AND (dataset.type = ANY($dataset_types)) if the datasets have the word 'MASTER' or 'AVIRIS' in it.
+                    If there is a combination of the two, a combination will be returned. The parameters are the
+                    lists of names, and types.
+    :rtype:         (str, dict of [str, list of [str]])
     """
     if dataset == "" or dataset == []:
         warn("You did not give any databases, so you won't receive a SQL clause, "
-             "only a empty string. (dataset_to_string)")
-        return ""
+             "only a empty string. (dataset_to_sql)")
+        return "", {}
 
     if not isinstance(dataset, list):
         dataset = [dataset]
-    if not single:
-        dataset_sql = " AND ("
+    if get_extended_point():
+        table = ""
     else:
-        dataset_sql = ""
-    for elm in dataset:
-        if get_extended_point():
-            table = ""
-        else:
-            table = " dataset."
-        if 'MASTER' in dataset or 'AVIRIS' in elm:
-            dataset_sql += table + "type = '"
-        else:
-            dataset_sql += table + "name = '"
-        dataset_sql += elm + "' OR "
-    dataset_sql = dataset_sql[:-3]  # Removing the last 'or '
+        table = "dataset."
+    types = [elm for elm in dataset if 'MASTER' in elm or 'AVIRIS' in elm]
+    names = [elm for elm in dataset if elm not in types]
+    conditions = []
+    params = {}
+    if len(names) > 0:
+        conditions.append(table + "name = ANY($dataset_names)")
+        params['dataset_names'] = names
+    if len(types) > 0:
+        conditions.append(table + "type = ANY($dataset_types)")
+        params['dataset_types'] = types
+    dataset_sql = " OR ".join(conditions)
     if not single:
-        dataset_sql += ')'
-    return dataset_sql
+        dataset_sql = " AND (" + dataset_sql + ")"
+    return dataset_sql, params
 
 
 def get_normalizing_sql(params, datasets="", use_stored_values=True):
     """
     Helper method for getting the SQL for the actual normalizing data specified in params.
-    NOTE:   The method will use the 'extended_point', and 'norm_points' table(s) is it is defined.
+    NOTE:   The method will use the 'extended_point', 'norm_points', and 'point_spectrum' table(s) is it is defined.
     :param params:              List of normalizing data to be retried. Can be any combination of 'maximum', 'minimum',
                                 'mean', 'standard deviation'.
     :param datasets:            The dataset from which we which to get the normalizing data from. Can be the name of the
@@ -199,8 +243,10 @@ def get_normalizing_sql(params, datasets="", use_stored_values=True):
                                 in the database.
                                 Default is True.
     :return:                    A SQL statement that will get the normalizing data in the form 'band_nr', 'dataset',
-                                [[minimum], [maximum], [mean], [stddev]]
+                                [[minimum], [maximum], [mean], [stddev]], and its parameters.
+    :rtype:                     (str, dict of [str, list of [str]])
     """
+    dataset_params = {}
     if use_stored_values:
         select_sql = "SELECT band_nr, dataset"
         if 'minimum' in params:
@@ -214,21 +260,24 @@ def get_normalizing_sql(params, datasets="", use_stored_values=True):
         select_sql += " FROM norm "
 
         if datasets != "":
-            where_sql = "WHERE " + dataset_to_string(datasets)
+            dataset_sql, dataset_params = dataset_to_sql(datasets, True)
+            where_sql = "WHERE " + dataset_sql
         else:
             where_sql = ""
         order_sql = " ORDER BY band_nr ASC "
         sql = select_sql + where_sql + order_sql + ";"
     else:
         values = ""
+        # The columns of norm_points are named after the aggregates
+        value_sql = "" if get_norm_points() else "(value)"
         if 'minimum' in params:
-            values += ", min "
+            values += ", min" + value_sql + " "
         if 'maximum' in params:
-            values += ", max "
+            values += ", max" + value_sql + " "
         if 'mean' in params:
-            values += ", avg "
+            values += ", avg" + value_sql + " "
         if 'standard' in params or 'standard deviation' in params:
-            values += ", stddev "
+            values += ", stddev" + value_sql + " "
         select_sql = "SELECT band_nr, dataset " + values
 
         if get_norm_points():
@@ -236,17 +285,61 @@ def get_normalizing_sql(params, datasets="", use_stored_values=True):
             where_sql = ""
             group_by_sql = ""
         elif get_extended_point():
-            from_sql = " FROM spectrum, extended_point "
+            from_sql = " FROM " + spectrum_sql() + ", extended_point "
             where_sql = " WHERE spectrum.point = extended_point.id "
             group_by_sql = " GROUP BY band_nr, dataset "
         else:
-            from_sql = " FROM spectrum, point, region, dataset "
+            from_sql = " FROM " + spectrum_sql() + ", point, region, dataset "
             where_sql = " WHERE point.region = region.id AND region.dataset = dataset.id AND spectrum.point = point.id"
             group_by_sql = " GROUP BY band_nr, dataset.id "
         order_by_sql = " ORDER BY band_nr ASC "
         if datasets != "":
-            where_sql += dataset_to_string(datasets)
+            dataset_sql, dataset_params = dataset_to_sql(datasets)
+            where_sql += dataset_sql
 
         sql = select_sql + from_sql + where_sql + group_by_sql + order_by_sql + ';'
 
-    return sql
+    return sql, dataset_params
+
+
+def to_positional(sql):
+    """
+        Converts the named parameters ($name) of a query to positional parameters ($1, $2, ...), as used by PREPARE.
+    :param sql: A query with named parameters.
+    :type sql:  str
+    :return:    The query with positional parameters, and the names of the parameters, in order.
+    :rtype:     (str, list of [str])
+    """
+    names = []
+
+    def replace(match):
+        name = match.group(1)
+        if name not in names:
+            names.append(name)
+        return "$" + str(names.index(name) + 1)
+    return re.sub(r'\$([A-Za-z_]\w*)', replace, sql), names
+
+
+def to_pyformat(sql):
+    """
+        Converts the named parameters ($name) of a query to the parameters of psycopg2 (%(name)s).
+    :param sql: A query with named parameters.
+    :type sql:  str
+    :return:    The query for a psycopg2 cursor.
+    :rtype:     str
+    """
+    return re.sub(r'\$([A-Za-z_]\w*)', r'%(\1)s', sql.replace('%', '%%'))
+
+
+def spectrum_sql():
+    """
+        Gives the table (or sub query) of the spectra, with the columns point, band_nr, and value (one row per band of
+        each point), to be used in a FROM clause. If the spectra are stored as arrays in 'point_spectrum', they are
+        unnested, and named 'spectrum', so that the same queries work for both layouts.
+    :return:    Either 'spectrum', or a sub query of 'point_spectrum' that is named 'spectrum'.
+    :rtype:     str
+    """
+    if get_point_spectrum():
+        return "(SELECT point_spectrum.point, bands.band_nr::int AS band_nr, bands.value " \
+               "FROM point_spectrum, unnest(point_spectrum.bands) WITH ORDINALITY AS bands(value, band_nr)) AS spectrum"
+    return "spectrum"
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""
+Finds the nearest neighbors of points in this process, instead of with a query to the database (and its <-> operator)
+for each point. The locations, and spectra of the points are loaded once, and the locations are put into a KD-tree if
+SciPy is available, or into a grid (see Common.spatial.GridIndex) otherwise.
+"""
+from __future__ import division
+
+__author__ = 'Sindre Nistad'
+
+import numpy as np
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+from Common.settings import get_extended_point
+from Common.spatial import GridIndex
+from Database.connector import get_spectra, _neighbor_dataset_sql
+from Database.database_definition import db
+from Database.session import session
+from RegionOfInterest.region import BasePoint
+
+"""
+The average number of points in each cell of the grid, when the grid is used instead of a KD-tree
+"""
+POINTS_PER_CELL = 4
+
+
+class NeighborIndex(object):
+    """
+    An index of the locations of a set of points that answers k-nearest neighbor, and radius queries for many
+    locations at the time, and that holds the spectra of the points as a single band matrix. The distances are the
+    same as those of the <-> operator on long_lat, i.e. Euclidean in (longitude, latitude).
+    """
+
+    def __init__(self, ids, longitudes, latitudes, region_ids=None, dataset_ids=None, bands=None, use_tree=True):
+        """
+            Creates an index of the given points.
+        :param ids:         The ids of the points.
+        :param longitudes:  The longitudes of the points.
+        :param latitudes:   The latitudes of the points.
+        :param region_ids:  The ids of the regions of the points. Default is -1 for all of them.
+        :param dataset_ids: The ids of the datasets of the points. Default is -1 for all of them.
+        :param bands:       The (number of points, number of bands) matrix of the spectra of the points. Default is
+                            None; the neighbors have no spectra.
+        :param use_tree:    Toggles whether or not a KD-tree is used, if SciPy is available. If not, a grid is used.
+                            Default is True.
+        :type ids:          np.ndarray | list of [int]
+        :type longitudes:   np.ndarray | list of [float]
+        :type latitudes:    np.ndarray | list of [float]
+        :type region_ids:   np.ndarray | list of [int]
+        :type dataset_ids:  np.ndarray | list of [int]
+        :type bands:        np.ndarray
+        :type use_tree:     bool
+        """
+        self.ids = np.asarray(ids, dtype=np.int64)
+        """ :type : np.ndarray """
+        self.longitudes = np.asarray(longitudes, dtype=np.float64)
+        """ :type : np.ndarray """
+        self.latitudes = np.asarray(latitudes, dtype=np.float64)
+        """ :type : np.ndarray """
+        self.region_ids = np.full(len(self.ids), -1, dtype=np.int64) if region_ids is None else \
+            np.asarray(region_ids, dtype=np.int64)
+        """ :type : np.ndarray """
+        self.dataset_ids = np.full(len(self.ids), -1, dtype=np.int64) if dataset_ids is None else \
+            np.asarray(dataset_ids, dtype=np.int64)
+        """ :type : np.ndarray """
+        self.bands = np.zeros((len(self.ids), 0)) if bands is None else bands
+        """ :type : np.ndarray """
+        self.tree = None
+        self.grid = None
+        if use_tree and cKDTree is not None:
+            self.tree = cKDTree(np.column_stack((self.longitudes, self.latitudes)))
+        else:
+            self.grid = GridIndex(self.longitudes, self.latitudes, self._get_cell_size())
+
+    def _get_cell_size(self):
+        """
+            The size of the cells of the grid, so that there are about POINTS_PER_CELL points in each cell.
+        """
+        if len(self) < 2:
+            return 1.0
+        area = np.ptp(self.longitudes) * np.ptp(self.latitudes)
+        if area == 0:
+            # The points are on a line
+            return max(np.ptp(self.longitudes), np.ptp(self.latitudes)) * POINTS_PER_CELL / len(self) or 1.0
+        return np.sqrt(area * POINTS_PER_CELL / len(self))
+
+    def query(self, longitudes, latitudes, k):
+        """
+            Finds the k nearest points to each of the given locations.
+        :param longitudes:  The longitudes of the locations.
+        :param latitudes:   The latitudes of the locations.
+        :param k:           The number of points to find for each location.
+        :type longitudes:   np.ndarray | list of [float]
+        :type latitudes:    np.ndarray | list of [float]
+        :type k:            int
+        :return:            A (number of locations, k) matrix of the indices of the points, sorted by their distance to
+                            the location, and a matrix of the distances. If there are fewer than k points, the rest of
+                            the indices are -1, and the distances are inf.
+        :rtype:             (np.ndarray, np.ndarray)
+        """
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        if self.grid is not None:
+            return self.grid.k_nearest(longitudes, latitudes, k)
+        if k <= 0 or len(longitudes) == 0:
+            return np.full((len(longitudes), max(k, 0)), -1, dtype=np.int64), \
+                np.full((len(longitudes), max(k, 0)), np.inf)
+        distances, indices = self.tree.query(np.column_stack((longitudes, latitudes)), k=k)
+        distances = np.asarray(distances, dtype=np.float64).reshape(len(longitudes), k)
+        indices = np.asarray(indices, dtype=np.int64).reshape(len(longitudes), k)
+        # The tree gives the number of points as the index, when there are too few points
+        indices[indices >= len(self)] = -1
+        return indices, distances
+
+    def query_radius(self, longitudes, latitudes, radius):
+        """
+            Finds the points within the given radius of each of the given locations.
+        :param longitudes:  The longitudes of the locations.
+        :param latitudes:   The latitudes of the locations.
+        :param radius:      The largest distance between a location, and a point.
+        :type longitudes:   np.ndarray | list of [float]
+        :type latitudes:    np.ndarray | list of [float]
+        :type radius:       float
+        :return:            The indices of the points of each location, sorted by their distance to the location, and
+                            the distances.
+        :rtype:             (list of [np.ndarray], list of [np.ndarray])
+        """
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        if self.grid is not None:
+            return self.grid.within(longitudes, latitudes, radius)
+        indices = []
+        distances = []
+        for i, found in enumerate(self.tree.query_ball_point(np.column_stack((longitudes, latitudes)), radius)):
+            found = np.asarray(found, dtype=np.int64)
+            found_distances = np.hypot(self.longitudes[found] - longitudes[i], self.latitudes[found] - latitudes[i])
+            order = np.argsort(found_distances, kind='mergesort')
+            indices.append(found[order])
+            distances.append(found_distances[order])
+        return indices, distances
+
+    def get_nearest_neighbors(self, points, k):
+        """
+            Does the same as Database.connector.get_nearest_neighbor_to_points, for the points in the index; returns
+            the k nearest neighbors of each of the given points, and the point itself, if it is in the index.
+        :param points:  The points we are interested in finding the nearest neighbors to.
+        :param k:       The number of nearest neighbors we want to find.
+        :type points:   list of [RegionOfInterest.region.BasePoint]
+        :type k:        int
+        :return:        One list of k + 1 points for each of the given points, sorted as the lists of
+                        get_nearest_neighbor_to_points.
+        :rtype:         list of [list of [RegionOfInterest.region.BasePoint]]
+        """
+        indices, _ = self.query([point.longitude for point in points], [point.latitude for point in points], k + 1)
+        return [self.get_points(row[row >= 0]) for row in indices]
+
+    def get_neighbors_within(self, points, radius):
+        """
+            Returns the points in the index within the given radius of each of the given points.
+        :param points:  The points we are interested in finding the neighbors of.
+        :param radius:  The largest distance between a point, and its neighbors.
+        :type points:   list of [RegionOfInterest.region.BasePoint]
+        :type radius:   float
+        :return:        One list of points for each of the given points, sorted as the lists of
+                        get_nearest_neighbor_to_points.
+        :rtype:         list of [list of [RegionOfInterest.region.BasePoint]]
+        """
+        indices, _ = self.query_radius([point.longitude for point in points], [point.latitude for point in points],
+                                       radius)
+        return [self.get_points(row) for row in indices]
+
+    def get_points(self, indices):
+        """
+            Creates points of the given indices, whose bands are rows of the band matrix of the index.
+        :param indices: The indices of the points.
+        :type indices:  np.ndarray | list of [int]
+        :return:        The points, sorted by their location (as the neighborhoods from the database).
+        :rtype:         list of [RegionOfInterest.region.BasePoint]
+        """
+        points = [BasePoint(self.ids[i], self.latitudes[i], self.longitudes[i], self.bands[i],
+                            self.region_ids[i], self.dataset_ids[i]) for i in indices]
+        points.sort()
+        return points
+
+    def get_bands(self, indices):
+        """
+            The spectra of the given points.
+        :param indices: The indices of the points, e.g. a matrix given by query.
+        :type indices:  np.ndarray
+        :return:        The spectra, with one more dimension than the indices.
+        :rtype:         np.ndarray
+        """
+        return self.bands[indices]
+
+    def __len__(self):
+        return len(self.ids)
+
+
+@session
+def load_neighbor_index(dataset="", ignore_dataset=False, load_bands=True, use_tree=True):
+    """
+        Loads the locations (and spectra) of the points in the given dataset(s) from the database into a NeighborIndex.
+    :param dataset:         The dataset(s) the points are to be from, with the same meaning as in
+                            Database.connector.get_nearest_neighbors_to_point. Default is every dataset.
+    :param ignore_dataset:  Toggles whether or not the datasets are ignored, i.e. the points of every dataset are loaded.
+                            Default is False.
+    :param load_bands:      Toggles whether or not the spectra of the points are loaded as well. Default is True.
+    :param use_tree:        Toggles whether or not a KD-tree is used, if SciPy is available. Default is True.
+    :type dataset:          list of [str] | str
+    :type ignore_dataset:   bool
+    :type load_bands:       bool
+    :type use_tree:         bool
+    :return:                An index of the points.
+    :rtype:                 NeighborIndex
+    """
+    if get_extended_point():
+        select_sql = "SELECT id, long_lat[0], long_lat[1], region, dataset FROM extended_point"
+    else:
+        select_sql = "SELECT point.id, point.long_lat[0], point.long_lat[1], point.region, dataset.id " \
+                     "FROM point, region, dataset " \
+                     "WHERE point.region = region.id AND region.dataset = dataset.id "
+    dataset_sql, params = "", {}
+    if dataset != "":
+        dataset_sql, params = _neighbor_dataset_sql(select_sql, dataset, ignore_dataset)
+    rows = db.execute(select_sql + dataset_sql + ";", params).fetchall()
+    columns = np.array(rows, dtype=np.float64).reshape(len(rows), 5)
+    ids = columns[:, 0].astype(np.int64)
+    bands = get_spectra(ids) if load_bands else None
+    return NeighborIndex(ids, columns[:, 1], columns[:, 2], columns[:, 3], columns[:, 4], bands, use_tree)
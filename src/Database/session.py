@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+Sessions of the database that are opened once by a long-running operation (e.g. sampling, finding neighbors,
+exporting, or adding data), and reused by everything it calls, instead of every function opening its own. The number
+of sessions that are open at the same time (i.e. of connections in use) is bounded, and the number of sessions, and
+transactions of each operation is counted.
+"""
+from __future__ import division
+
+__author__ = 'Sindre Nistad'
+
+from functools import wraps
+from threading import BoundedSemaphore, Lock, local
+from timeit import default_timer
+
+from pony.orm import db_session
+
+from Database.database_definition import db
+
+"""
+The largest number of sessions (and thereby connections) that are open at the same time in this process. Callers
+beyond that wait until a session is closed.
+"""
+POOL_SIZE = 8
+
+_pool = BoundedSemaphore(POOL_SIZE)
+_state = local()
+_counters = {}
+_counters_lock = Lock()
+
+
+class _Session(object):
+    """
+    The context of a session. The outermost session of a thread acquires a place in the pool, and opens a db_session;
+    the sessions within it reuse that db_session, and are counted as part of the outermost one.
+    """
+
+    def __init__(self, name=""):
+        """
+        :param name:    The name of the operation the session is counted for, if it is the outermost one.
+        :type name:     str
+        """
+        self.name = name
+        """ :type : str """
+
+    def __enter__(self):
+        depth = getattr(_state, 'depth', 0)
+        if depth == 0:
+            _pool.acquire()
+            try:
+                db_session.__enter__()
+            except Exception:
+                _pool.release()
+                raise
+            _state.name = self.name or "session"
+            _state.start = default_timer()
+            _count('sessions')
+        else:
+            _count('reused')
+        _state.depth = depth + 1
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        _state.depth -= 1
+        if _state.depth > 0:
+            return False
+        try:
+            # Commits, or rolls back the transaction of the session
+            db_session.__exit__(exc_type, exc_val, exc_tb)
+        finally:
+            _count('transactions')
+            _count('seconds', default_timer() - _state.start)
+            _state.name = None
+            _pool.release()
+        return False
+
+
+def session(name=""):
+    """
+        Opens a session that is reused by every function in it, either as a context (with session('name'): ...), or as
+        a decorator (@session), in which case the operation is named after the function.
+    :param name:    The name of the operation, or the function to be decorated.
+    :type name:     str | function
+    :return:        The context of the session, or the decorated function.
+    :rtype:         _Session | function
+    """
+    if callable(name):
+        function = name
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with _Session(function.__name__):
+                return function(*args, **kwargs)
+        return wrapper
+    return _Session(name)
+
+
+def commit():
+    """
+        Commits the transaction of the current session (as db.commit), and counts it.
+    :return:    None
+    :rtype:     None
+    """
+    db.commit()
+    _count('transactions')
+
+
+def set_pool_size(size):
+    """
+        Sets the largest number of sessions that are open at the same time. Should not be called while sessions are
+        open.
+    :param size:    The size of the pool.
+    :type size:     int
+    :return:        None
+    :rtype:         None
+    """
+    global _pool, POOL_SIZE
+    POOL_SIZE = size
+    _pool = BoundedSemaphore(size)
+
+
+def get_counters(name=None):
+    """
+        Gives the number of sessions that were opened ('sessions'), the number of times a session was reused by an
+        inner function ('reused'), the number of transactions that were committed, or ended ('transactions'), and the
+        time spent in the sessions ('seconds') of each operation.
+    :param name:    The name of the operation. Default is every operation.
+    :type name:     str
+    :return:        The counters of the operation, or a dictionary of the counters of each operation.
+    :rtype:         dict of [str, int | float] | dict of [str, dict of [str, int | float]]
+    """
+    with _counters_lock:
+        if name is not None:
+            return dict(_counters.get(name, _new_counters()))
+        return dict([(key, dict(value)) for key, value in _counters.items()])
+
+
+def reset_counters():
+    """
+        Sets all the counters to 0.
+    :return:    None
+    :rtype:     None
+    """
+    with _counters_lock:
+        _counters.clear()
+
+
+def _new_counters():
+    return {'sessions': 0, 'reused': 0, 'transactions': 0, 'seconds': 0.0}
+
+
+def _count(counter, value=1):
+    """
+        Adds the value to the given counter of the operation of the current session (or 'other', if there is none).
+    """
+    name = getattr(_state, 'name', None) or "other"
+    with _counters_lock:
+        if name not in _counters:
+            _counters[name] = _new_counters()
+        _counters[name][counter] += value
@@ -4,6 +4,12 @@ Misc. functions for exporting, and importing data to the different structures us
 """
 from __future__ import division
 
+from multiprocessing import Pool
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from timeit import default_timer
+
 from RegionOfInterest.regions_of_interest import RegionsOfInterest
 from Database.connector import roi_to_database
 
@@ -31,18 +37,37 @@ def get_file_list(normalized=False):
         return ["".join([prefix, itm, extension]) for itm in targets]
 
 
-def get_all_rois(normalized=True, read_data=False):
+def get_all_rois(normalized=True, read_data=False, workers=1):
     """
         Makes all the regions of interest from the different files, and returns them in a list
     :param normalized:  Toggles whether or not the output is normalized or not. Default is True.
     :param read_data:   Toggles whether or not the data will be loaded at creation or not.
+    :param workers:     The number of processes used to read, and normalize the files. If more than 1, and the data is
+                        to be read, each file is parsed in its own process, and handed back as a binary cache (see
+                        RegionsOfInterest.save_to_cache), so the points are not pickled between the processes. The
+                        caches are read into memory, and deleted. Default is 1.
     :type normalized:   bool
     :type read_data:    bool
+    :type workers:      int
     :return:            All the regions of interest that are given by the files.
     :rtype:             list of [RegionsOfInterest]
     """
     files = get_file_list()
     normalized_file = get_file_list(True)
+    if workers > 1 and read_data:
+        cache_folder = mkdtemp(prefix='rois_')
+        tasks = [(files[i], normalized_file[i], normalized, join(cache_folder, str(i))) for i in range(len(files))]
+        try:
+            rois = []
+            for cache_path in _map(_load_to_cache, tasks, workers):
+                roi = RegionsOfInterest(cache_path, read_data=False)
+                # The arrays are read into memory, rather than mapped, so that the files can be deleted (a mapped
+                # file can not be deleted on every platform)
+                roi.load_cache(cache_path, mmap_mode=None)
+                rois.append(roi)
+            return rois
+        finally:
+            rmtree(cache_folder, ignore_errors=True)
     return [
         RegionsOfInterest(files[i],
                           normalizing_path=normalized_file[i],
@@ -65,65 +90,174 @@ def get_roi(i, normalized=False):
     return RegionsOfInterest(files[i], normalizing_path=normalized_file[i], normalize=normalized)
 
 
-def export_to_pickle():
+def export_to_pickle(workers=1):
     """
         Exports all the rois to their own pickled file
+    :param workers: The number of processes used to read, normalize, and pickle the files. Default is 1.
+    :type workers:  int
     :return:    Nothing, but the files.
     :rtype:     None
     """
-    rois = get_all_rois()
-    for roi in rois:
-        print("Now processing " + roi.path)
-        # Gets the original file-name without the extension
-        name = roi.path.split("/")[-1].split(".")[0]
-        roi.save_to_file("".join([name, ".pkl"]))
+    files = get_file_list()
+    normalized_file = get_file_list(True)
+    tasks = [(files[i], normalized_file[i]) for i in range(len(files))]
+    _map(_export_file_to_pickle, tasks, workers)
 
 
-def export_to_csv(delimiter=",", normalized=True):
+def export_to_csv(delimiter=",", normalized=True, workers=1):
     """
         Exports all the rois to CSV
     :param delimiter:   The delimiter to be used. Default is ','
     :param normalized:  Toggles whether or not the rois will be normalized, or not. Default is True.
+    :param workers:     The number of processes used to read, normalize, and export the files. Default is 1.
     :type delimiter:    str
     :type normalized:   bool
+    :type workers:      int
     :return:            Does not return anything, but creates csv files.
     :rtype:             None
     """
-    rois = get_all_rois(normalized=normalized)
-    for roi in rois:
-        roi.save_to_csv(delimiter)
+    files = get_file_list()
+    normalized_file = get_file_list(True)
+    tasks = [(files[i], normalized_file[i], normalized, delimiter) for i in range(len(files))]
+    _map(_export_file_to_csv, tasks, workers)
 
 
-def export_to_postgres(add_wavelengths=False, debug=False, start_index=0, force_load=False):
+def _map(function, tasks, workers=1):
+    """
+        Applies the function to each of the tasks, either in this process, or in a pool of 'workers' processes.
+    :param function:    A (module level) function that takes a single task.
+    :param tasks:       The arguments to the function.
+    :param workers:     The number of processes. If 1 or less, the tasks are done in this process.
+    :type function:     function
+    :type tasks:        list of [tuple]
+    :type workers:      int
+    :return:            The results of the function, in the same order as the tasks.
+    :rtype:             list
+    """
+    if workers <= 1 or len(tasks) <= 1:
+        return [function(task) for task in tasks]
+    pool = Pool(min(workers, len(tasks)))
+    try:
+        # One file per task, as the files are few, and large.
+        return pool.map(function, tasks, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _load_to_cache(task):
+    """
+        Reads, and normalizes a single file, and saves it as a binary cache.
+    :param task:    The path to the ROI file, the path to its normalizing data, whether or not the data is to be
+                    normalized, and the folder of the cache.
+    :type task:     (str, str, bool, str)
+    :return:        The folder of the cache.
+    :rtype:         str
+    """
+    path, normalizing_path, normalized, cache_path = task
+    roi = RegionsOfInterest(path, normalizing_path=normalizing_path, normalize=normalized)
+    roi.save_to_cache(cache_path)
+    return cache_path
+
+
+def _export_file_to_pickle(task):
+    """
+        Reads, and normalizes a single file, and pickles it to a file in the current folder.
+    :param task:    The path to the ROI file, and the path to its normalizing data.
+    :type task:     (str, str)
+    :return:        None
+    :rtype:         None
+    """
+    path, normalizing_path = task
+    print("Now processing " + path)
+    roi = RegionsOfInterest(path, normalizing_path=normalizing_path)
+    # Gets the original file-name without the extension
+    name = roi.path.split("/")[-1].split(".")[0]
+    roi.save_to_file("".join([name, ".pkl"]))
+
+
+def _export_file_to_csv(task):
+    """
+        Reads, and normalizes a single file, and saves it as CSV.
+    :param task:    The path to the ROI file, the path to its normalizing data, whether or not the data is to be
+                    normalized, and the delimiter.
+    :type task:     (str, str, bool, str)
+    :return:        None
+    :rtype:         None
+    """
+    path, normalizing_path, normalized, delimiter = task
+    roi = RegionsOfInterest(path, normalizing_path=normalizing_path, normalize=normalized)
+    roi.save_to_csv(delimiter)
+
+
+def export_to_postgres(add_wavelengths=False, debug=False, start_index=0, force_load=False, workers=1, bulk=False):
     """
        This is a wrapper method for loading the regions of interest into the database.
     :param add_wavelengths: Toggle whether or not information about wavelengths is to be added. Default is False,
-                            as it takes quite a while, and is not strictly necessary.
+                            as it is not strictly necessary.
     :param debug:           Toggle whether or not debug information is to be written to the console. Default is False
     :param start_index:     Which dataset are we to start at? Default is 0.
     :param force_load:      Toggle whether or not the actual data in the regions of interest is to be read.
                             Default is False
+    :param workers:         The number of processes that add datasets at the same time, each with its own connection,
+                            and transactions. The datasets (and wavelengths) are created by this process first, so that
+                            the processes do not create the same ones, and each process adds the regions of its own
+                            datasets, which are then always read. Default is 1.
+    :param bulk:            Toggles whether or not the points are added in bulk (see roi_to_database). Default is False.
     :type add_wavelengths:  bool
     :type debug:            bool
     :type start_index:      int
     :type force_load:       bool
-    :return:
+    :type workers:          int
+    :type bulk:             bool
+    :return:                The name, number of points, and time (in seconds) of each dataset.
+    :rtype:                 list of [(str, int, float)]
     """
-    if debug:
-        n = len(get_all_rois(read_data=False))
-        i = 0
-    rois = get_all_rois(read_data=False)
-    for roi in rois[start_index:]:
-        # print("Now loading the dataset located at " + roi.path)
-        # roi.load_data()
-        # print("Loading complete. Now exporting to database.")
-        roi_to_database(roi, add_wavelengths=add_wavelengths, debug=debug, force_load=force_load)
-        if debug:
-            i += 1
-            print("NOW " + str(i / n * 100) + "% COMPLETE")
-        print("Data committed to the database.")
-        print("Deleting region to save memory; these files can be huge")
-        del roi
-
-    # TODO: Implement
-    pass
+    from Database.connector import connect, disconnect, prepare_dataset
+
+    files = get_file_list()[start_index:]
+    normalized_file = get_file_list(True)[start_index:]
+    start = default_timer()
+    if workers > 1 and len(files) > 1:
+        connect()
+        for path in files:
+            prepare_dataset(path, add_wavelengths)
+        # The processes must not share the connection of this process
+        disconnect()
+        force_load = True
+    tasks = [(files[i], normalized_file[i], add_wavelengths, debug, force_load, bulk) for i in range(len(files))]
+    results = _map(_export_file_to_postgres, tasks, workers)
+    total_time = default_timer() - start
+
+    total_points = sum([num_points for _, num_points, _ in results])
+    print("Added " + str(total_points) + " points from " + str(len(results)) + " datasets in " +
+          str(total_time) + " s (" + str(total_points / total_time) + " points/s) with " + str(workers) + " workers")
+    for name, num_points, seconds in results:
+        print("    " + name + ": " + str(num_points) + " points in " + str(seconds) + " s")
+    return results
+
+
+def _export_file_to_postgres(task):
+    """
+        Reads a single file, and adds its regions of interest to the database, with its own connection.
+    :param task:    The path to the ROI file, the path to its normalizing data, and add_wavelengths, debug,
+                    force_load, and bulk (see roi_to_database).
+    :type task:     (str, str, bool, bool, bool, bool)
+    :return:        The name of the dataset, the number of points that were read, and the time it took (in seconds).
+    :rtype:         (str, int, float)
+    """
+    from Database.connector import connect
+    from Database.database_definition import db
+
+    path, normalizing_path, add_wavelengths, debug, force_load, bulk = task
+    start = default_timer()
+    if db.provider is None:
+        # A new process (when they are spawned, rather than forked)
+        connect()
+    roi = RegionsOfInterest(path, read_data=False, normalizing_path=normalizing_path, normalize=False)
+    roi_to_database(roi, add_wavelengths=add_wavelengths, debug=debug, force_load=force_load, bulk=bulk)
+    num_points = sum([len(region) for region in roi.get_all()])
+    seconds = default_timer() - start
+    name = path.split("/")[-1].split(".")[0]
+    print("Data committed to the database: " + name + " (" + str(num_points) + " points in " + str(seconds) + " s)")
+    return name, num_points, seconds
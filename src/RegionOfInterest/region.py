@@ -4,7 +4,23 @@ from __future__ import print_function
 __author__ = 'Sindre Nistad'
 
 from warnings import warn
-from Common.common import strip_and_add_space, list_to_string
+
+import numpy as np
+
+from Common.common import strip_and_add_space, list_to_string, open_text_file
+from Common.spatial import morton_order, hilbert_order
+
+"""
+The rows of the location array of an array backed region of interest.
+"""
+LOCATION_FIELDS = ['identity', 'X', 'Y', 'map_X', 'map_Y', 'latitude', 'longitude']
+
+"""
+The number of points that are formatted, and written at the time when exporting to CSV (see ROI.write_csv), and the
+format of each value.
+"""
+CSV_CHUNK_SIZE = 10000
+CSV_FORMAT = '%.10g'
 
 
 class ROI(object):
@@ -12,18 +28,26 @@ class ROI(object):
     A class to store the information of a single region of interest, along with some handy methods.
     """
 
-    def __init__(self, name, sub_name, rgb, num_points, points=None):
+    def __init__(self, name, sub_name, rgb, num_points, points=None, locations=None, bands=None):
         """
             A object to hold the information on a region of interest.
+            The points can either be given as a list of Point objects, or as arrays; a (7, n) array of locations, and a
+            (n, number of bands) array of bands. In the latter case, the Point objects are created when they are first
+            accessed, and their bands are views into the band array.
         :param name:        The full name of the region of interest.
         :param rgb:         The rgb color of the region, as given by the ROI file
         :param num_points:  The number of points that are in the region
         :param points:      A list of the actual points of the region. If no points are given, an empty list is created.
+        :param locations:   Optional:   The rows ID, X, Y, map X, map Y, latitude, and longitude of the points
+                                        (in that order). See LOCATION_FIELDS.
+        :param bands:       Optional:   The bands of the points, one row per point.
 
         :type name:         str
         :type rgb:          list of [int]
         :type num_points:   int
         :type points:       list of [Point]
+        :type locations:    np.ndarray
+        :type bands:        np.ndarray
 
         :return:
         """
@@ -37,35 +61,227 @@ class ROI(object):
         """ :type : int """
         self.sorted_mode = ""
         """ :type: str """
-        if points is None:
-            self.points = []
-            """ :type : list[Point] """
+        self.locations = None
+        """ :type : np.ndarray """
+        self.bands = None
+        """ :type : np.ndarray """
+        self._points = None
+        """ :type : list[Point] """
+        self._order = None
+        """ :type : np.ndarray """
+        self._orders = {}
+        """ :type : dict of [(str, str, str), np.ndarray] """
+        if locations is not None and bands is not None:
+            self.set_arrays(locations, bands)
+        elif points is None:
+            self._points = []
+        else:
+            self._points = points
+
+    @property
+    def points(self):
+        """
+            The points of the region. If the region is backed by arrays, the points are created on the first access.
+        :rtype: list of [Point]
+        """
+        if self._points is None:
+            self._points = self._create_points()
+        return self._points
+
+    @points.setter
+    def points(self, points):
+        self._points = points
+        self.locations = None
+        self.bands = None
+        self._clear_orders()
+
+    def set_arrays(self, locations, bands):
+        """
+            Makes the region backed by the given arrays. Any points that have been created earlier are discarded.
+        :param locations:   The rows ID, X, Y, map X, map Y, latitude, and longitude of the points (in that order).
+        :param bands:       The bands of the points, one row per point.
+        :type locations:    np.ndarray
+        :type bands:        np.ndarray
+        :return:            None
+        :rtype:             None
+        """
+        assert locations.shape[0] == len(LOCATION_FIELDS) and locations.shape[1] == bands.shape[0]
+        self.locations = locations
+        self.bands = bands
+        self._points = None
+        self._clear_orders()
+
+    def to_arrays(self, dtype=np.float64, num_bands=0):
+        """
+            Makes the region backed by arrays that are built from its points. The points are kept, and their bands
+            become views into the band array. Does nothing if the region already is backed by arrays.
+        :param dtype:       The type of the band array. Default is float64.
+        :param num_bands:   The number of bands, which is used for the band array of a region without points.
+                            Default is 0.
+        :type dtype:        type
+        :type num_bands:    int
+        :return:            None
+        :rtype:             None
+        """
+        if self.is_array_backed():
+            return
+        points = self.points
+        locations = np.array([[getattr(point, field) for point in points] for field in LOCATION_FIELDS],
+                             dtype=np.float64).reshape(len(LOCATION_FIELDS), len(points))
+        if len(points) == 0:
+            bands = np.empty((0, num_bands), dtype=dtype)
         else:
-            self.points = points
-            """ :type : list[Point] """
+            bands = np.array([point.bands for point in points], dtype=dtype).reshape(len(points), -1)
+        self.set_arrays(locations, bands)
+        for i in range(len(points)):
+            points[i].bands = bands[i]
+        self._points = points
+
+    def is_array_backed(self):
+        """
+            Checks if the points of this region are stored in arrays.
+        :return:    True if the points are stored in arrays, False if they are (only) stored as a list of Points.
+        :rtype:     bool
+        """
+        return self.bands is not None
+
+    def get_location(self, field):
+        """
+            Gets all the values of the given field (e.g. 'X', or 'latitude') for the points in the region.
+        :param field:   The name of the field. See LOCATION_FIELDS.
+        :type field:    str
+        :return:        An array with one value per point.
+        :rtype:         np.ndarray
+        """
+        if self.is_array_backed():
+            return self.locations[LOCATION_FIELDS.index(field)]
+        return np.array([getattr(point, field) for point in self.points])
+
+    def get_band_matrix(self):
+        """
+            Gets the bands of all the points as a single (number of points, number of bands) matrix. If the region is
+            backed by arrays, the matrix itself is returned (not a copy).
+        :return:    The bands of the region, one row per point.
+        :rtype:     np.ndarray
+        """
+        if self.is_array_backed():
+            return self.bands
+        return np.array([point.bands for point in self.points], dtype=np.float64)
+
+    def _create_points(self):
+        """
+            Creates the Point objects from the arrays of this region.
+        :return:    A list of the points in the region, or an empty list if the region is not backed by arrays.
+        :rtype:     list of [Point]
+        """
+        if not self.is_array_backed():
+            return []
+        identities, xs, ys, map_xs, map_ys, latitudes, longitudes = self.locations.tolist()
+        bands = self.bands
+        return [Point(identities[i], xs[i], ys[i], map_xs[i], map_ys[i], latitudes[i], longitudes[i], bands[i])
+                for i in range(bands.shape[0])]
+
+    def _reorder(self, order):
+        """
+            Reorders the points of the array backed region in place, so that point i becomes the point order[i]. Points
+            that have already been created, are kept, and their bands are moved along with them.
+        :param order:   A permutation of the indices of the points.
+        :type order:    np.ndarray
+        :return:        None
+        :rtype:         None
+        """
+        self.locations[:] = self.locations[:, order]
+        self.bands[:] = self.bands[order]
+        if self._points is not None:
+            points = [self._points[i] for i in order]
+            for i in range(len(points)):
+                points[i].bands = self.bands[i]
+            self._points = points
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self.is_array_backed():
+            # The points can be recreated from the arrays
+            state['_points'] = None
+        return state
+
+    def __setstate__(self, state):
+        if 'points' in state:
+            # Pickled before the regions could be backed by arrays
+            state['_points'] = state.pop('points')
+        state.setdefault('locations', None)
+        state.setdefault('bands', None)
+        state.setdefault('_order', None)
+        state.setdefault('_orders', {})
+        self.__dict__.update(state)
 
     def sort(self, mode):
         """
             A method to sort the points according to x-y coordinates relative to the (actual) image, or relative to the
             map coordinates, or the points can be sorted according to latitude, and longitude.
-            The points are first sorted by x/latitude, and then by y/longitude.
-        :param mode:    The mode of sorting. Can be 'map', 'lat-long', or 'x-y'.
+            The points are either sorted lexicographically; first by x/latitude, and then by y/longitude, or along a
+            space-filling curve, so that points that are near each other are (mostly) near each other in the region,
+            e.g. 'morton' (or 'z-order'), or 'hilbert', which are over x-y, or 'morton-lat-long', 'hilbert-map', etc.
+            The order of each mode is only computed once, so changing back and forth between modes only moves the
+            points.
+        :param mode:    The mode of sorting. Can be 'map', 'lat-long', or 'x-y', optionally preceded by 'morton-', or
+                        'hilbert-'.
         :type mode:     str
         :return:        None
         :rtype:         None
         """
-        if mode == 'map':
-            expression = lambda p: (p.map_X, p.map_Y)
-        elif mode == 'lat-long' or mode == 'latitude-longitude' or mode == 'latlong':
-            expression = lambda p: (p.latitude, p.longitude)
-        elif mode == 'xy' or mode == 'x-y':
-            expression = lambda p: (p.X, p.Y)
-        else:
+        curve, fields = _sort_parameters(mode)
+        if fields is None:
             warn("No valid mode selected")
             return -1
-        self.points = sorted(self.points, key=expression)
+        if self._order is not None and len(self._order) != len(self):
+            # Points have been added since the orders were computed
+            self._clear_orders()
+        key = (curve,) + fields
+        if key not in self._orders:
+            x = self.get_location(fields[0])
+            y = self.get_location(fields[1])
+            if curve == 'morton':
+                order = morton_order(x, y)
+            elif curve == 'hilbert':
+                order = hilbert_order(x, y)
+            else:
+                # np.lexsort sorts by the last key first
+                order = np.lexsort((y, x))
+            # The orders are stored relative to the original order of the points
+            self._orders[key] = order if self._order is None else self._order[order]
+        target = self._orders[key]
+        if self._order is None:
+            self._apply_order(target)
+        else:
+            position = np.empty(len(self._order), dtype=np.int64)
+            position[self._order] = np.arange(len(self._order))
+            self._apply_order(position[target])
+        self._order = target
         self.sorted_mode = mode
 
+    def _apply_order(self, order):
+        """
+            Reorders the points, so that point i becomes the point order[i].
+        :param order:   A permutation of the indices of the points.
+        :type order:    np.ndarray
+        :return:        None
+        :rtype:         None
+        """
+        if self.is_array_backed():
+            self._reorder(order)
+        else:
+            self._points = [self._points[i] for i in order]
+
+    def _clear_orders(self):
+        """
+            Forgets the orders of the sort modes, e.g. when the points are changed.
+        :return:    None
+        :rtype:     None
+        """
+        self._order = None
+        self._orders = {}
+
     def add_point(self, point):
         """
             Adds the given point to the list of points in the region of interest.
@@ -74,49 +290,104 @@ class ROI(object):
         :return:        None
         :rtype:         None
         """
-        self.points.append(point)
+        # The arrays can not grow, so the region is only backed by the list of points from now on. The orders of the
+        # sort modes are forgotten by sort, once the points have been added.
+        points = self.points
+        self.locations = None
+        self.bands = None
+        points.append(point)
         self.sorted_mode = ""  # Because the points are likely to be in some disorder after adding one or more points.
 
-    def export_to_csv(self, return_val=False, delimiter=",", path=None):
+    def export_to_csv(self, return_val=False, delimiter=",", path=None, compress=False):
         """
             Creates a 'CSV' file where all the information in the ROI object is stored.
-            Format: "NAME, SUB_NAME, (R, G, B), ID, X, Y, MAP_X, MAP_Y, LATITUDE, LONGITUDE, BAND 1, ..., BAND n"
+            Format: "NAME, SUB_NAME, R, G, B, ID, X, Y, MAP_X, MAP_Y, LATITUDE, LONGITUDE, BAND 1, ..., BAND n"
         :param return_val:  Toggles, whether or not the function is return the string, or save it to a file. The
                             default is to save it to a file.
         :param delimiter:   What character the values are separated by. Default is ','
         :param path:        The path to the file in which the values are to be stored. If the path is not given, it
-                            will store the file as "NAME_SUB_NAME.csv"
+                            will store the file as "NAME_SUB_NAME.csv" (or "NAME_SUB_NAME.csv.gz" if compressed)
+        :param compress:    Toggles whether or not the file is gzip-compressed. Default is False.
         :type delimiter:    str
         :type path:         str
         :type return_val:   bool
+        :type compress:     bool
         :return:            If return_val is set to False, the method returns nothing, instead it writes it to a file.
                             If return_val is set to True, it returns a string of what would have been written to file.
         :rtype:             None | str
 
         """
-        delimiter = strip_and_add_space(delimiter)
-        if not return_val:
-            if path is not None:
-                file_name = path
-            else:
-                file_name = self.name + "_" + self.sub_name + ".csv"
-            f = open(file_name, 'w')
-        result_string = ""
-        pre = self.name + delimiter + self.sub_name + delimiter + str(self.rgb[0]) + delimiter + \
-              str(self.rgb[2]) + delimiter + str(self.rgb[2]) + delimiter
-        for point in self.points:
-            prefix = pre + str(point.identity) + delimiter + str(point.X) + delimiter + str(point.Y) + delimiter + \
-                     str(point.map_X) + delimiter + str(point.map_Y) + delimiter + \
-                     str(point.latitude) + delimiter + str(point.longitude)
-
-            point_string = prefix + delimiter + point.get_bands_as_string(delimiter) + '\n'
-            result_string += point_string
         if return_val:
-            return result_string
+            return "".join(self._get_csv_chunks(delimiter, CSV_CHUNK_SIZE))
+        if path is not None:
+            file_name = path
         else:
-            print(result_string, file=f)
+            file_name = self.name + "_" + self.sub_name + ".csv"
+            if compress:
+                file_name += ".gz"
+        with open_text_file(file_name, compress) as f:
+            self.write_csv(f, delimiter)
+
+    def write_csv(self, output, delimiter=",", chunk_size=CSV_CHUNK_SIZE):
+        """
+            Writes the points of the region to the given (open) file, one line per point, on the form given in
+            export_to_csv. The points are formatted, and written 'chunk_size' points at the time, so the time is linear
+            in the number of points, and the memory does not depend on it.
+        :param output:      The file (or other object with a write method) the lines are written to.
+        :param delimiter:   What character the values are separated by. Default is ','
+        :param chunk_size:  The number of points that are written at the time. Default is CSV_CHUNK_SIZE.
+        :type output:       file
+        :type delimiter:    str
+        :type chunk_size:   int
+        :return:            None
+        :rtype:             None
+        """
+        for chunk in self._get_csv_chunks(delimiter, chunk_size):
+            output.write(chunk)
+
+    def _get_csv_chunks(self, delimiter, chunk_size):
+        """
+            Formats the lines of the points (see write_csv) 'chunk_size' points at the time. The lines are formatted
+            here, rather than by numpy.savetxt, so that they are (native) strings on both Python 2, and 3.
+        :param delimiter:   What character the values are separated by.
+        :param chunk_size:  The number of points that are formatted at the time.
+        :type delimiter:    str
+        :type chunk_size:   int
+        :return:            A generator of the lines of each chunk of points.
+        :rtype:             generator of [str]
+        """
+        delimiter = strip_and_add_space(delimiter)
+        prefix = delimiter.join([self.name, self.sub_name] + [str(color) for color in self.rgb]) + delimiter
+        row_format = None
+        for start in range(0, len(self), chunk_size):
+            rows = np.hstack(self._get_rows(start, start + chunk_size))
+            if row_format is None:
+                # The prefix is written as is, so it must not be mistaken for a format
+                row_format = prefix.replace('%', '%%') + delimiter.join([CSV_FORMAT] * rows.shape[1]) + '\n'
+            yield "".join([row_format % tuple(row) for row in rows])
+
+    def _get_rows(self, start, end):
+        """
+            Gets the locations, and the bands of the points start to end, as a (n, 7), and a (n, number of bands)
+            matrix, without creating Point objects for an array backed region.
+        :param start:   The index of the first point.
+        :param end:     The index after the last point.
+        :type start:    int
+        :type end:      int
+        :return:        The locations, and the bands of the points.
+        :rtype:         (np.ndarray, np.ndarray)
+        """
+        if self.is_array_backed():
+            return self.locations[:, start:end].T, self.bands[start:end]
+        points = self.points[start:end]
+        locations = np.array([[getattr(point, field) for field in LOCATION_FIELDS] for point in points],
+                             dtype=np.float64)
+        bands = np.array([point.bands for point in points], dtype=np.float64).reshape(len(points), -1)
+        return locations, bands
 
     def __len__(self):
+        if self._points is None and self.is_array_backed():
+            return self.bands.shape[0]
         return len(self.points)
 
 
@@ -140,11 +411,42 @@ def select_params(mode='x-y'):
     return x_param, y_param
 
 
+def _sort_parameters(mode):
+    """
+        Gives the curve ('lexicographic', 'morton', or 'hilbert'), and the two fields the points are sorted on in the
+        given mode of ROI.sort.
+    :param mode:    The mode of sorting, e.g. 'x-y', or 'hilbert-lat-long'.
+    :type mode:     str
+    :return:        The curve, and the fields, which are None if the mode is not valid.
+    :rtype:         (str, (str, str))
+    """
+    curve = 'lexicographic'
+    for prefix, name in (('morton', 'morton'), ('z-order', 'morton'), ('hilbert', 'hilbert')):
+        if mode == prefix:
+            return name, ('X', 'Y')
+        elif mode.startswith(prefix + '-'):
+            curve = name
+            mode = mode[len(prefix) + 1:]
+            break
+    if mode == 'map':
+        fields = ('map_X', 'map_Y')
+    elif mode == 'lat-long' or mode == 'latitude-longitude' or mode == 'latlong':
+        fields = ('latitude', 'longitude')
+    elif mode == 'xy' or mode == 'x-y':
+        fields = ('X', 'Y')
+    else:
+        fields = None
+    return curve, fields
+
+
 class BasePoint(object):
     """
     Stores the information (location) of a single point along with the spectral bands. This is a 'simple' point that
-    only has id, longitude, and latitude, as well as the spectrum
+    only has id, longitude, and latitude, as well as the spectrum.
+    The attributes are slots (there is no __dict__ per point), and the bands are usually a view into a shared NumPy
+    matrix (one row per point), as there may be hundreds of thousands of points in memory.
     """
+    __slots__ = ('identity', 'latitude', 'longitude', 'bands', 'region_id', 'dataset_id')
 
     def __init__(self, identity, latitude, longitude, bands, region_id=-1, dataset_id=-1):
         """
@@ -152,7 +454,7 @@ class BasePoint(object):
         :param identity:    An id, unique to the ROI polygon at creation in ENVI. Not used
         :param latitude:    The absolute latitude of the point.
         :param longitude:   The absolute longitude of the point.
-        :param bands:       A list of the different spectral bands for the point.
+        :param bands:       The different spectral bands for the point, e.g. a row of a band matrix.
         :param region_id:   Optional:   The id for the region the point belongs to. Default is -1, indicating that it
                                         has not been set.
         :param dataset_id:  Optional:   The id for the dataset the point belongs to. Default is -1, indicating that it
@@ -160,7 +462,7 @@ class BasePoint(object):
         :type identity:     int
         :type latitude:     float
         :type longitude:    float
-        :type bands:        list[float]
+        :type bands:        np.ndarray | list[float]
         :type region_id:    int
         :type dataset_id:   int
         :return:
@@ -176,7 +478,7 @@ class BasePoint(object):
         self.longitude = longitude
         """ :type : float """
         self.bands = bands
-        """ :type : list[float] """
+        """ :type : np.ndarray | list[float] """
         self.region_id = region_id
         """ :type : int """
         self.dataset_id = dataset_id
@@ -229,6 +531,20 @@ class BasePoint(object):
     def __eq__(self, other):
         return (self.longitude, self.latitude) == (other.longitude, other.latitude)
 
+    def __getstate__(self):
+        # There is no __dict__ to pickle, as the attributes are slots
+        state = {}
+        for cls in type(self).__mro__:
+            for name in getattr(cls, '__slots__', ()):
+                if hasattr(self, name):
+                    state[name] = getattr(self, name)
+        return state
+
+    def __setstate__(self, state):
+        # Also restores points that were pickled before they had slots
+        for name, value in state.items():
+            setattr(self, name, value)
+
         # def __repr__(self):
         #     return self.__str__()
         #
@@ -239,6 +555,7 @@ class Point(BasePoint):
     """
     More specific information is stored, such as relative image location and such
     """
+    __slots__ = ('X', 'Y', 'map_X', 'map_Y', 'name', 'sub_name')
 
     def __init__(self, identity, x, y, map_x, map_y, latitude, longitude, bands, name="", sub_name="",
                  region_id=-1, dataset_id=-1):
@@ -251,7 +568,7 @@ class Point(BasePoint):
         :param map_y:       The y coordinate in the map.
         :param latitude:    The absolute latitude of the point.
         :param longitude:   The absolute longitude of the point.
-        :param bands:       A list of the different spectral bands for the point.
+        :param bands:       The different spectral bands for the point, e.g. a row of a band matrix.
         :param name:        Optional:   The name of the region the point belongs to.
         :param sub_name:    Optional:   The sub-name of the region the point belongs to.
         :param region_id:   Optional:   The id for the region the point belongs to. Default is -1, indicating that it
@@ -265,7 +582,7 @@ class Point(BasePoint):
         :type map_y:        float
         :type latitude:     float
         :type longitude:    float
-        :type bands:        list[float]
+        :type bands:        np.ndarray | list[float]
         :type name:         str
         :type sub_name:     str
         :type region_id:    int
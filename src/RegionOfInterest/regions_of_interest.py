@@ -4,12 +4,27 @@ Classes and methods for reading, and interpreting the data from a ASCII ROI file
 """
 __author__ = 'Sindre Nistad'
 
+from copy import copy
+from json import dump as json_dump, load as json_load
+from os import makedirs
+from os.path import isdir, join
 from pickle import dump, load, HIGHEST_PROTOCOL
 
-from Common.common import get_histogram, extract_name, list_to_string
-from Common.data_management import read_data_from_file, read_normalizing_data
-from RegionOfInterest.region import ROI
+import numpy as np
+
+from Common.common import get_histogram, extract_name, list_to_string, open_text_file
+from Common.data_management import read_data_from_file, read_normalizing_data, get_region_index, \
+    read_region_from_file, compute_statistics
+from RegionOfInterest.region import ROI, LOCATION_FIELDS
 from Common.common import strip_and_add_space, is_min_max, is_gaussian
+from Common.statistics import BandStatistics
+
+"""
+The files of a binary cache (see RegionsOfInterest.save_to_cache).
+"""
+CACHE_MANIFEST = 'manifest.json'
+CACHE_LOCATIONS = 'locations.npy'
+CACHE_BANDS = 'bands.npy'
 
 
 class RegionsOfInterest(object):
@@ -17,13 +32,14 @@ class RegionsOfInterest(object):
         A holder/structure for the ROI file, as given by ENVI (in ASCII format)
     """
     def __init__(self, path, read_data=True, use_aggregate=True,
-                 normalizing_path=None, mode='min-max', normalize=True, is_normalized=False):
+                 normalizing_path=None, mode='min-max', normalize=True, is_normalized=False, columnar=True,
+                 dtype=None, use_statistics=False):
         """
             Creates a RegionsOfInterest object, which is a collection of region on interest, each having a
             number of points in it. The default is to read the data at creation, and to use the aggregate
             name of the regions, e.g. 'rock' instead of 'rock_23'.
-        :param path:                The path to either the ROI text file, or an already pickled RegionsOfInterest
-                                    object.
+        :param path:                The path to either the ROI text file, an already pickled RegionsOfInterest
+                                    object, or a binary cache (a folder) made by save_to_cache.
         :param read_data:           Decides whether or not the data is to be read when the new RegionsOfInterest object
                                     is created. The default is to read at creation.
         :param use_aggregate:       Decides whether or not you can refer to a region by its general name,
@@ -34,6 +50,14 @@ class RegionsOfInterest(object):
         :param mode:                The mode of how the data is to be normalized.
         :param normalize:           Toggles whether or not the data will be normalized. Default is True.
         :param is_normalized:       Specify whether or not the input data is normalized or not. The default is not.
+        :param columnar:            Toggles whether or not the points are stored in contiguous arrays; one matrix for
+                                    all the bands, and one for the locations, with the Point objects of each region
+                                    being created when they are first accessed. Default is True.
+        :param dtype:               The type the bands are converted to when they are normalized, e.g. numpy.float32 to
+                                    halve the memory. Default is None; the type is not changed.
+        :param use_statistics:      Toggles whether or not the data is normalized by the statistics of the bands that
+                                    are computed while the file is read (see get_statistics), instead of the data in
+                                    normalizing_path. Default is False.
         :type path:                 str
         :type read_data:            bool
         :type use_aggregate:        bool
@@ -41,6 +65,9 @@ class RegionsOfInterest(object):
         :type mode:                 str
         :type normalize:            bool
         :type is_normalized:        bool
+        :type columnar:             bool
+        :type dtype:                type
+        :type use_statistics:       bool
         """
         self.path = path
         """ :type : list of [str] """
@@ -62,6 +89,8 @@ class RegionsOfInterest(object):
         """ :type : bool """
         self.is_normalized = is_normalized
         """ :type : bool """
+        self.normalizing_mode = ""
+        """ :type : str """
         self.maximums = []
         """ :type : list[float] """
         self.minimums = []
@@ -70,17 +99,33 @@ class RegionsOfInterest(object):
         """ :type : list[float] """
         self.standard_deviations = []
         """ :type : list[float] """
+        self.statistics = None
+        """ :type : BandStatistics """
         self.is_loaded = False
         """ :type : bool """
+        self.columnar = columnar
+        """ :type : bool """
+        self.locations = None
+        """ :type : np.ndarray """
+        self.bands = None
+        """ :type : np.ndarray """
+        self.offsets = None
+        """ :type : np.ndarray """
+        self.region_keys = []
+        """ :type : list of [(str, str)] """
 
         if read_data:
             ending = self.path.split('.')[-1]
-            if ending == 'pkl' or ending == 'pickle':
+            if isdir(self.path):
+                self.load_cache(path)
+            elif ending == 'pkl' or ending == 'pickle':
                 self.load_roi_object(path)
             else:
                 self._load_data_from_file()
-        if normalizing_path is not None:
-            self._load_normalizing_data(normalizing_path, mode, normalize)
+        if use_statistics:
+            self.set_normalizing_data(self.get_statistics(), mode, normalize, dtype)
+        elif normalizing_path is not None:
+            self._load_normalizing_data(normalizing_path, mode, normalize, dtype)
 
     def load_data(self):
         """
@@ -97,21 +142,30 @@ class RegionsOfInterest(object):
         :return:    None
         :rtype:     None
         """
-        data = read_data_from_file(self.path)
+        data = read_data_from_file(self.path, bulk=self.columnar)
+        if self.columnar:
+            self.locations = data['locations']
+            self.bands = data['bands']
+            self.offsets = data['offsets']
+            self.region_keys = data['region_keys']
+            self.statistics = data['statistics']
         self.rois = data['rois']
+        self.is_loaded = True
         self.number_of_rois = data['number_of_rois']
         self.meta = data['meta']
         self.img_dim = data['img_dim']
         self.band_info = data['band_info']
         self.num_bands = data['num_bands']
 
-    def _load_normalizing_data(self, path, mode, normalize=True):
+    def _load_normalizing_data(self, path, mode, normalize=True, dtype=None):
         """
             Loads the data so that normalizing is possible, and then normalizes the data
         :param path:    The path to where the normalizing data is located
         :param mode:    What kind of normalizing should be done.
+        :param dtype:   The type the bands are converted to when normalized. Default is None; no conversion.
         :type path:     str
         :type mode:     str
+        :type dtype:    type
         :return:        None
         :rtype:         None
         """
@@ -121,7 +175,49 @@ class RegionsOfInterest(object):
         self.means = data['means']
         self.standard_deviations = data['standard_deviations']
         if normalize:
-            self.normalize(mode)
+            self.normalize(mode, dtype)
+
+    def get_statistics(self):
+        """
+            Gives the minimum, maximum, mean, and standard deviation of each band of the (raw) data. These are computed
+            in the same pass as the file is read, when the data is columnar. Otherwise, they are computed from the
+            loaded data, or streamed from the file, if the data is not loaded.
+        :return:    The statistics of the bands.
+        :rtype:     BandStatistics
+        """
+        if self.statistics is None:
+            if not self.is_loaded:
+                self.statistics = compute_statistics(self.path)
+            elif self.is_normalized:
+                raise Exception("The statistics of the raw data can not be computed from normalized data")
+            else:
+                self.statistics = BandStatistics()
+                for bands in self._get_band_matrices():
+                    self.statistics.update(bands)
+        return self.statistics
+
+    def set_normalizing_data(self, statistics, mode='min-max', normalize=True, dtype=None):
+        """
+            Uses the given statistics as the normalizing data (instead of a normalizing file), and then normalizes the
+            data. The statistics of several files may be merged (see BandStatistics.merge), so that they are
+            normalized in the same way.
+        :param statistics:  The statistics of the bands.
+        :param mode:        What kind of normalizing should be done.
+        :param normalize:   Toggles whether or not the data will be normalized. Default is True.
+        :param dtype:       The type the bands are converted to when normalized. Default is None; no conversion.
+        :type statistics:   BandStatistics
+        :type mode:         str
+        :type normalize:    bool
+        :type dtype:        type
+        :return:            None
+        :rtype:             None
+        """
+        self.maximums = statistics.maximum.tolist()
+        self.minimums = statistics.minimum.tolist()
+        self.means = statistics.mean.tolist()
+        self.standard_deviations = statistics.get_standard_deviation().tolist()
+        if normalize:
+            self.normalize(mode, dtype)
 
     def load_roi_object(self, path):
         """
@@ -140,6 +236,14 @@ class RegionsOfInterest(object):
         self.num_bands = roi.num_bands
         self.use_aggregate = roi.use_aggregate
         self.is_normalized = roi.is_normalized
+        self.normalizing_mode = roi.normalizing_mode
+        self.columnar = roi.columnar
+        self.locations = roi.locations
+        self.bands = roi.bands
+        self.offsets = roi.offsets
+        self.region_keys = roi.region_keys
+        self.statistics = roi.statistics
+        self.is_loaded = True
 
     def set_aggregate(self, val):
         """
@@ -153,13 +257,14 @@ class RegionsOfInterest(object):
 
     def sort(self, mode):
         """
-            Sorts all the regions of interest according to the give mode, which may be 'x-y', 'map', or 'lat-long'.
+            Sorts all the regions of interest according to the give mode, which may be 'x-y', 'map', or 'lat-long', or
+            one of these along a space-filling curve, e.g. 'hilbert-x-y' (see ROI.sort).
         :param mode:    What parameters do we sort on?
         :type mode:     str
         :return:        None
         :rtype:         None
         """
-        for roi in self.rois:
+        for roi in self.get_all():
             roi.sort(mode)
 
     def get_histogram(self):
@@ -176,23 +281,143 @@ class RegionsOfInterest(object):
 
     def save_to_file(self, filename):
         """
-            Pickles the entire object to the specified file.
+            Saves the entire object to the specified file. If the file name ends with '.pkl', or '.pickle', the object
+            is pickled, otherwise it is saved as a binary cache (see save_to_cache).
         :param filename:    The full name of the path/file name of the desired output file.
         :type filename:     str
         :return:            None
         :rtype:             None
         """
-        with open(filename, 'wb') as output:
-            dump(self, output, HIGHEST_PROTOCOL)
+        ending = filename.split('.')[-1]
+        if ending == 'pkl' or ending == 'pickle':
+            with open(filename, 'wb') as output:
+                dump(self, output, HIGHEST_PROTOCOL)
+        else:
+            self.save_to_cache(filename)
 
-    def save_to_csv(self, delimiter=",", path=None):
+    def save_to_cache(self, path):
+        """
+            Saves the object as a binary cache in the folder 'path'; the locations, and the bands of all the points are
+            stored as two .npy files, and everything else (meta data, band info, image dimensions, normalizing data, and
+            the index of the regions) in a small JSON manifest.
+            The cache is opened with load_cache, or by giving the folder as the path of a new RegionsOfInterest object.
+        :param path:    The path to the folder of the cache. It is created if it does not exist.
+        :type path:     str
+        :return:        None
+        :rtype:         None
+        """
+        if not isdir(path):
+            makedirs(path)
+        if self.region_keys:
+            rois = [self.rois[name][sub_name] for name, sub_name in self.region_keys]
+        else:
+            rois = self.get_all()
+        num_points = sum([len(roi) for roi in rois])
+        locations = np.lib.format.open_memmap(join(path, CACHE_LOCATIONS), mode='w+', dtype=np.float64,
+                                              shape=(len(LOCATION_FIELDS), num_points))
+        band_matrices = [roi.get_band_matrix() for roi in rois if len(roi) > 0]
+        num_bands = band_matrices[0].shape[1] if band_matrices else self.num_bands
+        dtype = band_matrices[0].dtype if band_matrices else np.float64
+        bands = np.lib.format.open_memmap(join(path, CACHE_BANDS), mode='w+', dtype=dtype,
+                                          shape=(num_points, num_bands))
+        regions = []
+        start = 0
+        for roi in rois:
+            end = start + len(roi)
+            if end > start:
+                locations[:, start:end] = np.array([roi.get_location(field) for field in LOCATION_FIELDS])
+                bands[start:end] = roi.get_band_matrix()
+            regions.append({'name': roi.name,
+                            'sub_name': roi.sub_name,
+                            'rgb': [float(color) for color in roi.rgb],
+                            'num_points': roi.num_points,
+                            'start': start,
+                            'end': end})
+            start = end
+        locations.flush()
+        bands.flush()
+        del locations, bands
+
+        manifest = {'path': self.path,
+                    'meta': self.meta,
+                    'number_of_rois': self.number_of_rois,
+                    'img_dim': [int(dim) for dim in self.img_dim],
+                    'band_info': self.band_info,
+                    'num_bands': int(num_bands),
+                    'use_aggregate': self.use_aggregate,
+                    'is_normalized': self.is_normalized,
+                    'normalizing_mode': self.normalizing_mode,
+                    'maximums': [float(value) for value in self.maximums],
+                    'minimums': [float(value) for value in self.minimums],
+                    'means': [float(value) for value in self.means],
+                    'standard_deviations': [float(value) for value in self.standard_deviations],
+                    'statistics': self.statistics.to_dict() if self.statistics is not None else None,
+                    'regions': regions}
+        with open(join(path, CACHE_MANIFEST), 'w') as output:
+            json_dump(manifest, output)
+
+    def load_cache(self, path, mmap_mode='c'):
+        """
+            Loads a binary cache made by save_to_cache into this object. The arrays are memory-mapped, so nothing is
+            read from disk before the points are accessed, and then only the pages that are touched.
+        :param path:        The path to the folder of the cache.
+        :param mmap_mode:   The mode of the memory-map (see numpy.memmap). The default is 'c' (copy-on-write), so that the
+                            data can be changed (e.g. normalized) without changing the cache. Use 'r' for read-only,
+                            'r+' to write changes back to the cache, or None to read the arrays into memory, so that the
+                            cache may be deleted.
+        :type path:         str
+        :type mmap_mode:    str
+        :return:            None
+        :rtype:             None
+        """
+        with open(join(path, CACHE_MANIFEST), 'r') as manifest_file:
+            manifest = json_load(manifest_file)
+        self.path = manifest['path']
+        self.meta = manifest['meta']
+        self.number_of_rois = manifest['number_of_rois']
+        self.img_dim = manifest['img_dim']
+        self.band_info = manifest['band_info']
+        self.num_bands = manifest['num_bands']
+        self.use_aggregate = manifest['use_aggregate']
+        self.is_normalized = manifest['is_normalized']
+        self.normalizing_mode = manifest['normalizing_mode']
+        self.maximums = manifest['maximums']
+        self.minimums = manifest['minimums']
+        self.means = manifest['means']
+        self.standard_deviations = manifest['standard_deviations']
+        self.statistics = None
+        if manifest.get('statistics') is not None:
+            self.statistics = BandStatistics.from_dict(manifest['statistics'])
+        self.columnar = True
+        self.locations = np.load(join(path, CACHE_LOCATIONS), mmap_mode=mmap_mode)
+        self.bands = np.load(join(path, CACHE_BANDS), mmap_mode=mmap_mode)
+        self.rois = {}
+        self.region_keys = []
+        offsets = [0]
+        for region in manifest['regions']:
+            start, end = region['start'], region['end']
+            roi = ROI(region['name'], region['sub_name'], region['rgb'], region['num_points'],
+                      locations=self.locations[:, start:end], bands=self.bands[start:end])
+            if roi.name not in self.rois:
+                self.rois[roi.name] = {}
+            self.rois[roi.name][roi.sub_name] = roi
+            self.region_keys.append((roi.name, roi.sub_name))
+            offsets.append(end)
+        self.offsets = np.array(offsets, dtype=np.int64)
+        self.is_loaded = True
+
+    def save_to_csv(self, delimiter=",", path=None, compress=False):
         """
             Saves all the information to a CSV file. (Two, if the data is normalized: one for the 'raw' data, and one
             for the normalizing data.
+            The regions are written in chunks (see ROI.write_csv), so the whole file is never held in memory.
         :param delimiter:   The delimiter to separate the data.
         :param path:        The path to where the CSV file is to be saved
+        :param compress:    Toggles whether or not the CSV file (of the data) is gzip-compressed, in which case '.gz'
+                            is added to the default path. Default is False.
         :type delimiter:    str
         :type path:         str
+        :type compress:     bool
         :return:            None
         :rtype:             None
         """
@@ -200,15 +425,17 @@ class RegionsOfInterest(object):
             path = self.path
             path = path.split(".")[0]
             path += ".csv"
-        f = open(path, 'w')
+            data_path = path + ".gz" if compress else path
+        else:
+            data_path = path
         delimiter = strip_and_add_space(delimiter)
         label = "Name" + delimiter + "sub_name" + delimiter + \
                 "Red" + delimiter + "Green" + delimiter + "Blue" + delimiter
         label += list_to_string(self.band_info, delimiter)
-        f.write(label + '\n')
-        for roi in self.get_all():
-            f.write(roi.export_to_csv(return_val=True, delimiter=delimiter))
-        f.close()
+        with open_text_file(data_path, compress) as f:
+            f.write(label + '\n')
+            for roi in self.get_all():
+                roi.write_csv(f, delimiter)
         if self.maximums is not None:
             f = open(path + '.norm.csv', 'w')
             meta = self.band_info[7:]
@@ -221,17 +448,23 @@ class RegionsOfInterest(object):
             f.write("Standard deviation" + delimiter + list_to_string(self.standard_deviations, delimiter) + '\n')
             f.close()
 
-    def normalize(self, mode='min-max'):
+    def normalize(self, mode='min-max', dtype=None):
         """
             Normalizes the data. Makes it simpler than the original normalize function, which takes a subtraction, and
             and a division parameter.
             The mode can be 'min-max', or gaussian.
         :param mode:    Specify the way the data can be normalized. At the moment, only min-max,
                         and gaussian normalization is supported.
+        :param dtype:   The type the bands are converted to before they are normalized, e.g. numpy.float32. Default is
+                        None; the type is not changed. NB: Points that have been created before a conversion are no
+                        longer views into the bands.
         :type mode:     str
+        :type dtype:    type
         :return:        None
         :rtype:         None
         """
+        if dtype is not None:
+            self._set_band_type(dtype)
         if is_min_max(mode):
             assert self.minimums is not None
             assert self.maximums is not None
@@ -253,13 +486,12 @@ class RegionsOfInterest(object):
         :return: None
         :rtype: None
         """
-        if not len(mean_param) == self.num_bands and len(std_dev_param) == self.num_bands:
+        if self.is_loaded and not (len(mean_param) == self.num_bands and len(std_dev_param) == self.num_bands):
             raise Exception("The input parameters does not match the bands in the ROIs")
-        for roi in self.get_all():
-            for point in roi.points:
-                for i in range(self.num_bands):
-                    point.bands[i] = (point.bands[i] - mean_param[i]) / std_dev_param[i]
+        for bands in self._get_band_matrices():
+            _normalize_bands(bands, mean_param, std_dev_param)
         self.is_normalized = True
+        self.normalizing_mode = 'gaussian'
 
     def _normalize_min_max(self, min_param, max_param):
         """
@@ -273,13 +505,13 @@ class RegionsOfInterest(object):
         :return: None
         :rtype: None
         """
-        if not len(min_param) == self.num_bands and len(max_param) == self.num_bands:
+        if self.is_loaded and not (len(min_param) == self.num_bands and len(max_param) == self.num_bands):
             raise Exception("The input parameters does not match the bands in the ROIs")
-        for roi in self.get_all():
-            for point in roi.points:
-                for i in range(self.num_bands):
-                    point.bands[i] = (point.bands[i] - min_param[i]) / (max_param[i] - min_param[i])
+        scale = np.asarray(max_param, dtype=np.float64) - np.asarray(min_param, dtype=np.float64)
+        for bands in self._get_band_matrices():
+            _normalize_bands(bands, min_param, scale)
         self.is_normalized = True
+        self.normalizing_mode = 'min-max'
 
     def absolutize(self, mode='min-max'):
         """
@@ -296,6 +528,7 @@ class RegionsOfInterest(object):
         else:
             raise NotImplementedError("Only min-max, and gaussian reversed normalize has been implemented")
         self.is_normalized = False
+        self.normalizing_mode = ""
 
     def _absolutize_min_max(self):
         """
@@ -305,10 +538,9 @@ class RegionsOfInterest(object):
         """
         if not self.is_normalized:
             raise Exception("The data has to be normalized, if you want to revert the normalization!")
-        for roi in self.rois:
-            for point in roi.points:
-                for i in range(self.num_bands):
-                    point.bands[i] = point.bands[i] * (self.maximums[i] - self.minimums[i] ) + self.minimums[i]
+        scale = np.asarray(self.maximums, dtype=np.float64) - np.asarray(self.minimums, dtype=np.float64)
+        for bands in self._get_band_matrices():
+            _absolutize_bands(bands, self.minimums, scale)
 
     def _abolutize_gaussian(self):
         """
@@ -318,10 +550,51 @@ class RegionsOfInterest(object):
         """
         if not self.is_normalized:
             raise Exception("The data has to be normalized, if you want to revert the normalization!")
-        for roi in self.rois:
-            for point in roi.points:
-                for i in range(self.num_bands):
-                    point.bands[i] = point.bands[i] * self.standard_deviations[i] + self.means[i]
+        for bands in self._get_band_matrices():
+            _absolutize_bands(bands, self.means, self.standard_deviations)
+
+    def _get_band_matrices(self):
+        """
+            Gets the band matrices that together hold the bands of all the points; the matrix of this object (if any),
+            and the matrices of the regions that are not views into it. Regions that are only backed by a list of
+            points are made array backed (see ROI.to_arrays).
+        :return:    A list of (number of points, number of bands) matrices.
+        :rtype:     list of [np.ndarray]
+        """
+        matrices = []
+        if self.bands is not None:
+            matrices.append(self.bands)
+        for roi in self.get_all():
+            if not roi.is_array_backed():
+                roi.to_arrays(num_bands=self.num_bands)
+            elif self.bands is not None and np.may_share_memory(roi.bands, self.bands):
+                continue
+            if len(roi.bands) > 0:
+                matrices.append(roi.bands)
+        return matrices
+
+    def _set_band_type(self, dtype):
+        """
+            Converts all the bands to the given type. The regions are made views into the converted arrays, so any
+            points that have already been created, are discarded.
+        :param dtype:   The new type of the bands, e.g. numpy.float32.
+        :type dtype:    type
+        :return:        None
+        :rtype:         None
+        """
+        if self.bands is not None and self.bands.dtype != dtype:
+            bands = self.bands.astype(dtype)
+            for i in range(len(self.region_keys)):
+                name, sub_name = self.region_keys[i]
+                roi = self.rois[name][sub_name]
+                if roi.is_array_backed() and np.may_share_memory(roi.bands, self.bands):
+                    roi.set_arrays(roi.locations, bands[self.offsets[i]:self.offsets[i + 1]])
+            self.bands = bands
+        for roi in self.get_all():
+            if not roi.is_array_backed():
+                roi.to_arrays(dtype, self.num_bands)
+            elif roi.bands.dtype != dtype:
+                roi.set_arrays(roi.locations, roi.bands.astype(dtype))
 
     def get_all(self, force_load=False):
         """
@@ -339,7 +612,105 @@ class RegionsOfInterest(object):
                 roi_list.append(self.rois[key][sub_key])
         return roi_list
 
+    def _bind_regions(self):
+        """
+            Makes the regions of interest that are not backed by their own arrays, or by a list of points, views into
+            the arrays of this object.
+        :return:    None
+        :rtype:     None
+        """
+        if self.bands is None:
+            return
+        for i in range(len(self.region_keys)):
+            name, sub_name = self.region_keys[i]
+            roi = self.rois[name][sub_name]
+            if roi._points is None and not roi.is_array_backed():
+                start, end = self.offsets[i], self.offsets[i + 1]
+                roi.set_arrays(self.locations[:, start:end], self.bands[start:end])
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self.bands is not None:
+            # The regions that are views into the arrays of this object are pickled without their arrays, and are
+            # bound to the arrays again when loaded, so that the points are not stored twice.
+            rois = {}
+            for name in self.rois.keys():
+                rois[name] = {}
+                for sub_name in self.rois[name].keys():
+                    roi = self.rois[name][sub_name]
+                    if roi.is_array_backed() and np.may_share_memory(roi.bands, self.bands):
+                        roi = copy(roi)
+                        roi.locations = None
+                        roi.bands = None
+                    rois[name][sub_name] = roi
+            state['rois'] = rois
+        return state
+
+    def __setstate__(self, state):
+        # Objects pickled before the arrays were added
+        state.setdefault('columnar', False)
+        state.setdefault('locations', None)
+        state.setdefault('bands', None)
+        state.setdefault('offsets', None)
+        state.setdefault('region_keys', [])
+        state.setdefault('normalizing_mode', "")
+        state.setdefault('statistics', None)
+        self.__dict__.update(state)
+        self._bind_regions()
+
+    def _get_from_index(self, item):
+        """
+            Reads the region(s) given by item straight from the ROI file, using the byte offsets in the index of the
+            file (see Common.data_management.get_region_index), without reading the rest of the file.
+        :param item:    The name of the region(s), e.g. 'soil', or 'soil_3' if use_aggregate is False.
+        :type item:     str
+        :return:        The region of interest. If use_aggregate is True, all the regions with the given name are
+                        combined into one.
+        :rtype:         ROI
+        """
+        index = get_region_index(self.path)
+        if self.use_aggregate:
+            regions = [region for region in index['regions'] if region['name'] == item]
+        else:
+            name, sub_name = extract_name(item)
+            regions = [region for region in index['regions']
+                       if region['name'] == name and region['sub_name'] == sub_name]
+        if not regions:
+            raise KeyError(item)
+        rois = [read_region_from_file(self.path, region) for region in regions]
+        if self.is_normalized:
+            for roi in rois:
+                self._normalize_region(roi)
+        if not self.use_aggregate:
+            return rois[0]
+        locations = np.concatenate([roi.locations for roi in rois], axis=1)
+        bands = np.concatenate([roi.bands for roi in rois])
+        return ROI(item, "", rois[-1].rgb, bands.shape[0], locations=locations, bands=bands)
+
+    def _normalize_region(self, roi):
+        """
+            Normalizes a single (array backed) region in the same way as this object has been normalized.
+        :param roi: The region to be normalized.
+        :type roi:  ROI
+        :return:    None
+        :rtype:     None
+        """
+        if is_min_max(self.normalizing_mode):
+            scale = np.asarray(self.maximums, dtype=np.float64) - np.asarray(self.minimums, dtype=np.float64)
+            _normalize_bands(roi.bands, self.minimums, scale)
+        elif is_gaussian(self.normalizing_mode):
+            _normalize_bands(roi.bands, self.means, self.standard_deviations)
+
     def __getitem__(self, item):
+        """
+            Gets the region(s) with the given name. If the data has not been loaded, the regions are read straight from
+            the file, without loading the rest of it.
+        :param item:    The name of the region(s), e.g. 'soil', or 'soil_3' if use_aggregate is False.
+        :type item:     str
+        :rtype:         ROI
+        """
+        if not self.is_loaded and not isdir(self.path) and self.path.split('.')[-1] not in ['pkl', 'pickle']:
+            return self._get_from_index(item)
         if self.use_aggregate:
             rois = self.rois[item]
             points = []
@@ -354,3 +725,35 @@ class RegionsOfInterest(object):
 
     def __len__(self):
         return len(self.rois)
+
+
+def _normalize_bands(bands, subtract, divide):
+    """
+        Normalizes the bands in place; (bands - subtract) / divide, for each band (column).
+    :param bands:       A (number of points, number of bands) matrix.
+    :param subtract:    The value to subtract from each band.
+    :param divide:      The value each band is divided by.
+    :type bands:        np.ndarray
+    :type subtract:     list of [float] | np.ndarray
+    :type divide:       list of [float] | np.ndarray
+    :return:            None
+    :rtype:             None
+    """
+    bands -= np.asarray(subtract, dtype=bands.dtype)
+    bands /= np.asarray(divide, dtype=bands.dtype)
+
+
+def _absolutize_bands(bands, add, multiply):
+    """
+        Reverts _normalize_bands in place; bands * multiply + add, for each band (column).
+    :param bands:       A (number of points, number of bands) matrix.
+    :param add:         The value that was subtracted from each band.
+    :param multiply:    The value each band was divided by.
+    :type bands:        np.ndarray
+    :type add:          list of [float] | np.ndarray
+    :type multiply:     list of [float] | np.ndarray
+    :return:            None
+    :rtype:             None
+    """
+    bands *= np.asarray(multiply, dtype=bands.dtype)
+    bands += np.asarray(add, dtype=bands.dtype)
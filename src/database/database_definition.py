@@ -11,6 +11,26 @@ from settings import DATABASE
 
 db = Database()
 
+"""
+The secondary indices that back the filters, joins, and nearest neighbor orderings (<->) of the queries in
+Database.connector, as (name, table, method, columns). The indices of a table are only created if the table exists,
+e.g. extended_point.
+"""
+INDEXES = [
+    ('spectrum_point_band_nr_idx', 'spectrum', 'btree', 'point, band_nr'),
+    ('spectrum_band_nr_idx', 'spectrum', 'btree', 'band_nr'),
+    ('point_region_idx', 'point', 'btree', 'region'),
+    ('point_long_lat_idx', 'point', 'gist', 'long_lat'),
+    ('region_name_sub_name_idx', 'region', 'btree', 'name, sub_name'),
+    ('region_dataset_idx', 'region', 'btree', 'dataset'),
+    ('dataset_type_idx', 'dataset', 'btree', 'type'),
+    ('extended_point_id_idx', 'extended_point', 'btree', 'id'),
+    ('extended_point_long_lat_idx', 'extended_point', 'gist', 'long_lat'),
+    ('extended_point_name_sub_name_idx', 'extended_point', 'btree', 'name, sub_name'),
+    ('extended_point_dataset_idx', 'extended_point', 'btree', 'dataset'),
+    ('extended_point_type_idx', 'extended_point', 'btree', 'type'),
+]
+
 
 class Wavelengths(db.Entity):
     """Where the information about a specific band/or wavelength reside; band number,
@@ -121,7 +141,7 @@ def bind_database(check_tables=True, create_tables=False, **kwargs):
     db.generate_mapping(check_tables=check_tables, create_tables=create_tables)
 
 
-def create_database(overwrite=False, debug_sql=True, check_tables=True, create_tables=False):
+def create_database(overwrite=False, debug_sql=True, check_tables=True, create_tables=False, indexes=True):
     """
         Creates a database with the database settings from settings.py
     :param overwrite:       Toggle whether or not the database should be dropped, if it already exists. Default is
@@ -129,10 +149,13 @@ def create_database(overwrite=False, debug_sql=True, check_tables=True, create_t
     :param debug_sql:       Toggle debug_sql mode. Default is True.
     :param check_tables:    Sets the flag 'check_tables' for the generate_mapping method.
     :param create_tables:   Sets the flag 'create_tables' for the generate_mapping method.
+    :param indexes:         Toggle whether or not the secondary indices are created (see ensure_indexes). Default is
+                            True.
     :type overwrite:        bool
     :type debug_sql:        bool
     :type check_tables:     bool
     :type create_tables:    bool
+    :type indexes:          bool
     :return:                The database that has been generated
     :rtype:                 Database
     """
@@ -141,9 +164,75 @@ def create_database(overwrite=False, debug_sql=True, check_tables=True, create_t
     if overwrite:
         drop_tables(True)
     db.create_tables(check_tables=check_tables)
+    if indexes:
+        ensure_indexes()
     return db
 
 
+def ensure_indexes(debug=False):
+    """
+        Creates the indices in INDEXES that do not exist, rebuilds those that are not valid (e.g. after a failed
+        CREATE INDEX CONCURRENTLY), and updates the statistics of the tables, so that the planner uses them.
+    :param debug:   Toggles whether or not the indices, and their sizes are written to the console. Default is False.
+    :type debug:    bool
+    :return:        The size (in bytes) of each index.
+    :rtype:         dict of [str, int]
+    """
+    # Imported here, as Database.session imports this module
+    from Database.session import session, commit
+
+    with session('ensure_indexes'):
+        tables = set()
+        for name, table, method, columns in INDEXES:
+            if db.select("SELECT to_regclass($table) IS NOT NULL", {'table': table})[0]:
+                db.execute("CREATE INDEX IF NOT EXISTS " + name + " ON " + table + " USING " + method +
+                           " (" + columns + ");")
+                tables.add(table)
+        sizes = {}
+        for name, valid, size in _get_indexes():
+            if not valid:
+                db.execute("REINDEX INDEX " + name + ";")
+            sizes[name] = size
+        for table in tables:
+            db.execute("ANALYZE " + table + ";")
+        commit()
+    if debug:
+        for name, table, _, _ in INDEXES:
+            if name in sizes:
+                print(name + " on " + table + ": " + str(float(sizes[name]) / 1024 ** 2) + " MB")
+    return sizes
+
+
+def drop_indexes():
+    """
+        Drops the indices in INDEXES, e.g. to speed up adding a lot of data, or to compare the queries with, and
+        without them.
+    :return:    None
+    :rtype:     None
+    """
+    from Database.session import session, commit
+
+    with session('drop_indexes'):
+        for name, _, _, _ in INDEXES:
+            db.execute("DROP INDEX IF EXISTS " + name + ";")
+        commit()
+
+
+def _get_indexes():
+    """
+        Gives the indices in INDEXES that exist in the database.
+    :return:    The name of each index, whether or not it is valid, and its size (in bytes).
+    :rtype:     list of [(str, bool, int)]
+    """
+    sql = """
+        SELECT index_class.relname, pg_index.indisvalid, pg_relation_size(index_class.oid)
+        FROM pg_class AS index_class
+          JOIN pg_index ON pg_index.indexrelid = index_class.oid
+        WHERE index_class.relname = ANY($names);
+        """
+    return db.select(sql, {'names': [name for name, _, _, _ in INDEXES]})
+
+
 def drop_tables(are_you_sure=False):
     """
         Drops all the data in the database!
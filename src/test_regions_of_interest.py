@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+Tests that normalizing, and then absolutizing the regions of interest gives back the original bands.
+Run as 'python -m unittest test_regions_of_interest' from the source folder.
+"""
+__author__ = 'Sindre Nistad'
+
+import unittest
+from os import close, remove
+from tempfile import mkstemp
+
+import numpy as np
+
+from RegionOfInterest.regions_of_interest import RegionsOfInterest
+
+"""
+The regions (name, RGB value, and number of points) of the test file, and its number of bands. One of the regions is
+empty.
+"""
+REGIONS = [('soil_1', '{255, 0, 0}', 5), ('water_2', '{0, 0, 255}', 3), ('rock_3', '{0, 255, 0}', 0)]
+NUM_BANDS = 4
+
+
+def _write_roi_file(path, seed=0):
+    """
+        Writes a small ASCII ROI file (as given by ENVI) with random bands.
+    :param path:    The path to the file.
+    :param seed:    The seed of the random bands.
+    :type path:     str
+    :type seed:     int
+    :return:        None
+    :rtype:         None
+    """
+    generator = np.random.RandomState(seed)
+    lines = ["; ENVI Output of ROIs (4.8) [Thu Jan 01 00:00:00 2015]",
+             "; Number of ROIs: " + str(len(REGIONS)),
+             "; File Dimension: 16 x 16",
+             ";"]
+    for i in range(len(REGIONS)):
+        name, rgb, num_points = REGIONS[i]
+        lines += ["; ROI name: " + name, "; ROI rgb value: " + rgb, "; ROI npts: " + str(num_points)]
+        if i < len(REGIONS) - 1:
+            lines.append(";")
+    lines.append(";   ID    X    Y    Map X    Map Y    Lat    Lon    " +
+                 "    ".join(["B" + str(band + 1) for band in range(NUM_BANDS)]))
+    identity = 1
+    for name, rgb, num_points in REGIONS:
+        for _ in range(num_points):
+            location = [identity, identity % 16, identity // 16, 0.5 * identity, 0.25 * identity,
+                        34.0 + 0.001 * identity, -119.0 - 0.001 * identity]
+            bands = generator.uniform(100, 5000, NUM_BANDS)
+            lines.append(" ".join([repr(float(value)) for value in location + list(bands)]))
+            identity += 1
+        lines.append("")
+    with open(path, 'w') as f:
+        f.write("\n".join(lines) + "\n")
+
+
+class TestNormalizing(unittest.TestCase):
+
+    def setUp(self):
+        handle, self.path = mkstemp(suffix='.txt')
+        close(handle)
+        _write_roi_file(self.path)
+
+    def tearDown(self):
+        remove(self.path)
+
+    def _round_trip(self, mode, columnar, dtype=None):
+        """
+            Normalizes, and then absolutizes the regions of interest of the test file, and checks that the bands are
+            the same as before.
+        """
+        roi = RegionsOfInterest(self.path, columnar=columnar, use_statistics=True, normalize=False)
+        original = _get_bands(roi)
+        self.assertEqual(original.shape, (sum([region[2] for region in REGIONS]), NUM_BANDS))
+
+        roi.normalize(mode, dtype)
+        normalized = _get_bands(roi)
+        self.assertTrue(roi.is_normalized)
+        self.assertFalse(np.allclose(normalized, original))
+        if dtype is not None:
+            self.assertEqual(normalized.dtype, dtype)
+
+        roi.absolutize(mode)
+        self.assertFalse(roi.is_normalized)
+        if dtype is None:
+            self.assertTrue(np.allclose(_get_bands(roi), original))
+        else:
+            self.assertTrue(np.allclose(_get_bands(roi), original, rtol=1e-5, atol=1e-3))
+
+    def test_min_max(self):
+        self._round_trip('min-max', True)
+        self._round_trip('min-max', False)
+
+    def test_gaussian(self):
+        self._round_trip('gaussian', True)
+        self._round_trip('gaussian', False)
+
+    def test_min_max_float32(self):
+        self._round_trip('min-max', True, np.float32)
+        self._round_trip('min-max', False, np.float32)
+
+    def test_gaussian_float32(self):
+        self._round_trip('gaussian', True, np.float32)
+        self._round_trip('gaussian', False, np.float32)
+
+
+def _get_bands(roi):
+    """
+        The bands of all the points of the regions of interest (in the order of get_all), as a single matrix.
+    """
+    return np.vstack([region.get_band_matrix() for region in roi.get_all() if len(region) > 0])
+
+
+if __name__ == '__main__':
+    unittest.main()